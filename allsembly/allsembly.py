@@ -67,13 +67,17 @@ Get updates on the current state of the deliberation,
   of the truth value of sets of statements.
 """
 import logging
+import multiprocessing
+import queue
 from logging import Logger
 
 import transaction #type: ignore[import]
 import ZODB, ZODB.FileStorage #type: ignore[import]
+from ZODB.POSException import ConflictError #type: ignore[import]
+import ZEO #type: ignore[import]
 import rpyc #type: ignore[import]
 
-from typing import TextIO, Dict
+from typing import TextIO, Dict, Set, Tuple, Callable, Union
 #from queue import Queue
 import time
 from time import thread_time_ns
@@ -86,16 +90,18 @@ from typing_extensions import Final
 
 from allsembly.argument_graph import Issues, IssuesDBAccessor, build_ArgumentNode, build_PositionNode, ArgumentGraph
 from allsembly.speech_act import IndependentBid, MarketLocator
-from allsembly.betting_exchange import BettingMarket
-from allsembly.common import FinalVar
+from allsembly.betting_exchange import BettingMarket, CONTRACT_PRICE, \
+    LmsrMarketMaker
 from allsembly.config import Config
 from allsembly.config import Limits
+from allsembly.prob_logic import InferenceService
 from allsembly import CONSTANTS
 import threading
 from threading import Event
 
-from allsembly.rpyc_server import AllsemblyServices, GraphRequest, LedgerRequest, GraphUpdatePosQueue, \
-    OrderQueue, IssueQueue, GraphUpdateArgQueue, IssueDeleteDirective
+from allsembly.rpyc_server import AllsemblyServices, GraphRequest, LedgerRequest, \
+    Command, CommandQueue, AddArgument, AddPosition, PlaceOrder, PlaceAsk, \
+    DeleteIssue, ClearCallAuctions, IssuesRequest
 from allsembly.speech_act import ProOrCon, UnconcededPosition
 
 logger: Logger = logging.getLogger(__name__)
@@ -161,158 +167,464 @@ class ServerControl:
 #        self._should_exit: AtomicLong = AtomicLong(0)
 
 
-def process_one_argument_from_queue(issues: Issues,
-    graph_arg_queue: GraphUpdateArgQueue,
-    order_queue: OrderQueue) -> bool:
-    """ Return true if graph_arg_queue is not empty
-        after processing one item from the queue;
-        False otherwise
+def process_command(issues: Issues,
+                    command: Command,
+                    updated_issues: Optional[Set[Tuple[bytes, int]]] = None
+                    ) -> None:
+    """ Processes one command taken from the command queue.
+        If updated_issues is given, the id of the updated
+        issue is added to it, and the caller is responsible for
+        calling update_graph() on the issue's ArgumentGraph.
     """
-    if graph_arg_queue:
-        current_update = graph_arg_queue.popleft()
-        updating_user_userid = current_update[0]
-        update_issue = current_update[2]
-        new_arg = current_update[3]
-
-        new_arg_node = build_ArgumentNode(updating_user_userid,
-                         new_arg.pro_or_con is ProOrCon.PRO,
-                         new_arg.target_position.pos_id
-                         )
-
-        if issues.graphs.has_key(update_issue):
-            for i, p in enumerate(new_arg.premises):
-                same_as_list: List[int]
-                statement: str
-                if isinstance(p, UnconcededPosition):
-                    existing_position = issues.graphs[update_issue]\
-                                              .get_position_copy(
-                                                  p.pos_id
-                                               )
-                    same_as_list = list(existing_position.same_as)
-                    same_as_list.append(p.pos_id)
-                    statement = existing_position.statement
-                else:
-                    same_as_list = []
-                    statement = p.statement
-
-                pos_id = issues.graphs[update_issue].add_position(
-                               build_PositionNode(
-                                 updating_user_userid,
-                                 statement,
-                                 same_as_list)
-                               )
-                new_arg_node.premises_ids.append(pos_id)
-                #put new premise bids on order queue
-                order_queue.append((current_update[0],
-                                   current_update[1],
-                                   IndependentBid(p.bid.max_price,
-                                     p.bid.min_price,
-                                     MarketLocator(update_issue[1],
-                                       pos_id),
-                                     ProOrCon.PRO
-                                   )
-                                  )
-                                )
-                process_one_order_from_queue(issues, order_queue)
-
-            issues.graphs[update_issue].add_argument(new_arg_node)
-
-            #put new argument bid on order queue
-            if new_arg.bid_on_target is not None:
-                order_queue.append((current_update[0],
-                                    current_update[1],
-                                   IndependentBid(
-                                     new_arg.bid_on_target.max_price,
-                                     new_arg.bid_on_target.min_price,
-                                     MarketLocator(update_issue[1],
-                                       new_arg_node.conclusion_id),
-                                     new_arg.pro_or_con
-                                   )
-                                  )
-                                )
-
-    return bool(graph_arg_queue)
-
-
-def process_one_position_from_queue(issues: Issues,
-      graph_pos_queue: GraphUpdatePosQueue) -> bool:
-    """ Return true if graph_pos_queue is not empty
-        after processing one item from the queue;
-        False otherwise
+    if isinstance(command, AddArgument):
+        process_argument(issues, command, updated_issues)
+    elif isinstance(command, AddPosition):
+        process_position(issues, command, updated_issues)
+    elif isinstance(command, PlaceOrder):
+        process_order(issues, command, updated_issues)
+    elif isinstance(command, PlaceAsk):
+        process_ask(issues, command, updated_issues)
+    elif isinstance(command, ClearCallAuctions):
+        process_clear_call_auctions(issues, command, updated_issues)
+    else: #if isinstance(command, DeleteIssue):
+        process_delete_issue(issues, command, updated_issues)
+
+
+def process_argument(issues: Issues,
+    command: AddArgument,
+    updated_issues: Optional[Set[Tuple[bytes, int]]] = None) -> None:
+    updating_user_userid = command.userid
+    update_issue = command.issue_id
+    new_arg = command.argument
+
+    new_arg_node = build_ArgumentNode(updating_user_userid,
+                     new_arg.pro_or_con is ProOrCon.PRO,
+                     new_arg.target_position.pos_id
+                     )
+
+    if issues.graphs.has_key(update_issue):
+        for i, p in enumerate(new_arg.premises):
+            same_as_list: List[int]
+            statement: str
+            if isinstance(p, UnconcededPosition):
+                existing_position = issues.graphs[update_issue]\
+                                          .get_position_copy(
+                                              p.pos_id
+                                           )
+                same_as_list = list(existing_position.same_as)
+                same_as_list.append(p.pos_id)
+                statement = existing_position.statement
+            else:
+                same_as_list = []
+                statement = p.statement
+
+            pos_id = issues.graphs[update_issue].add_position(
+                           build_PositionNode(
+                             updating_user_userid,
+                             statement,
+                             same_as_list),
+                           update_graph=updated_issues is None
+                           )
+            new_arg_node.premises_ids.append(pos_id)
+            #process new premise bids along with the argument
+            # (rather than putting them on the command queue), so
+            # that they are committed to the database together
+            process_order(issues,
+                          PlaceOrder(command.userid,
+                                     command.subuser,
+                                     IndependentBid(p.bid.max_price,
+                                       p.bid.min_price,
+                                       MarketLocator(update_issue[1],
+                                         pos_id),
+                                       ProOrCon.PRO,
+                                       p.bid.amount
+                                     )
+                          ),
+                          updated_issues)
+
+        issues.graphs[update_issue].add_argument(
+            new_arg_node,
+            update_graph=updated_issues is None)
+        if updated_issues is not None:
+            updated_issues.add(update_issue)
+
+        #process new argument bid along with the argument, too
+        if new_arg.bid_on_target is not None:
+            process_order(issues,
+                          PlaceOrder(command.userid,
+                                     command.subuser,
+                                     IndependentBid(
+                                       new_arg.bid_on_target.max_price,
+                                       new_arg.bid_on_target.min_price,
+                                       MarketLocator(update_issue[1],
+                                         new_arg_node.conclusion_id),
+                                       new_arg.pro_or_con,
+                                       new_arg.bid_on_target.amount
+                                     )
+                          ),
+                          updated_issues)
+
+
+def process_position(issues: Issues,
+      command: AddPosition,
+      updated_issues: Optional[Set[Tuple[bytes, int]]] = None) -> None:
+    updating_user_userid = command.userid
+    update_issue = command.issue_id
+    new_pos = command.position
+    #ignore premises
+    #TODO: fix: initial position should not have premises;
+    #  they can be added later as an argument
+    logger.debug(update_issue)
+    if not issues.graphs.has_key(update_issue) and \
+           update_issue[1] < Limits.max_total_issues:
+        issues.graphs[update_issue] = ArgumentGraph("")
+        logger.debug("inside not has_key")
+    if issues.graphs.has_key(update_issue):
+        logger.debug("inside has_key")
+        new_pos_id: int  = issues.graphs[update_issue].add_position(
+                   build_PositionNode(
+                     updating_user_userid,
+                     new_pos.conclusion),
+                   update_graph=updated_issues is None
+                   )
+        if updated_issues is not None:
+            updated_issues.add(update_issue)
+
+
+def process_order(issues: Issues,
+                  command: PlaceOrder,
+                  repriced_issues: Optional[Set[Tuple[bytes, int]]] = None
+                  ) -> None:
+    """ If repriced_issues is given, the id of the issue whose
+        prices changed is added to it, so that the caller can
+        update the issue's probabilities once for many orders
+        by calling update_graph() on the issue's ArgumentGraph.
+        Orders at prices outside of (0, CONTRACT_PRICE) are refused.
+        If Config.call_auction_interval_msec is nonzero, the bid
+        waits for the market's next call auction instead of being
+        matched (unless the market has a market maker); see
+        process_clear_call_auctions().
+    """
+    issue_id = command.issue_id
+    market_id = command.bid.market_locator.position_id
+    pro_or_con = command.bid.pro_or_con
+    new_bid = command.bid
+    #a con bid's min_price is the lowest support price it accepts;
+    # so, it bids the rest of the contract price for opposing
+    price: Final = new_bid.max_price if pro_or_con is ProOrCon.PRO \
+        else CONTRACT_PRICE - new_bid.min_price
+    if not 0.0 < price < CONTRACT_PRICE:
+        logger.info("refusing an order at price " + str(price))
+        return
+    if issues.graphs.has_key(issue_id):
+        if not issues.graphs[issue_id].betting_exchange\
+            .markets.has_key(market_id):
+            issues.graphs[issue_id].betting_exchange\
+            .markets[market_id] = BettingMarket(
+                LmsrMarketMaker(Config.market_maker_liquidity)
+                if Config.market_maker_liquidity > 0
+                else None)
+        if Config.call_auction_interval_msec and \
+                issues.graphs[issue_id].betting_exchange\
+                .markets[market_id].market_maker is None:
+            issues.graphs[issue_id].betting_exchange\
+                .add_auction_bid(market_id, command.userid, pro_or_con,
+                                 price, new_bid.amount)
+            return
+        fills = issues.graphs[issue_id].betting_exchange\
+            .markets[market_id].place_bid(
+                command.userid,
+                pro_or_con,
+                price,
+                new_bid.amount)
+        issues.graphs[issue_id].betting_exchange\
+            .record_fills(market_id, fills)
+        issues.graphs[issue_id]\
+            .refresh_position_price(market_id)
+        if repriced_issues is not None:
+            repriced_issues.add(issue_id)
+
+
+def process_ask(issues: Issues,
+                command: PlaceAsk,
+                repriced_issues: Optional[Set[Tuple[bytes, int]]] = None
+                ) -> None:
+    """ Offers contracts held by the user for sale in the market of
+        the position (see BettingExchange.place_ask()).
+        The ask is refused if its price is outside of
+        (0, CONTRACT_PRICE) or if the user does not hold the contracts.
+        If repriced_issues is given, the id of the issue is added to
+        it (as in process_order()).
+    """
+    issue_id: Final = command.issue_id
+    market_id: Final = command.ask.market_locator.position_id
+    price: Final = command.ask.min_price
+    if not 0.0 < price < CONTRACT_PRICE:
+        logger.info("refusing an ask at price " + str(price))
+        return
+    if not issues.graphs.has_key(issue_id) or \
+            not issues.graphs[issue_id].betting_exchange\
+            .markets.has_key(market_id):
+        # no market, so no contracts to sell
+        return
+    try:
+        issues.graphs[issue_id].betting_exchange.place_ask(
+            market_id, command.userid, command.ask.pro_or_con, price,
+            command.ask.amount)
+    except ValueError as e:
+        logger.info("refusing an ask: " + str(e))
+        return
+    issues.graphs[issue_id].refresh_position_price(market_id)
+    if repriced_issues is not None:
+        repriced_issues.add(issue_id)
+
+
+def process_clear_call_auctions(issues: Issues,
+                                command: ClearCallAuctions,
+                                repriced_issues: Optional[
+                                    Set[Tuple[bytes, int]]] = None
+                                ) -> None:
+    """ Clears the call auctions of the issue's markets that have bids
+        waiting (see BettingExchange.clear_auctions()).
+        If repriced_issues is given and prices changed, the id of the
+        issue is added to it (as in process_order()).
+    """
+    issue_id: Final = command.issue_id
+    if issues.graphs.has_key(issue_id):
+        graph: Final = issues.graphs[issue_id]
+        repriced_market_ids: Final = graph.betting_exchange.clear_auctions()
+        for market_id in repriced_market_ids:
+            graph.refresh_position_price(market_id)
+        if repriced_market_ids and repriced_issues is not None:
+            repriced_issues.add(issue_id)
+
+
+def process_delete_issue(issues: Issues,
+                         command: DeleteIssue,
+                         updated_issues: Optional[Set[Tuple[bytes, int]]] = None
+                         ) -> None:
+    """ If updated_issues is given, the id of the deleted issue is
+        added to it, so that its (new, empty) graph gets drawn.
+    """
+    issue_id_to_delete: Final = command.issue_id
+    if issues.graphs.has_key(issue_id_to_delete):
+        issue_to_delete = issues.graphs[issue_id_to_delete]
+        issues.graphs[issue_id_to_delete] = ArgumentGraph(issue_to_delete.issue_name)
+        issue_to_delete.clear()
+        if updated_issues is not None:
+            updated_issues.add(issue_id_to_delete)
+
+
+def parse_zeo_address(address: str) -> Union[Tuple[str, int], str]:
+    """ Converts "host:port" (or "[ipv6 address]:port") to a
+        (host, port) tuple; anything else is taken to be the path
+        of a Unix domain socket.
+    """
+    host, separator, port = address.rpartition(":")
+    if not separator or not port.isdigit():
+        return address
+    return (host[1:-1] if host.startswith("[") and host.endswith("]")
+            else host,
+            int(port))
+
+
+def open_argument_db(storage: Any) -> ZODB.DB:
+    """ Opens the argument database in the given storage, with the
+        connection pool and object caches sized by the Config settings
     """
-    if graph_pos_queue:
-        current_update = graph_pos_queue.popleft()
-        updating_user_userid = current_update[0]
-        update_issue = current_update[2]
-        new_pos = current_update[3]
-        #ignore premises
-        #TODO: fix: initial position should not have premises;
-        #  they can be added later as an argument
-        logger.debug(update_issue)
-        if not issues.graphs.has_key(update_issue) and \
-               update_issue[1] < Limits.max_total_issues:
-            issues.graphs[update_issue] = ArgumentGraph("")
-            logger.debug("inside not has_key")
-        if issues.graphs.has_key(update_issue):
-            logger.debug("inside has_key")
-            new_pos_id: int  = issues.graphs[update_issue].add_position(
-                       build_PositionNode(
-                         updating_user_userid,
-                         new_pos.conclusion)
-                       )
-    return bool(graph_pos_queue)
-
-def process_one_order_from_queue(issues: Issues,
-                                 order_queue: OrderQueue) -> bool:
-    """ Return true if order_queue is not empty
-        after processing one item from the queue;
-        False otherwise
+    return ZODB.DB(
+        storage,
+        pool_size=Config.argument_db_pool_size,
+        cache_size=Config.argument_db_cache_size,
+        cache_size_bytes=Config.argument_db_cache_size_mb * 1024 * 1024)
+
+
+def open_zeo_db(zeo_address: Any, read_only: bool = False) -> ZODB.DB:
+    """ Opens a database served by a ZEO server, e.g., the argument
+        database of an AllsemblyServer using ZEO storage (see
+        AllsemblyServer.zeo_address) from another process.
+        The client cache is sized by Config.zeo_client_cache_size_mb.
     """
-    if order_queue:
-        current_order = order_queue.popleft()
-        bidding_user_userid = current_order[0]
-        bidding_subuser = current_order[1]
-        issue_id = current_order[2].market_locator.issue_id
-        market_id = current_order[2].market_locator.position_id
-        pro_or_con = current_order[2].pro_or_con
-        new_bid = current_order[2]
-        if issues.graphs.has_key((bidding_user_userid, issue_id)):
-            #temporarily accept the max price given
-            #order book is not implemented, yet
-            if not issues.graphs[(bidding_user_userid, issue_id)].betting_exchange\
-                .markets.has_key(market_id):
-                issues.graphs[(bidding_user_userid, issue_id)].betting_exchange\
-                .markets[market_id] = BettingMarket()
-            issues.graphs[(bidding_user_userid, issue_id)].betting_exchange\
-                .markets[market_id].last_support_price = \
-                new_bid.max_price if pro_or_con is ProOrCon.PRO \
-                    else 1.0 - new_bid.min_price
-    return bool(order_queue)
-
-
-def process_one_issue_from_queue(issues: Issues, 
-                                 issue_queue: IssueQueue) -> bool:
-    """ Return true if issue_queue is not empty after
-        processing one item from the queue;
-        False otherwise
+    storage: Final = ZEO.client(
+        zeo_address,
+        cache_size=Config.zeo_client_cache_size_mb * 1024 * 1024,
+        read_only=read_only)
+    try:
+        return open_argument_db(storage)
+    except Exception:
+        storage.close()
+        raise
+
+
+def _get_settings() -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """ Config and Limits settings, to be passed to a worker process
+        (see _apply_settings()), which does not inherit them when it
+        is spawned.
+    """
+    return ({name: value for name, value in vars(Config).items()
+             if not name.startswith("_")},
+            {name: value for name, value in vars(Limits).items()
+             if not name.startswith("_")})
+
+
+def _apply_settings(settings: Tuple[Dict[str, Any], Dict[str, Any]]
+                    ) -> None:
+    for name, value in settings[0].items():
+        setattr(Config, name, value)
+    for name, value in settings[1].items():
+        setattr(Limits, name, value)
+
+
+def _commit_with_retries(update: Callable[[], None]) -> bool:
+    """ Calls update and commits, trying again if the transaction
+        conflicts with one committed by another process.
+        Returns False if it did not succeed.
+    """
+    for attempt in range(Config.issue_shard_commit_attempts):
+        try:
+            update()
+            transaction.commit()
+            return True
+        except ConflictError as e:
+            transaction.abort()
+            logger.info("retrying conflicting transaction: " + str(e))
+        except Exception as e:
+            transaction.abort()
+            logger.exception(e)
+            return False
+    logger.error("giving up on conflicting transaction")
+    return False
+
+
+def _run_issue_shard(zeo_address: Any,
+                     command_queue: "multiprocessing.Queue[Optional[List[Command]]]",
+                     updated_issues_queue: "multiprocessing.Queue[Optional[List[Tuple[bytes, int]]]]",
+                     settings: Tuple[Dict[str, Any], Dict[str, Any]]
+                     ) -> None:
+    """ The main loop of an IssueShards worker process """
+    _apply_settings(settings)
+    # the worker calculates the probabilities of its issues itself
+    Config.inference_worker_processes = 0
+    argumentdb: Final = open_zeo_db(zeo_address)
+    try:
+        issues: Final[Issues] = argumentdb.open().root().issues
+        should_exit = False
+        while not should_exit:
+            batches: List[List[Command]] = []
+            next_batch = command_queue.get()
+            # handle everything that is waiting at once, so that each
+            # issue's graph is updated once for a burst of commands
+            while next_batch is not None:
+                batches.append(next_batch)
+                try:
+                    next_batch = command_queue.get_nowait()
+                except queue.Empty:
+                    break
+            should_exit = next_batch is None
+            updated_issues: Set[Tuple[bytes, int]] = set()
+            for commands in batches:
+                # (the commands are all for the same issue)
+                def process_commands() -> None:
+                    for command in commands:
+                        process_command(issues, command, updated_issues)
+                _commit_with_retries(process_commands)
+            for issue_id in updated_issues:
+                def update_graph() -> None:
+                    if issues.graphs.has_key(issue_id):
+                        issues.graphs[issue_id].update_graph()
+                _commit_with_retries(update_graph)
+            if updated_issues:
+                updated_issues_queue.put(list(updated_issues))
+    finally:
+        transaction.abort()
+        argumentdb.close()
+
+
+class IssueShards:
+    """ Processes the commands for issues in worker processes, so that
+        one slow issue (e.g., with a large graph or a slow Problog
+        calculation) does not delay the others, and so that the
+        throughput increases with the number of cores.
+
+        Each issue is always sent to the same worker process, chosen
+        by hashing its id, which processes its commands, updates its
+        graph and probabilities, and commits them to the database.
+        The processes share the database through a ZEO server.
+        The commands for the same issue are processed in the order
+        that they were submitted.
+
+        The ids of the issues updated (and committed) by the workers
+        are collected by the caller with take_updated_issues(), e.g.,
+        to notify the clients waiting for them.  If an Event object
+        is given, it is set whenever there are updated issues.
     """
-    if issue_queue.queue:
-        issue_queue_item: Final = issue_queue.queue.popleft()
-        if isinstance(issue_queue_item, IssueDeleteDirective):
-            issue_id_to_delete: Final = issue_queue_item.id_to_delete
-            if issues.graphs.has_key(issue_id_to_delete):
-                issue_to_delete = issues.graphs[issue_id_to_delete]
-                issues.graphs[issue_id_to_delete] = ArgumentGraph(issue_to_delete.issue_name)
-                issue_to_delete.clear()
-        else: #if isinstance(issue_queue_item, IssueAddDirective):
-            issue_to_add: Final = issue_queue_item
-            issue_id = issue_to_add[0]
-            issue_name = issue_to_add[1]
-            if not issues.graphs.has_key(issue_to_add[0]):
-                issues.graphs[issue_id] = ArgumentGraph(issue_name)
-            else: # rename issue
-                issues.graphs[issue_id].issue_name = issue_name
-    return bool(issue_queue.queue)
+    def __init__(self, number_of_processes: int,
+                 zeo_address: Any,
+                 event_obj: Optional[Event] = None) -> None:
+        mp_context: Final = multiprocessing.get_context("spawn")
+        self._updated_issues_queue: Final[
+            "multiprocessing.Queue[Optional[List[Tuple[bytes, int]]]]"] = \
+            mp_context.Queue()
+        self._command_queues: Final[
+            List["multiprocessing.Queue[Optional[List[Command]]]"]] = [
+            mp_context.Queue() for _ in range(max(1, number_of_processes))
+        ]
+        self._processes: Final = [
+            mp_context.Process(target=_run_issue_shard,
+                               args=(zeo_address,
+                                     command_queue,
+                                     self._updated_issues_queue,
+                                     _get_settings()),
+                               name="issue shard " + str(i),
+                               daemon=True)
+            for i, command_queue in enumerate(self._command_queues)
+        ]
+        for process in self._processes:
+            process.start()
+        self._event_obj = event_obj
+        self._lock: Final = threading.Lock()
+        self._updated_issues: Set[Tuple[bytes, int]] = set()
+        self._collector_thread: Final = threading.Thread(
+            target=self._collect_updated_issues,
+            name="issue shard results",
+            daemon=True)
+        self._collector_thread.start()
+
+    def submit(self, issue_id: Tuple[bytes, int],
+               commands: List[Command]) -> None:
+        """ commands should all be for the issue issue_id """
+        self._command_queues[hash(issue_id) % len(self._command_queues)]\
+            .put(commands)
+
+    def _collect_updated_issues(self) -> None:
+        while True:
+            updated_issues = self._updated_issues_queue.get()
+            if updated_issues is None:
+                return
+            with self._lock:
+                self._updated_issues.update(updated_issues)
+            if self._event_obj is not None:
+                self._event_obj.set()
+
+    def take_updated_issues(self) -> Set[Tuple[bytes, int]]:
+        """ Returns the ids of the issues updated since the previous
+            call.
+        """
+        with self._lock:
+            updated_issues: Final = self._updated_issues
+            self._updated_issues = set()
+        return updated_issues
+
+    def shutdown(self) -> None:
+        """ Waits for the workers to finish the commands already
+            submitted.
+        """
+        for command_queue in self._command_queues:
+            command_queue.put(None)
+        for process in self._processes:
+            process.join()
+        self._updated_issues_queue.put(None)
+        self._collector_thread.join()
 
 
 class AllsemblyServer:
@@ -329,17 +641,32 @@ class AllsemblyServer:
                 ):
         #open database for: orderbook, ledger, & arg_graph
         #TODO: check for errors; exit if can't open DB
-        self.argumentdb_storage = ZODB.FileStorage.FileStorage(arg_dbfilename)
-        self.argumentdb = ZODB.DB(self.argumentdb_storage)
+        #the address of the ZEO server through which the database is
+        # shared with other processes, if any, and the function to stop
+        # it, if it was started here
+        self.zeo_address: Any = None
+        self._stop_zeo_server: Optional[Callable[[], None]] = None
+        if Config.argument_db_storage == "zeo" and \
+                Config.argument_db_zeo_address is not None:
+            self.zeo_address = parse_zeo_address(
+                Config.argument_db_zeo_address)
+        elif Config.argument_db_storage == "zeo" or \
+                Config.issue_shard_processes:
+            #the issue shard processes need to share the database
+            self.zeo_address, self._stop_zeo_server = ZEO.server(
+                path=arg_dbfilename, threaded=False)
+        if self.zeo_address is not None:
+            self.argumentdb = open_zeo_db(self.zeo_address)
+            self.argumentdb_storage = self.argumentdb.storage
+        else:
+            self.argumentdb_storage = ZODB.FileStorage.FileStorage(arg_dbfilename)
+            self.argumentdb = open_argument_db(self.argumentdb_storage)
         self.argdb_conn = self.argumentdb.open()
-        #create the queues: order_queue, graph_update_queue
+        #create the command queue
         #create separate queues for guests?
-        #TODO: additions to the queue, when they are full will just get
-        #  discarded without notice.  That is not the behavoir I prefer.
-        #  Attend to that in a future version.
-        self.order_queue: OrderQueue = OrderQueue()
-        self.graph_arg_queue: GraphUpdateArgQueue = GraphUpdateArgQueue()
-        self.graph_pos_queue: GraphUpdatePosQueue = GraphUpdatePosQueue()
+        #When the queue is full, requests are refused, and the client
+        # is told to try again later (see AllsemblyServices.UserServices)
+        self.command_queue: CommandQueue = CommandQueue()
 
         #Load the data into BettingExchange and ArgumentGraph
         #  instances &
@@ -353,7 +680,31 @@ class AllsemblyServer:
             self.dbroot.issues = Issues()
         transaction.commit()
         self.issues = self.dbroot.issues
-        self.issue_queue = IssueQueue(self.issues)
+        self.issues_request = IssuesRequest(self.issues)
+        #started by server_main_loop if Config.inference_worker_processes
+        # is nonzero; otherwise probabilities are calculated synchronously
+        self.inference_service: Optional[InferenceService] = None
+        #started by server_main_loop if Config.issue_shard_processes
+        # is nonzero; otherwise the commands are processed here
+        self.issue_shards: Optional[IssueShards] = None
+        #issues updated while processing the queues, whose probabilities
+        # and drawn graphs are updated once per batch of updates
+        # (see process_dirty_issues())
+        self.dirty_issues: Set[Tuple[bytes, int]] = set()
+        #time (from time.monotonic()) each dirty issue was first updated
+        self._dirty_issue_times: Dict[Tuple[bytes, int], float] = {}
+        #time (from time.monotonic()) the first bid was placed in each
+        # issue whose markets have bids waiting for a call auction
+        # (see process_call_auctions())
+        self._call_auction_times: Dict[Tuple[bytes, int], float] = {}
+        #created by server_main_loop for the RPyC services; notified
+        # when updated graphs are committed
+        self.graph_request: Optional[GraphRequest] = None
+        #queue items processed but not yet committed (see
+        # _commit_if_due()) and the time (from time.monotonic())
+        # the first of them was processed
+        self._uncommitted_items = 0
+        self._first_uncommitted_item_time = 0.0
 
 
     @classmethod
@@ -382,139 +733,213 @@ class AllsemblyServer:
             return False
         return server_control.should_exit()
 
-    def process_all_issues_from_queue(self,
-                                      timeout_msecs: Optional[int],
-                                      loop_sentinel_ref: Optional[ServerControl]
-                                      ) -> None:
-        start_time = thread_time_ns()
-        current_time = start_time
-        while not AllsemblyServer.check_should_exit(loop_sentinel_ref) and \
-            not AllsemblyServer.check_timeout(
-                timeout_msecs,
-                int(start_time / CONSTANTS.MILLION),
-                int(current_time / CONSTANTS.MILLION)
-            ):
-            queue_is_empty = FinalVar[bool](not process_one_issue_from_queue(
-                self.issues,
-                self.issue_queue))
-            # logger.debug("inside loop for process_one_issue_from_queue")
-            transaction.commit()
-            if queue_is_empty.get():
-                break
-            current_time = thread_time_ns()
-            # logger.debug((current_time - start_time) / CONSTANTS.MILLION)
+    def _commit_if_due(self) -> None:
+        """ Call after processing each queue item.
+            Commits the items processed since the last commit if
+            there are Config.group_commit_max_items of them or if
+            the first of them was processed at least
+            Config.group_commit_max_msec milliseconds ago.
+            Committing a group of items at once, instead of each one
+            separately, saves a write to disk (and sync) per item.
+            Each item is processed completely (e.g., an argument
+            together with its bids) before this is called, so an item
+            is never partly committed.
+        """
+        now: Final[float] = time.monotonic()
+        if self._uncommitted_items == 0:
+            self._first_uncommitted_item_time = now
+        self._uncommitted_items += 1
+        if self._uncommitted_items >= Config.group_commit_max_items or \
+                (Config.group_commit_max_msec and
+                 (now - self._first_uncommitted_item_time) * 1000.0 >=
+                 Config.group_commit_max_msec):
+            self._commit()
 
-    def process_all_orders_from_queue(self,
-                                      timeout_msecs: Optional[int],
-                                      loop_sentinel_ref: Optional[ServerControl]
-                                      ) -> None:
-        start_time = thread_time_ns()
-        current_time = start_time
-        #logger.debug(bool(self.order_queue))
-        while not AllsemblyServer.check_should_exit(loop_sentinel_ref) and \
-            not AllsemblyServer.check_timeout(
-                timeout_msecs,
-                int(start_time / CONSTANTS.MILLION),
-                int(current_time / CONSTANTS.MILLION)):
-            queue_is_empty = FinalVar[bool](not process_one_order_from_queue(
-            self.issues,
-            self.order_queue))
-            # logger.debug("inside loop for process_one_order_from_queue")
-            # commit the transaction after each order is processed
-            transaction.commit()
-            if queue_is_empty.get():
-                break
-            # set time for elapsed time check
-            current_time = thread_time_ns()
-            # logger.debug((current_time - start_time) / CONSTANTS.MILLION)
+    def _commit(self) -> None:
+        transaction.commit()
+        self._uncommitted_items = 0
 
-    def process_all_positions_from_queue(self,
-                                         timeout_msecs: Optional[int],
-                                         loop_sentinel_ref: Optional[ServerControl]
-                                         ) -> None:
+    def process_all_commands_from_queue(self,
+                                        timeout_msecs: Optional[int],
+                                        loop_sentinel_ref: Optional[ServerControl]
+                                        ) -> None:
+        """ Processes the queued commands in batches of commands for
+            the same issue (see CommandQueue.pop_issue_batch()) until
+            the queue is empty or the timeout has expired.
+        """
         start_time = thread_time_ns()
         current_time = start_time
-        #logger.debug(list(self.graph_pos_queue))
-        #logger.debug(bool(self.graph_pos_queue))
-        while not AllsemblyServer.check_should_exit(loop_sentinel_ref) and \
+        while self.command_queue and \
+            not AllsemblyServer.check_should_exit(loop_sentinel_ref) and \
             not AllsemblyServer.check_timeout(
                 timeout_msecs,
                 int(start_time / CONSTANTS.MILLION),
                 int(current_time / CONSTANTS.MILLION)
-                                              ):
-            queue_is_empty = FinalVar[bool](not process_one_position_from_queue(
-                self.issues,
-                self.graph_pos_queue))
-            # logger.debug("inside loop for process_one_position_from_queue")
-            # no bids need processing, so transaction is complete
-            transaction.commit()
-            if queue_is_empty.get():
-                break
+            ):
+            issue_id, commands = self.command_queue.pop_issue_batch(
+                Config.max_commands_per_issue_batch)
+            if Config.call_auction_interval_msec and \
+                    any(isinstance(command, (AddArgument, PlaceOrder))
+                        for command in commands):
+                self._call_auction_times.setdefault(issue_id,
+                                                    time.monotonic())
+            if self.issue_shards is not None:
+                self.issue_shards.submit(issue_id, commands)
+                continue
+            for command in commands:
+                process_command(self.issues, command, self.dirty_issues)
+                # commit the transaction after each command is processed
+                # (or after a group of them).  An argument has orders
+                # (bids) associated with it that should be committed
+                # into the database as part of the same transaction, so
+                # process_argument() processes them itself.
+                self._commit_if_due()
             # set time for elapsed time check
             current_time = thread_time_ns()
-            # logger.debug((current_time - start_time) / CONSTANTS.MILLION)
+        # the rest of the last group of commands
+        if self._uncommitted_items:
+            self._commit()
 
-    def process_all_arguments_from_queue(self,
-                                         timeout_msecs: Optional[int],
-                                         loop_sentinel_ref: Optional[ServerControl]
-                                         ) -> None:
+    def process_call_auctions(self, force: bool = False) -> Optional[float]:
+        """ Clears the call auctions of the markets of each issue whose
+            bids have been collected for Config.call_auction_interval_msec
+            milliseconds (or of every issue with bids waiting, if force
+            is True), and commits all of their fills together.  The
+            issues whose prices changed are marked dirty, so that their
+            probabilities are updated once per auction.
+            Returns the number of seconds until the next call auction
+            is due or None if there are no bids waiting.
+        """
+        now: Final[float] = time.monotonic()
+        interval_seconds: Final[float] = \
+            Config.call_auction_interval_msec / 1000.0
+        next_due_seconds: Optional[float] = None
+        cleared = False
+        for issue_id, first_bid_time in list(self._call_auction_times.items()):
+            remaining_seconds = first_bid_time + interval_seconds - now
+            if not force and remaining_seconds > 0.0:
+                next_due_seconds = remaining_seconds \
+                    if next_due_seconds is None \
+                    else min(next_due_seconds, remaining_seconds)
+                continue
+            del self._call_auction_times[issue_id]
+            command = ClearCallAuctions(issue_id)
+            if self.issue_shards is not None:
+                # after the issue's bids, which were submitted before
+                self.issue_shards.submit(issue_id, [command])
+                continue
+            process_command(self.issues, command, self.dirty_issues)
+            cleared = True
+        if cleared:
+            self._commit()
+        return next_due_seconds
 
-        start_time = thread_time_ns()
-        current_time = start_time
-        #logger.debug(bool(self.graph_arg_queue))
-        while process_one_argument_from_queue(
-                self.issues,
-                self.graph_arg_queue,
-                self.order_queue) and \
-            not AllsemblyServer.check_should_exit(loop_sentinel_ref) and \
-            not AllsemblyServer.check_timeout(
-                timeout_msecs,
-                int(start_time / CONSTANTS.MILLION),
-                int(current_time / CONSTANTS.MILLION)
-                                              ):
-            #There is an ordering issue here: an argument has orders
-            # (bids) associated with it that should be committed into the
-            # database as part of the same transaction.  That suggests we
-            # should wait to call transaction.commit() until after the orders
-            # queue has been processed.
-            #In a future version send all requests on a single queue to
-            # eliminate order sensitive processing problems like this.
-            #For now, process_one_argument_from_queue appends each of its orders
-            # associated with its argument to the order queue then immediately
-            # calls process_one_order_from_queue.
-            #This works without problems because all of the queue processing
-            # happens in a single thread.
-            transaction.commit()
-            current_time = thread_time_ns()
+    def process_inference(self) -> None:
+        """ Publishes the probabilities calculated by the inference
+            worker processes since the last call, if any.
+            Calculations are started by process_dirty_issues(), which
+            does not wait for them to finish; until they do, the graphs
+            show the previously calculated (cached) values.
+        """
+        if self.inference_service is None:
+            return
+        query_results_by_issue: Final = self.inference_service.take_results()
+        for issue_id, query_results in query_results_by_issue.items():
+            if self.issues.graphs.has_key(issue_id):
+                self.issues.graphs[issue_id].set_problog_query_results(
+                    query_results)
+        if query_results_by_issue:
+            self._commit()
+            for issue_id in query_results_by_issue:
+                self._notify_graph_updated(issue_id)
+
+    def start_worker_processes(self, event_obj: Optional[Event] = None
+                               ) -> None:
+        """ Starts the issue shard processes, if
+            Config.issue_shard_processes is nonzero, or else the
+            inference worker processes, if
+            Config.inference_worker_processes is nonzero.
+            If an Event object is given, it is set when they have
+            results to be published (see process_issue_shard_updates()
+            and process_inference()).
+        """
+        if Config.issue_shard_processes:
+            # sends everything it needs to the workers, so commit it
+            self._commit()
+            self.issue_shards = IssueShards(Config.issue_shard_processes,
+                                            self.zeo_address,
+                                            event_obj)
+        elif Config.inference_worker_processes:
+            self.inference_service = InferenceService(
+                Config.inference_worker_processes,
+                event_obj)
+
+    def process_issue_shard_updates(self) -> Set[Tuple[bytes, int]]:
+        """ Notifies the clients waiting for the issues updated by the
+            issue shard processes since the last call, and returns
+            their ids.
+        """
+        if self.issue_shards is None:
+            return set()
+        updated_issues: Final = self.issue_shards.take_updated_issues()
+        if updated_issues:
+            # Also commits any changes made here (e.g., by
+            # IssuesRequest.add_issue()).  Then begins a new
+            # transaction to see the updates.
+            self._commit()
+            transaction.begin()
+            for issue_id in updated_issues:
+                if self.issues.graphs.has_key(issue_id):
+                    # loads the updated graph, which wakes the threads
+                    # waiting for the next revision of it
+                    self.issues.graphs[issue_id].get_revision_number()
+                self._notify_graph_updated(issue_id)
+        return updated_issues
 
-    def process_all_items_from_all_queues(self,
-                                         timeout_msecs: Optional[int],
-                                         loop_sentinel_ref: Optional[ServerControl]
-                                         ) -> None:
-        #Order is important.
-        # The ArgumentGraph methods push new orders onto
-        # the order queue for processing.
-        # So, the order queue should be processed after
-        # the argument queue.
-        # (But currently this is a non-issue because I am
-        # calling process_one_order_from_queue from within
-        # process_one_argument_from_queue to avoid data
-        # integrity problems.)
-        # It also makes sense to process creation of
-        # new issues before arguments or positions
-        # and the creation of new positions before
-        # arguments.  In some cases each might
-        # be needed by the next.
-        # In the future, make these all use one queue.
-
-        self.process_all_issues_from_queue(timeout_msecs,
-                                           loop_sentinel_ref)
-        self.process_all_positions_from_queue(timeout_msecs,
-                                              loop_sentinel_ref)
-        self.process_all_arguments_from_queue(timeout_msecs,
-                                              loop_sentinel_ref)
-        self.process_all_orders_from_queue(timeout_msecs,
-                                           loop_sentinel_ref)
+    def process_dirty_issues(self, force: bool = False) -> Optional[float]:
+        """ Updates the probabilities and redraws the graph once for
+            each issue updated since the last call, instead of once per
+            update.  An issue is only updated after
+            Config.graph_update_debounce_msec milliseconds have passed
+            since it was first marked dirty, unless force is True, so
+            that a burst of updates is handled all at once.
+            Returns the number of seconds until the next dirty issue is
+            due to be updated or None if there are no dirty issues left.
+        """
+        now: Final[float] = time.monotonic()
+        for issue_id in self.dirty_issues:
+            self._dirty_issue_times.setdefault(issue_id, now)
+        self.dirty_issues.clear()
+        debounce_seconds: Final[float] = \
+            Config.graph_update_debounce_msec / 1000.0
+        next_due_seconds: Optional[float] = None
+        for issue_id, dirty_time in list(self._dirty_issue_times.items()):
+            remaining_seconds = dirty_time + debounce_seconds - now
+            if not force and remaining_seconds > 0.0:
+                next_due_seconds = remaining_seconds \
+                    if next_due_seconds is None \
+                    else min(next_due_seconds, remaining_seconds)
+                continue
+            del self._dirty_issue_times[issue_id]
+            if self.issues.graphs.has_key(issue_id):
+                self._update_dirty_issue(issue_id,
+                                         self.issues.graphs[issue_id])
+        return next_due_seconds
+
+    def _update_dirty_issue(self, issue_id: Tuple[bytes, int],
+                            graph: ArgumentGraph) -> None:
+        graph.update_graph()
+        if self.inference_service is not None:
+            request: Final = graph.take_problog_inference_request()
+            if request is not None:
+                self.inference_service.submit(issue_id, *request)
+        self._commit()
+        self._notify_graph_updated(issue_id)
+
+    def _notify_graph_updated(self, issue_id: Tuple[bytes, int]) -> None:
+        # after committing, so that the updated graph can be read
+        if self.graph_request is not None:
+            self.graph_request.notify_graph_updated(issue_id)
 
     def cleanup(self) -> None:
 #        try:
@@ -522,8 +947,20 @@ class AllsemblyServer:
 #        except ConnectionStateError as e:
 #            logging.exception(e)
         transaction.abort()
+        if self.inference_service is not None:
+            self.inference_service.shutdown()
+            self.inference_service = None
+        if self.issue_shards is not None:
+            self.issue_shards.shutdown()
+            self.issue_shards = None
+        if self.graph_request is not None:
+            self.graph_request.close()
+            self.graph_request = None
         self.argdb_conn.close()
         self.argumentdb.close()
+        if self._stop_zeo_server is not None:
+            self._stop_zeo_server()
+            self._stop_zeo_server = None
 
     def process_all_items_of_one_request(self,
                           # it might be better to use BinaryIO
@@ -534,9 +971,11 @@ class AllsemblyServer:
                           server_control: Optional[ServerControl],
                           ) -> int:
         try:
-            self.process_all_items_from_all_queues(Config\
+            self.process_all_commands_from_queue(Config\
                                                    .time_msec_for_one_iter_of_order_processing,
                                                    server_control)
+            self.process_call_auctions(force=True)
+            self.process_dirty_issues(force=True)
             update_nofication_fileobj.truncate(0)
             update_nofication_fileobj.write(str(time.time()))
         except Exception as e:
@@ -578,23 +1017,24 @@ class AllsemblyServer:
         event_obj: Event = server_control.get_event_obj() \
                            if server_control is not None \
                            else Event()
-        self.order_queue.set_event_object(event_obj)
-        self.graph_arg_queue.set_event_object(event_obj)
-        self.graph_pos_queue.set_event_object(event_obj)
-        self.issue_queue.set_event_object(event_obj)
+        self.command_queue.set_event_object(event_obj)
+        self.start_worker_processes(event_obj)
+        self.graph_request = GraphRequest(
+            IssuesDBAccessor(self.argumentdb, read_only=True),
+            self.issues)
 
         #start RPyC threaded server; pass:
-        #  order_queue and graph_update_queue (FIFOs)
+        #  command_queue (FIFO)
         #  authenticator that can provide a UserInfo object
         #  on successful authentication
         rpyc_server = rpyc.ThreadPoolServer(classpartial(AllsemblyServices,
-                                                       self.order_queue,
-                                                       self.graph_arg_queue,
-                                                       self.graph_pos_queue,
-                                                       self.issue_queue,
-                                                       GraphRequest(IssuesDBAccessor(self.argumentdb, read_only=True),
-                                                                    self.issues),
-                                                       LedgerRequest()
+                                                       self.command_queue,
+                                                       self.issues_request,
+                                                       self.graph_request,
+                                                       LedgerRequest(
+                                                         IssuesDBAccessor(
+                                                           self.argumentdb,
+                                                           read_only=True))
                                                        ),
                                           hostname = listen_address,
                                           ipv6 = ipv6,
@@ -625,31 +1065,36 @@ class AllsemblyServer:
 
             logger.debug("before main loop")
 
+            #seconds until a dirty issue is due to be updated, if any
+            wait_timeout: Optional[float] = None
             #start main loop in main thread
             while not AllsemblyServer.check_should_exit(server_control):
                 #logger.debug("starting main loop")
-                # wait for an item to be added to any queue
-                event_obj.wait()
+                # wait for a command to be added to the queue
+                # or for a dirty issue to be due
+                event_obj.wait(wait_timeout)
                 event_obj.clear()
-                self.process_all_items_from_all_queues(
+                self.process_all_commands_from_queue(
                     Config.time_msec_for_one_iter_of_graph_updating,
                     server_control)
 
-                #TODO: if anything has changed
-                #  add new nodes to the problog_model
-                #  start problog in separate thread to update posteriors
-                #  wait a little while for problog
-                #  if problog hasn't finished
-                #    THEN: get cached values
-                #  NEXT: update arg diagram
-                #  NEXT: set new timestamp in file indicating update is available
+                # publish finished probability calculations, if any
+                self.process_inference()
+                # and notify clients of updates by the issue shards
+                self.process_issue_shard_updates()
+                # clear the call auctions that are due, if any
+                auction_timeout = self.process_call_auctions()
+                # update probabilities and redraw once per updated issue
+                # (or start the calculations in the inference workers)
+                wait_timeout = self.process_dirty_issues()
+                if auction_timeout is not None:
+                    wait_timeout = auction_timeout \
+                        if wait_timeout is None \
+                        else min(wait_timeout, auction_timeout)
+
+                #TODO: set new timestamp in file indicating update is available
                 #  (need to get filename in as an argument to this function)
                 #  *
-                #  *
-                #  *Currently all of this updating, except updating of the
-                #  file is handled in the ArgumentGraph class by the add_argument(...)
-                #  and add_position(...) functions.
-                #  *
                 #  *Updating the file is not yet necessary because the
                 #  graphs are currently single-user, so no users have to
                 #  be updated about changes made to the graph by other users.
@@ -30,9 +30,11 @@ The functions to build arguments and insert them into the graph are
 
 import copy
 import threading
+import weakref
 import time
 import logging
 
+import transaction #type: ignore[import]
 import ZODB #type: ignore[import]
 import persistent #type: ignore[import]
 from persistent.list import PersistentList #type: ignore[import]
@@ -40,17 +42,69 @@ from persistent.mapping import PersistentMapping #type: ignore[import]
 import heapq
 import pygraphviz as pgv #type: ignore[import]
 import re
+from BTrees.IIBTree import IITreeSet #type: ignore[import]
 from BTrees.OOBTree import OOBTree #type: ignore[import]
-from typing import List, Dict, Any, Optional, cast
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple, Union, \
+    cast
 from typing_extensions import Final
 
 from allsembly.betting_exchange import BettingExchange
-from allsembly.common import FinalVar
-from allsembly.config import Limits
-from allsembly.prob_logic import ProblogModel
+from allsembly.common import RevisionCounter
+from allsembly.config import Config, Limits
+from allsembly.prob_logic import ProblogModel, ProblogProgramBuilder
+from allsembly.svg_postprocessor import postprocess_svg
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+# the revision counters of invalidated ArgumentGraphs; see
+# ArgumentGraph._p_invalidate()
+_kept_graph_revisions: Final["weakref.WeakKeyDictionary[ArgumentGraph, RevisionCounter]"] = \
+    weakref.WeakKeyDictionary()
+
+# Stand in for the price and the probability in the position nodes when
+# the graph is laid out, so that they take up the same space whatever
+# the values are.  The values are filled in afterwards (see
+# ArgumentGraph._prepare_graph()), so that a change of values does not
+# require laying out the graph again.
+PRICE_PLACEHOLDER: Final = "100.0¢"
+PROBABILITY_PLACEHOLDER: Final = "100.0%"
+
+_VALUE_SLOT_RE: Final = re.compile(
+    r'<title>([^<]*)</title>|<!\[CDATA\[(' + re.escape(PRICE_PLACEHOLDER)
+    + '|' + re.escape(PROBABILITY_PLACEHOLDER) + r')\]\]>')
+
+# a part of a laid-out graph: either SVG or a slot for the price (True)
+# or probability (False) of the position with the pos_id
+LayoutPart = Union[str, Tuple[int, bool]]
+
+
+def _split_layout_svg(svg: str) -> List[LayoutPart]:
+    """ Splits the SVG of a graph laid out with placeholders for the
+        values at the placeholders.  Only the first placeholder of each
+        kind in a position node is a slot; a statement could look like
+        a placeholder, too.
+    """
+    parts: Final[List[LayoutPart]] = []
+    start = 0
+    pos_id: Optional[int] = None
+    filled_slots: List[bool] = []
+    for match in _VALUE_SLOT_RE.finditer(svg):
+        if match.group(1) is not None:
+            # the start of the next node or edge
+            pos_id = int(match.group(1)) if match.group(1).isdigit() else None
+            filled_slots = []
+            continue
+        is_price = match.group(2) == PRICE_PLACEHOLDER
+        if pos_id is None or is_price in filled_slots:
+            continue
+        filled_slots.append(is_price)
+        parts.append(svg[start:match.start(2)])
+        parts.append((pos_id, is_price))
+        start = match.end(2)
+    parts.append(svg[start:])
+    return parts
+
+
 class ArgumentNode(persistent.Persistent):
     """An argument which has as its conclusion either that its
        parent is true (when self.supports_conclusion is true) or
@@ -69,13 +123,16 @@ class ArgumentNode(persistent.Persistent):
 def build_ArgumentNode(creator: bytes,
                       supports_conclusion: bool,
                       conclusion_id: int = int(),
-                      premise_ids: PersistentList = PersistentList(),
+                      premise_ids: Optional[PersistentList] = None,
                       creation_time: int = int(time.time()),
                       arg_id: int = int()) -> ArgumentNode:
     new_arg_node = ArgumentNode()
     new_arg_node.arg_id = arg_id
     new_arg_node.supports_conclusion = supports_conclusion
-    new_arg_node.premise_ids = premise_ids
+    # not shared between nodes, which could be stored in different databases
+    new_arg_node.premise_ids = premise_ids \
+        if premise_ids is not None \
+        else PersistentList()
     new_arg_node.conclusion_id = conclusion_id
     new_arg_node.creation_time = creation_time
     new_arg_node.creator = creator
@@ -109,6 +166,43 @@ def build_PositionNode(creator: bytes,
     new_pos_node.node_is_leaf_node = node_is_leaf_node
     return new_pos_node
 
+class GraphChanges(NamedTuple):
+    """ The changes made to an argument graph after a given revision,
+        up to and including revision_number (see
+        ArgumentGraph.get_changes_since()).
+        positions: (pos_id, statement) of each position added
+        arguments: (arg_id, supports_conclusion, conclusion_id,
+          premise ids) of each argument added
+        values: (pos_id, price, probability) of each position whose
+          price (None if it has no market) or probability (a
+          percentage, as shown in the drawn graph) changed, including
+          the positions added
+    """
+    revision_number: int
+    positions: Tuple[Tuple[int, str], ...]
+    arguments: Tuple[Tuple[int, bool, int, Tuple[int, ...]], ...]
+    values: Tuple[Tuple[int, Optional[float], float], ...]
+
+    def changes_layout(self) -> bool:
+        """ Whether nodes or edges were added, so that the graph
+            has to be drawn again to show the changes
+        """
+        return bool(self.positions or self.arguments)
+
+    def followed_by(self, later: 'GraphChanges') -> 'GraphChanges':
+        """ These changes together with the later ones, made after
+            this revision_number
+        """
+        values: Final[Dict[int, Tuple[Optional[float], float]]] = {
+            p_key: (price, probability)
+            for p_key, price, probability in self.values + later.values}
+        return GraphChanges(
+            later.revision_number,
+            self.positions + later.positions,
+            self.arguments + later.arguments,
+            tuple((p_key,) + value for p_key, value in values.items()))
+
+
 class ArgumentGraph(persistent.Persistent):
     """Stores all of the arguments for an *issue* and generates
        the visual representation of the graph using PyGraphViz
@@ -122,79 +216,206 @@ class ArgumentGraph(persistent.Persistent):
         self.pos_node_index = PersistentMapping()
         self.betting_exchange = BettingExchange()
         self.problog_model: ProblogModel = ProblogModel()
+        self.problog_program_builder = ProblogProgramBuilder()
         self.next_arg_id = int(0) #PicklableAtomicLong(0)
         self.next_pos_id = int(0) #PicklableAtomicLong(0)
-        self._v_gv_graph = pgv.AGraph(strict=False, directed=True)
-        self._v_gv_graph.graph_attr["rankdir"] = "LR"
-        self._v_gv_graph.graph_attr["splines"] = "line"
-        self._v_gv_graph.graph_attr["clusterrank"] = "local"
-        self._v_gv_graph.graph_attr["compound"] = "true"
-        self._v_gv_graph.graph_attr["color"] = "gray"
-        self._v_gv_graph.graph_attr["packmode"] = "clust"
+        self._init_gv_graph()
         self._v_my_g_svg: List[str] = ["", ""]
-        self._v_updated_graph_event_obj = threading.Event()
-        # this could be saved to the database, but it is okay if this
-        # resets to zero because the logic in rpyc is to only
-        # wait once and not re-check the revision number after it
-        # is signalled that a new graph is available.
-        self._v_graph_revision_number = 0
-        self._build_initial_gv_graph()
+        # threads waiting for the next revision of the graph wait on this
+        self._v_graph_revision = RevisionCounter()
+        self._init_problog_update_state()
         self.read_buffer_index = 0
         self.write_buffer_index = 1
         self.my_problog_prog = str()
         self.my_g_svg = ""
+        # the revision number of the graph last drawn (my_g_svg), saved
+        # with it so that readers of the database get a matching pair
+        self.drawn_graph_revision_number = 0
+        self._init_change_log()
 
 
     def __setstate__(self, state: Dict[Any, Any]) -> None:
         self.__dict__ = state
-        self._v_gv_graph = pgv.AGraph(strict=False, directed=True)
-        self._v_gv_graph.graph_attr["rankdir"] = "LR"
-        self._v_gv_graph.graph_attr["splines"] = "line"
-        self._v_gv_graph.graph_attr["clusterrank"] = "local"
-        self._v_gv_graph.graph_attr["compound"] = "true"
-        self._v_gv_graph.graph_attr["color"] = "gray"
-        self._v_gv_graph.graph_attr["packmode"] = "clust"
+        self._init_gv_graph()
         self._v_my_g_svg = ["", ""]
-        self._v_updated_graph_event_obj = threading.Event()
-        # this could be saved to the database, but it is okay if this
-        # resets to zero because the logic in rpyc is to only
-        # wait once and not re-check the revision number after it
-        # is signalled that a new graph is available.
-        self._v_graph_revision_number = 0
-        self._build_initial_gv_graph()
-        self._prepare_graph()
-
+        if "drawn_graph_revision_number" not in state:
+            # database written by a version without saved revision numbers
+            self.drawn_graph_revision_number = 0
+        if "change_log" not in state:
+            # database written by a version without a change log;
+            # the changes so far are only in the drawn graph
+            self._init_change_log()
+        elif "unlogged_pos_ids" not in state:
+            # database written by a version that compared the values of
+            # all of the positions with the logged ones
+            self.unlogged_pos_ids = IITreeSet(self.pos_node_index.keys())
+        graph_revision: Final = _kept_graph_revisions.pop(self, None)
+        if graph_revision is not None:
+            # wakes the threads waiting for a revision drawn elsewhere
+            graph_revision.set(self.drawn_graph_revision_number)
+            self._v_graph_revision = graph_revision
+        else:
+            self._v_graph_revision = RevisionCounter(
+                self.drawn_graph_revision_number)
+        self._init_problog_update_state()
+        if "problog_program_builder" not in state:
+            # database written by a version without cached fragments
+            self._build_problog_program()
+
+
+    def _p_invalidate(self) -> None:
+        # Called when another connection (e.g., in an issue shard
+        # process) has committed a change to the graph, or when a
+        # change is aborted.  Keep the revision counter, which threads
+        # may be waiting on, until the graph is loaded again.
+        graph_revision: Final = self.__dict__.get("_v_graph_revision") \
+            if self._p_changed is not None \
+            else None
+        super()._p_invalidate()
+        if graph_revision is not None:
+            _kept_graph_revisions[self] = graph_revision
 
     def clear(self) -> None:
-        self._v_graph_revision_number = 0;
-        self._v_updated_graph_event_obj.set()
-        # TODO: the line below should most likely be removed
-        #  because otherwise a thread could wait on revisions to
-        #  this argument graph after it has stopped being used.
-        #  Probably should also change the name of this function
+        # wakes the threads waiting on revisions to this argument graph
+        # TODO: Probably should change the name of this function
         #  to something like "cleanup" or "decommission".
-        self._v_updated_graph_event_obj.clear()
+        self._v_graph_revision.reset()
 
 
     def get_revision_number(self) -> int:
-        return self._v_graph_revision_number
-
-    def get_update_graph_event_obj(self) -> threading.Event:
-        return self._v_updated_graph_event_obj
-
-    def _add_position_to_gv_graph(self, pos_id: int, pos: PositionNode) -> None:
-        p_key = pos_id
-        p_value = pos
+        return self._v_graph_revision.get()
+
+    def get_drawn_graph_revision_number(self) -> int:
+        return self.drawn_graph_revision_number
+
+    def wait_for_revision_change(self, last_seen_revision_number: int,
+                                 timeout: Optional[float] = None) -> bool:
+        """ See RevisionCounter.wait_for_change() """
+        return self._v_graph_revision.wait_for_change(
+            last_seen_revision_number, timeout)
+
+    def _init_change_log(self) -> None:
+        # the changes made in each of the most recent revisions, by
+        # revision number: the range of pos_ids and the range of
+        # arg_ids added, and the changed values (see GraphChanges)
+        self.change_log = OOBTree()
+        # the nodes and the values of the positions up to the last
+        # logged revision
+        self.logged_next_pos_id = self.next_pos_id
+        self.logged_next_arg_id = self.next_arg_id
+        self.logged_values = OOBTree()
+        # the positions whose values may have changed since the last
+        # logged revision, so that only those are compared with the
+        # logged values
+        self.unlogged_pos_ids = IITreeSet(self.pos_node_index.keys())
+
+    def _log_changes(self, revision_number: int) -> None:
+        changed_values: Final = []
+        for p_key in self.unlogged_pos_ids:
+            values = self._get_position_values(p_key)
+            if self.logged_values.get(p_key) != values:
+                self.logged_values[p_key] = values
+                changed_values.append((p_key,) + values)
+        self.unlogged_pos_ids.clear()
+        self.change_log[revision_number] = (
+            (self.logged_next_pos_id, self.next_pos_id),
+            (self.logged_next_arg_id, self.next_arg_id),
+            tuple(changed_values))
+        self.logged_next_pos_id = self.next_pos_id
+        self.logged_next_arg_id = self.next_arg_id
+        oldest_kept: Final[int] = \
+            revision_number - Config.graph_change_log_max_revisions
+        while len(self.change_log) and self.change_log.minKey() <= oldest_kept:
+            del self.change_log[self.change_log.minKey()]
+
+    def get_changes_since(self, revision_number: int
+                          ) -> Optional[GraphChanges]:
+        """ Returns the changes made after the given revision, or None
+            if they are no longer (or were never) in the change log, in
+            which case the whole graph has to be read again.
+        """
+        current: Final[int] = self.drawn_graph_revision_number
+        if revision_number == current:
+            return GraphChanges(current, (), (), ())
+        if not revision_number < current or \
+                not self.change_log.has_key(revision_number + 1):
+            return None
+        new_pos_ids: range = range(0)
+        new_arg_ids: range = range(0)
+        values: Dict[int, Tuple[Optional[float], float]] = {}
+        for (pos_start, pos_end), (arg_start, arg_end), changed_values in \
+                self.change_log.values(revision_number + 1, current):
+            new_pos_ids = range(new_pos_ids.start
+                                if new_pos_ids else pos_start, pos_end)
+            new_arg_ids = range(new_arg_ids.start
+                                if new_arg_ids else arg_start, arg_end)
+            for p_key, price, probability in changed_values:
+                values[p_key] = (price, probability)
+        return GraphChanges(
+            current,
+            tuple((p_key, self.pos_node_index[p_key].statement)
+                  for p_key in new_pos_ids),
+            tuple((a_key,
+                   self.arg_node_index[a_key].supports_conclusion,
+                   self.arg_node_index[a_key].conclusion_id,
+                   tuple(self.arg_node_index[a_key].premises_ids))
+                  for a_key in new_arg_ids),
+            tuple((p_key,) + value for p_key, value in values.items()))
+
+    def _publish_revision(self) -> None:
+        self.drawn_graph_revision_number += 1
+        revision_number: Final[int] = self.drawn_graph_revision_number
+        self._log_changes(revision_number)
+        if self._p_jar is None:
+            self._v_graph_revision.set(revision_number)
+            return
+        # Waiters read the drawn graph through their own database
+        # connections, which do not see it until it is committed.
+        def set_revision_number_if_committed(committed: bool) -> None:
+            if committed:
+                self._v_graph_revision.set(revision_number)
+        self._p_jar.transaction_manager.get().addAfterCommitHook(
+            set_revision_number_if_committed)
+
+    def _init_gv_graph(self) -> None:
+        # The graphviz graph is only needed to draw the graph again
+        # after an update.  Reading the graph drawn last (my_g_svg)
+        # or the positions does not need it, so it is not built
+        # until it is needed (see _build_initial_gv_graph()).
+        self._v_gv_graph: Optional[pgv.AGraph] = None
+        # labels last given to the graphviz nodes, by pos_id, so that
+        # only the nodes whose price or probability changed are updated
+        self._v_gv_labels: Dict[int, str] = {}
+        # whether the graphviz graph has changed since it was last drawn
+        self._v_gv_graph_is_stale = False
+        # the graph last laid out, split at the slots for the values
+        # (see _split_layout_svg())
+        self._v_layout_parts: List[LayoutPart] = []
+
+    def _get_position_values(self, pos_id: int
+                             ) -> Tuple[Optional[float], float]:
+        """ The price of the position (None if it has no market) and
+            its probability, as a percentage rounded as it is shown
+        """
         price: Final[Optional[float]] = \
             self.betting_exchange \
-                                 .markets[p_key] \
+                                 .markets[pos_id] \
                                  .last_support_price \
-            if self.betting_exchange.markets.has_key(p_key) \
+            if self.betting_exchange.markets.has_key(pos_id) \
             else None
 
-        probabilities = self.problog_model.get_problog_query_results()
-        prob_string = '{:.1f}'.format(probabilities[p_key] * 100.0) if p_key in probabilities\
-            else "50.0"
+        probabilities: Final = self.problog_model.get_problog_query_results()
+        return (price,
+                round(probabilities[pos_id] * 100.0, 1)
+                if pos_id in probabilities
+                else 50.0)
+
+    def _add_position_to_gv_graph(self, pos_id: int, pos: PositionNode) -> None:
+        if self._v_gv_graph is None:
+            # the position is included when the graph is built
+            return
+        p_key = pos_id
+        p_value = pos
         #avoid injection and also limit short version of text to 140 characters
         #replacing '\n' with '<br />' causes graphviz to keep newlines
         position_text: Final[str] = re.sub(r'<!\[CDATA\[', r'',
@@ -203,24 +424,32 @@ class ArgumentGraph(persistent.Persistent):
                                                          p_value.statement[:140])
                                                   )
                                            )
+        # the price and probability are filled in after the layout
         label: str = ('<<table border="0" cellborder="0" cellspacing="0" cellpadding="0">'
                       '<tr ><td>')
-        label += str(price) + "¢" if price is not None else ""
+        label += PRICE_PLACEHOLDER
         label += "</td><td>"
-        label += prob_string
-        label += ('%</td></tr>'
+        label += PROBABILITY_PLACEHOLDER
+        label += ('</td></tr>'
                   '<tr><td colspan="2" border="1" port="here" cellpadding="5">')
         label += position_text
         label += "</td></tr></table>>"
+        if self._v_gv_labels.get(p_key) == label:
+            return
+        self._v_gv_labels[p_key] = label
         self._v_gv_graph.add_node(str(p_key),
                                   label=label,
                                   shape="Mrecord"
                                   )
-        self._prepare_graph()
+        self._v_gv_graph_is_stale = True
 
     def _add_argument_to_gv_graph(self, arg_id: int, arg: ArgumentNode) -> None:
+        if self._v_gv_graph is None:
+            # the argument is included when the graph is built
+            return
         a_key = arg_id
         a_value = arg
+        self._v_gv_graph_is_stale = True
 
         #add arg node containing plus or minus sign
         labeltext: Final[str] = "+" \
@@ -262,23 +491,45 @@ class ArgumentGraph(persistent.Persistent):
                                            self.pos_node_index[
                                                a_value.conclusion_id
                                            ])
-        else:
-            self._prepare_graph()
         #done
 
     def _update_gv_graph_nodes(self) -> None:
+        if self._v_gv_graph is None:
+            return
         for p_key, p_value in self.pos_node_index.items():
             logger.debug("key " + str(p_key))
             self._add_position_to_gv_graph(p_key, p_value)
 
-    def _build_initial_gv_graph(self) -> None:
+    def _build_initial_gv_graph(self) -> pgv.AGraph:
+        self._v_gv_graph = pgv.AGraph(strict=False, directed=True)
+        self._v_gv_graph.graph_attr["rankdir"] = "LR"
+        self._v_gv_graph.graph_attr["splines"] = "line"
+        self._v_gv_graph.graph_attr["clusterrank"] = "local"
+        self._v_gv_graph.graph_attr["compound"] = "true"
+        self._v_gv_graph.graph_attr["color"] = "gray"
+        self._v_gv_graph.graph_attr["packmode"] = "clust"
+        self._v_gv_labels = {}
+        self._v_gv_graph_is_stale = True
         self._update_gv_graph_nodes()
         for a_key, a_value in self.arg_node_index.items():
             self._add_argument_to_gv_graph(a_key, a_value)
+        return self._v_gv_graph
+
+    def _init_problog_update_state(self) -> None:
+        # whether positions or arguments have been added since
+        # the Problog program was last compiled
+        self._v_problog_program_is_stale = True
+        # prices that changed since the Problog program was last evaluated
+        self._v_problog_weight_updates: Dict[str, float] = {}
+
+    def _get_problog_weight(self, pos_id: int) -> float:
+        return self.betting_exchange \
+                   .markets[pos_id] \
+                   .last_support_price / 100.0 \
+            if self.betting_exchange.markets.has_key(pos_id) \
+            else 0.5
 
-    def _add_clause_to_problog_program(self, a_key: int,
-                                       a_value: ArgumentNode) -> None:
-
+    def _problog_clause_fragment(self, a_value: ArgumentNode) -> str:
         c_key: Final[int] = a_value.conclusion_id
         term_base: Final[str] = "n" + str(c_key)
         pos_term: Final[str] = term_base + "(t)"
@@ -286,61 +537,153 @@ class ArgumentGraph(persistent.Persistent):
         conclusion_term: Final[str] = pos_term \
                                       if a_value.supports_conclusion \
                                       else neg_term
-        prob: Final[float] = self.betting_exchange \
-                                 .markets[c_key] \
-                                 .last_support_price / 100.0 \
-            if self.betting_exchange.markets.has_key(c_key) \
-            else 0.5
-        self.my_problog_prog += conclusion_term + " :- "
-        conjuncts = str()
-        for p in a_value.premises_ids:
-            prem_term = FinalVar[str]("n" + str(p) + "(t)")
-            if conjuncts:
-                conjuncts += ","
-            conjuncts += prem_term.get()
-        self.my_problog_prog += conjuncts + ".\n"
-        self.my_problog_prog += str(prob) + "::" + pos_term \
-                                + ";" + str(1 - prob) + "::" + neg_term + ".\n"
-        self.my_problog_prog += term_base + "_and_not_" + term_base + \
-                                   " :- " + pos_term + ", " + neg_term + ".\n"
-        self.my_problog_prog += "evidence(" + \
-                                   term_base + "_and_not_" + term_base + \
-                                   ", false).\n"
+        prob: Final[float] = self._get_problog_weight(c_key)
+        conjuncts: Final[str] = ",".join("n" + str(p) + "(t)"
+                                         for p in a_value.premises_ids)
+        return conclusion_term + " :- " + conjuncts + ".\n" \
+               + str(prob) + "::" + pos_term \
+               + ";" + str(1 - prob) + "::" + neg_term + ".\n" \
+               + term_base + "_and_not_" + term_base + \
+               " :- " + pos_term + ", " + neg_term + ".\n" \
+               + "evidence(" + \
+               term_base + "_and_not_" + term_base + \
+               ", false).\n"
+
+    def _problog_term_and_query_fragment(self, p_key: int,
+                                         p_value: PositionNode) -> str:
+        term: Final[str] = "n" + str(p_key) + "(t)"
+        fragment = str()
+        if p_value.node_is_leaf_node:
+            fragment += str(self._get_problog_weight(p_key)) + "::" + term + ".\n"
+        fragment += "query(" + term + ").\n"
+        return fragment
 
+    def _add_clause_to_problog_program(self, a_key: int,
+                                       a_value: ArgumentNode) -> None:
+        self.problog_program_builder.set_fragment(
+            ("a", a_key),
+            self._problog_clause_fragment(a_value))
+        self.problog_program_builder.add_weight_dependent(a_value.conclusion_id,
+                                                          ("a", a_key))
+        self._v_problog_program_is_stale = True
 
     def _add_term_and_query_to_problog_program(self,
                                                p_key: int,
                                                p_value: PositionNode
                                                ) -> None:
-        term: Final[str] = "n" + str(p_key) + "(t)"
-        if p_value.node_is_leaf_node:
-            prob: Final[float] = self.betting_exchange\
-                                     .markets[p_key]\
-                                     .last_support_price / 100.0 \
-            if self.betting_exchange.markets.has_key(p_key) \
-            else 0.5
-            self.my_problog_prog += str(prob) + "::" + term + ".\n"
-        self.my_problog_prog += "query(" + term + ").\n"
+        if self.problog_program_builder.set_fragment(
+                ("p", p_key),
+                self._problog_term_and_query_fragment(p_key, p_value)):
+            self._v_problog_program_is_stale = True
 
     def _build_problog_program(self) -> None:
-        self.my_problog_prog = ""
+        """Builds the cached program fragments from scratch.
+        Only needed for graphs stored without them; otherwise the
+        fragments are kept up to date as nodes are added.
+        """
+        self.problog_program_builder = ProblogProgramBuilder()
         for a_key, a_value in self.arg_node_index.items():
             self._add_clause_to_problog_program(a_key, a_value)
         for p_key, p_value in self.pos_node_index.items():
             self._add_term_and_query_to_problog_program(p_key, p_value)
 
+    def refresh_position_price(self, pos_id: int) -> None:
+        """ Call after the price in the betting market for the position
+            has changed so that the Problog program fragments that use
+            the price are re-rendered.
+            A price change does not change the structure of the program,
+            so the compiled model is re-weighted instead of recompiled
+            the next time the probabilities are calculated.
+        """
+        builder: Final = self.problog_program_builder
+        if pos_id in self.pos_node_index:
+            builder.set_fragment(("p", pos_id),
+                                 self._problog_term_and_query_fragment(
+                                     pos_id, self.pos_node_index[pos_id]))
+        for kind, key in builder.get_weight_dependents(pos_id):
+            if kind == "a":
+                builder.set_fragment(("a", key),
+                                     self._problog_clause_fragment(
+                                         self.arg_node_index[key]))
+        self._v_problog_weight_updates["n" + str(pos_id)] = \
+            self._get_problog_weight(pos_id)
+        if pos_id in self.pos_node_index:
+            self.unlogged_pos_ids.add(pos_id)
+
     def get_problog_program_string(self) -> str:
-        return self.my_problog_prog
+        return self.problog_program_builder.get_program_string()
 
     def _problog_calculate(self) -> None:
-        self._build_problog_program()
-        if self.my_problog_prog:
-            self.problog_model.set_problog_program(self.my_problog_prog)
+        if self._v_problog_program_is_stale \
+                or not self.problog_model.is_compiled():
+            self.my_problog_prog = self.problog_program_builder.get_program_string()
+            if self.my_problog_prog:
+                self.problog_model.set_problog_program(self.my_problog_prog)
+                self.problog_model.calculate_marginals()
+                self.unlogged_pos_ids.update(
+                    self.problog_model.get_problog_query_results().keys())
+            self._v_problog_program_is_stale = False
+        elif self._v_problog_weight_updates:
+            self.problog_model.update_term_weights(self._v_problog_weight_updates)
             self.problog_model.calculate_marginals()
+            self.unlogged_pos_ids.update(
+                self.problog_model.get_problog_query_results().keys())
+        self._v_problog_weight_updates = {}
+
+    def take_problog_inference_request(self
+                                       ) -> Optional[Tuple[bool, str, Dict[str, float]]]:
+        """ For calculating the probabilities elsewhere (see
+            prob_logic.InferenceService) rather than in this thread.
+            Returns whether the structure of the program has changed,
+            the current program string, and the prices changed since
+            the last request; or None if nothing has changed.
+        """
+        structure_changed: Final[bool] = self._v_problog_program_is_stale
+        if not structure_changed and not self._v_problog_weight_updates:
+            return None
+        program: Final[str] = self.problog_program_builder.get_program_string()
+        if not program:
+            return None
+        if structure_changed:
+            self.my_problog_prog = program
+        weight_updates: Final = self._v_problog_weight_updates
+        self._v_problog_program_is_stale = False
+        self._v_problog_weight_updates = {}
+        return structure_changed, program, weight_updates
+
+    def set_problog_query_results(self, query_results: Dict[int, float]) -> None:
+        """ Publishes probabilities calculated elsewhere
+            and updates the drawn graph.
+        """
+        # ignore positions unknown to this graph, e.g., if the issue
+        # was cleared while the calculation was running
+        known_query_results: Final = {
+            k: v for k, v in query_results.items() if k in self.pos_node_index}
+        self.problog_model.set_query_results(known_query_results)
+        self.unlogged_pos_ids.update(known_query_results.keys())
+        if self._prepare_graph():
+            self._publish_revision()
+
+    def update_graph(self) -> None:
+        """ Brings the probabilities and the drawn graph up to date
+            after positions and arguments were added with
+            update_graph=False and after prices have changed (see
+            refresh_position_price()).  Calculates the probabilities
+            (unless that is done in inference worker processes) and
+            draws the graph once for all of those updates.
+        """
+        if not Config.inference_worker_processes:
+            self._problog_calculate()
+        if self._prepare_graph():
+            self._publish_revision()
 
-    def add_argument(self, argument: ArgumentNode) -> Optional[int]:
+    def add_argument(self, argument: ArgumentNode,
+                     update_graph: bool = True) -> Optional[int]:
         """ Enter a new argument into the arg_node_index
             And return its id number
+            If update_graph is False, the probabilities are not
+            calculated and the graph is not drawn; the caller should
+            call update_graph() after a batch of updates.
         """
         if self.next_arg_id <= \
            Limits.max_total_nodes_per_issue:
@@ -353,17 +696,24 @@ class ArgumentGraph(persistent.Persistent):
             # if it was previously
             if argument.conclusion_id in self.pos_node_index:
                 self.pos_node_index[argument.conclusion_id].node_is_leaf_node = False
+                self._add_term_and_query_to_problog_program(
+                    argument.conclusion_id,
+                    self.pos_node_index[argument.conclusion_id])
+            self._add_clause_to_problog_program(arg_id, argument)
 
-            # calculate probabilities for this argument's positions
-            self._problog_calculate()
             #add new nodes and edges to graphviz graph
             self._add_argument_to_gv_graph(arg_id, argument)
-            self._update_gv_graph_nodes()
+            if not update_graph:
+                return arg_id
+
+            # calculate probabilities for this argument's positions
+            # unless that is done in inference worker processes
+            if not Config.inference_worker_processes:
+                self._problog_calculate()
 
             #add rules and disjunctions to problog model
-            self._v_graph_revision_number += 1
-            self._v_updated_graph_event_obj.set()
-            self._v_updated_graph_event_obj.clear()
+            if self._prepare_graph():
+                self._publish_revision()
             return arg_id
         else:
             return None
@@ -377,7 +727,8 @@ class ArgumentGraph(persistent.Persistent):
             return PositionNode()
 
     def add_position(self,
-                     position: PositionNode) -> Optional[int]:
+                     position: PositionNode,
+                     update_graph: bool = True) -> Optional[int]:
         """ Enter a new position into the pos_node_index
             And return its id number.
             For the convenience of producing the drawn argument
@@ -389,6 +740,9 @@ class ArgumentGraph(persistent.Persistent):
             position nodes that represent the same position.
             The one with the smallest pos_id will be used by
             the BettingExchange and the Problog model.
+            If update_graph is False, the graph is not drawn;
+            the caller should call update_graph() after a batch
+            of updates.
         """
         logger.debug("next_pos_id = " + str(self.next_pos_id))
         if self.next_pos_id <= \
@@ -403,21 +757,23 @@ class ArgumentGraph(persistent.Persistent):
             logger.debug("pos_id = " + str(pos_id))
             self.pos_node_index[pos_id] = position
             position.pos_id = pos_id
+            self.unlogged_pos_ids.add(pos_id)
             #maintain the other position nodes' lists of nodes
             #representing the same position
             for p in position.same_as:
                 heapq.heappush(self.pos_node_index[p.pos_id].same_as,
                                pos_id)
+            self._add_term_and_query_to_problog_program(pos_id, position)
 
             #next add node in graphviz model
             #  getting current price from betting market and
             #  marginal probability from cached problog model results
             self._add_position_to_gv_graph(pos_id, position)
-            self._prepare_graph()
+            if not update_graph:
+                return pos_id
             #add probabilistic term to problog model
-            self._v_graph_revision_number += 1
-            self._v_updated_graph_event_obj.set()
-            self._v_updated_graph_event_obj.clear()
+            if self._prepare_graph():
+                self._publish_revision()
 
             return pos_id
         else:
@@ -427,37 +783,49 @@ class ArgumentGraph(persistent.Persistent):
         #stub
         pass
 
-    def _prepare_graph(self) -> None:
-        self._v_gv_graph.layout(prog="dot")
-        self._v_my_g_svg[self.write_buffer_index] = self._v_gv_graph.draw(None, "svg").decode("utf-8")
-        self._v_my_g_svg[self.write_buffer_index] = re.sub(
-            r'&#45;',
-            r'-',
-            self._v_my_g_svg[self.write_buffer_index])
-        #Make SVG clickable. For now, using regular expression matching.
-        # In the future, maybe use something less fragile.
-        #old substitution, effective with shape=record but not effective with shape=Mrecord
-        self._v_my_g_svg[self.write_buffer_index] = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<polygon (.*)/>\n<text ', r'<g id="node\1<title>\2</title>\n<polygon \3/>\n<text style="cursor:pointer;" onclick="show_position_details(\2);" ', self._v_my_g_svg[self.write_buffer_index])
-        #last bet price and calculated probability
-        self._v_my_g_svg[self.write_buffer_index] = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text style="cursor:pointer;" onclick="show_position_details(\2);" ', self._v_my_g_svg[self.write_buffer_index])
-        self._v_my_g_svg[self.write_buffer_index] = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text style="cursor:pointer;" onclick="show_position_details(\2);" ', self._v_my_g_svg[self.write_buffer_index])
-        #calculated probability field above an initial position
-        self._v_my_g_svg[self.write_buffer_index] = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<polygon (.*)/>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<polygon \5/>\n<text style="cursor:pointer;" onclick="show_position_details(\2);" ', self._v_my_g_svg[self.write_buffer_index])
-        #space around a position's text
-        self._v_my_g_svg[self.write_buffer_index] = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text (.*)</text>\n<polygon ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text \5</text>\n<polygon cursor="pointer" pointer-events="visible" onclick="show_position_details(\2);" ', self._v_my_g_svg[self.write_buffer_index])
-        #first four lines of a position's text
-        self._v_my_g_svg[self.write_buffer_index] = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text (.*)</text>\n<polygon (.*)\>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text \5</text>\n<polygon \6/>\n<text cursor="pointer" onclick="show_position_details(\2);" ', self._v_my_g_svg[self.write_buffer_index])
-        self._v_my_g_svg[self.write_buffer_index] = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text (.*)</text>\n<polygon (.*)\>\n<text (.*)</text>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text \5</text>\n<polygon \6/>\n<text \7</text>\n<text cursor="pointer" onclick="show_position_details(\2);" ', self._v_my_g_svg[self.write_buffer_index])
-        self._v_my_g_svg[self.write_buffer_index] = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text (.*)</text>\n<polygon (.*)\>\n<text (.*)</text>\n<text (.*)</text>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text \5</text>\n<polygon \6/>\n<text \7</text>\n<text \8</text>\n<text cursor="pointer" onclick="show_position_details(\2);" ', self._v_my_g_svg[self.write_buffer_index])
-        self._v_my_g_svg[self.write_buffer_index] = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text (.*)</text>\n<polygon (.*)\>\n<text (.*)</text>\n<text (.*)</text>\n<text (.*)</text>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text \5</text>\n<polygon \6/>\n<text \7</text>\n<text \8</text>\n<text \9</text>\n<text cursor="pointer" onclick="show_position_details(\2);" ', self._v_my_g_svg[self.write_buffer_index])
-
-        #do this to prevent a participant injecting html or javascript into other participants' browsers
-        self._v_my_g_svg[self.write_buffer_index] = re.sub(r'<text (.*)>(.*)</text>', r'<text \1><![CDATA[\2]]></text>', self._v_my_g_svg[self.write_buffer_index])
+    def _fill_in_values(self) -> str:
+        """ The graph last laid out, with the current prices and
+            probabilities
+        """
+        svg_parts: Final[List[str]] = []
+        for part in self._v_layout_parts:
+            if isinstance(part, str):
+                svg_parts.append(part)
+                continue
+            pos_id, is_price = part
+            price, probability = self._get_position_values(pos_id)
+            if not is_price:
+                svg_parts.append('{:.1f}%'.format(probability))
+            elif price is not None:
+                svg_parts.append('{:.1f}¢'.format(price))
+        return "".join(svg_parts)
+
+    def _prepare_graph(self) -> bool:
+        """ Lays out the graph, once for all of the node and edge
+            updates made since it was last laid out, and draws it with
+            the current prices and probabilities.  If only those have
+            changed, the graph is not laid out again.
+            Returns whether the drawn graph changed, i.e., whether
+            there is a new revision to publish.
+        """
+        gv_graph: Final = self._v_gv_graph \
+            if self._v_gv_graph is not None \
+            else self._build_initial_gv_graph()
+        if self._v_gv_graph_is_stale:
+            self._v_gv_graph_is_stale = False
+            gv_graph.layout(prog="dot")
+            self._v_layout_parts = _split_layout_svg(postprocess_svg(
+                gv_graph.draw(None, "svg")))
+        graph_svg: Final[str] = self._fill_in_values()
+        if graph_svg == self.my_g_svg:
+            return False
+        self._v_my_g_svg[self.write_buffer_index] = graph_svg
         self.my_g_svg = self._v_my_g_svg[self.write_buffer_index]
         swap_index: int = self.write_buffer_index
         self.write_buffer_index = self.read_buffer_index
     #     with self._v_my_wlock:
         self.read_buffer_index = swap_index
+        return True
 
     def get_drawn_graph(self) -> str:
         return self.my_g_svg
@@ -492,6 +860,24 @@ class IssuesDBAccessor:
     def __init__(self, db: ZODB.DB, read_only: bool = False) -> None:
         self._db = db
         self._read_only = read_only
+        self._loads_lock: Final = threading.Lock()
+        #objects loaded from storage (i.e., not found in the object
+        # cache of the connection) by closed contexts
+        self._loads = 0
+
+    class CacheStatus(NamedTuple):
+        """ cached_objects: objects in the caches of the connections
+            non_ghost_objects: those of them that are loaded, not ghosts
+            loads: objects loaded from storage by contexts, i.e., object
+              cache misses
+            storage_cache_hits: records found in the ZEO client cache,
+              if ZEO is used; those not found were loaded from the
+              ZEO server
+        """
+        cached_objects: int
+        non_ghost_objects: int
+        loads: int
+        storage_cache_hits: int
 
     class _Context:
         """ Instantiate a separate _Context per thread
@@ -499,23 +885,54 @@ class IssuesDBAccessor:
         This is to avoid race conditions.  Use instances with
         the context manager (i.e., in 'with' statements).
         """
-        def __init__(self, db: ZODB.DB, read_only: bool) -> None:
-            self._db = db
-            self._read_only = read_only
+        def __init__(self, accessor: 'IssuesDBAccessor') -> None:
+            self._accessor = accessor
 
         def __enter__(self) -> Issues:
-            if self._read_only:
-                self._conn = self._db.open(at=self._db.lastTransaction())
+            # Connections are reused from the pool of the database,
+            # along with their object caches.  (A historical
+            # connection, at the last transaction, would start with
+            # an empty cache after every commit.)
+            if self._accessor._read_only:
+                # in a transaction of its own, synced with the latest
+                # committed transaction, which is aborted on exit
+                self._transaction_manager: Optional[
+                    transaction.TransactionManager] = \
+                    transaction.TransactionManager()
+                self._conn = self._accessor._db.open(
+                    self._transaction_manager)
+                self._transaction_manager.begin()
             else:
-                self._conn = self._db.open()
+                self._transaction_manager = None
+                self._conn = self._accessor._db.open()
             return cast(Issues, self._conn.root().issues)
 
         def __exit__(self, *_: Any) -> None:
+            if self._transaction_manager is not None:
+                self._transaction_manager.abort()
+            self._accessor._add_loads(
+                self._conn.getTransferCounts(clear=True)[0])
             self._conn.close()
 
     def get_context(self) -> _Context:
         # Each thread needs its own context;
         # So, provide it through its own instance of _Context
         # rather than directly through a shared copy of IssuesAccessor.
-        return type(self)._Context(self._db, self._read_only)
+        return type(self)._Context(self)
+
+    def _add_loads(self, loads: int) -> None:
+        with self._loads_lock:
+            self._loads += loads
+
+    def get_cache_status(self) -> 'IssuesDBAccessor.CacheStatus':
+        connection_caches: Final = self._db.cacheDetailSize()
+        storage_cache: Final = getattr(self._db.storage, "_cache", None)
+        with self._loads_lock:
+            loads: Final = self._loads
+        return IssuesDBAccessor.CacheStatus(
+            sum(cache["size"] for cache in connection_caches),
+            sum(cache["ngsize"] for cache in connection_caches),
+            loads,
+            storage_cache.getStats()[4]
+            if hasattr(storage_cache, "getStats") else 0)
 
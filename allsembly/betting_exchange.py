@@ -128,26 +128,71 @@ Purchasing or selling a betting contract depends on there being a
  automated, and that is described in a paper: Berg, Henry and Todd A.
  Proebsting (2009), "Hanson's Automated Market Maker", _Journal of
  Prediction Markets_, Vol. 3, Iss. 1, pp. 45-59.  It is not an
- essential feature but could be added at some point as an 
- enhancement.
+ essential feature, so it is optional (see LmsrMarketMaker and
+ Config.market_maker_liquidity).
 """
 
+import math
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from typing_extensions import Final
+
 import persistent  #type: ignore[import]
 
+from allsembly.price_history import PriceHistory
 from allsembly.speech_act import ProOrCon
 from persistent.list import PersistentList #type: ignore[import]
 from readerwriterlock import rwlock
-#import heapq
-from BTrees.OOBTree import OOBTree #type: ignore[import]
+from BTrees.IIBTree import IITreeSet #type: ignore[import]
+from BTrees.IOBTree import IOBTree #type: ignore[import]
+from BTrees.OOBTree import OOBTree, OOTreeSet #type: ignore[import]
+
+# Prices are in "cents" of a contract between a support bettor and an
+# oppose bettor, whose prices add up to this
+CONTRACT_PRICE: Final = 100.0
+
+
+class Order:
+    """ An order waiting in an OrderBook: a bid to buy, or an ask to
+        sell, amount contracts for one side at price (the price for
+        that side).
+    """
+    def __init__(self, userid: bytes, price: float, amount: int) -> None:
+        self.userid = userid
+        self.price = price
+        self.amount = amount
+
+
+class Fill(NamedTuple):
+    """ amount contracts for the side pro_or_con bought by buyer_userid
+        from seller_userid at price (for that side).  If new_contract
+        is True, they are new contracts between a support bettor (the
+        buyer) and an oppose bettor (the seller, paying
+        CONTRACT_PRICE - price); otherwise, the seller has resold
+        contracts that it held (see OrderBook).
+    """
+    pro_or_con: ProOrCon
+    buyer_userid: bytes
+    seller_userid: bytes
+    price: float
+    amount: int
+    new_contract: bool
+
+
+# the key of an order in one of the queues of an OrderBook:
+# (price sort key, sequence number)
+_QueueKey = Tuple[float, int]
 
 
 class OrderBook(persistent.Persistent):
     """ Order book matching algorithm matches highest bids on each side
         (support or oppose) for pareto optimal matching.
         See https://blogs.cornell.edu/info4220/2016/03/17/nyse-automated-matching-algorithm/
-        For that purpose, each side's orders are stored in priority
-        queues.  (Lists will be made into priority queues using the
-        algorithm from the heapq module of the Python standard library.)
+        For that purpose, each side's orders are stored in queues:
+        BTrees keyed by (price sort key, sequence number), so that the
+        best order has the smallest key.  (Adding or removing an order
+        changes only one bucket of a BTree, so that only that is
+        written to the database, not the whole queue.)
         Re-sale of old betting contracts is accommodated by having
          separate seller queues (self.support_asks and self.oppose_asks).
         Since sellers cannot sell to other sellers, the order book needs
@@ -159,40 +204,783 @@ class OrderBook(persistent.Persistent):
          an old contract, and correspondingly with bids for oppose contracts
          and their counterparts.
         A user also may not buy from or sell to self.
+        Orders are matched in price-time priority: an incoming order is
+         matched with the best priced waiting orders, the earliest
+         first among equally priced ones, at their prices, for as many
+         contracts as it can be (partially filling the last one if
+         need be); whatever is left of it waits in its queue.
+        If the best waiting order that an incoming order would be matched
+         with is by the same user, it is canceled (the user is taken to
+         have changed their mind), so that a user's orders never cross.
+        Each order takes O(log n) time, plus O(log n) for each order
+         filled or canceled, for n waiting orders.
+        (__len__() takes O(n) time, since the BTrees do not keep count.)
     """
+    # for order books stored before orders were matched
+    next_sequence_number = 0
+    # for order books stored before the contracts offered in asks were
+    # counted (see _count_asked())
+    asked_amounts: Optional[OOBTree] = None
+
     def __init__(self) -> None:
-        self.support_bids = PersistentList()
-        self.oppose_bids = PersistentList()
-        self.support_asks = PersistentList()
-        self.oppose_asks = PersistentList()
+        self.support_bids = OOBTree()
+        self.oppose_bids = OOBTree()
+        self.support_asks = OOBTree()
+        self.oppose_asks = OOBTree()
+        self.next_sequence_number = 0
+        # the number of contracts offered in waiting asks, by (userid,
+        # side), where side is the value of the ProOrCon they are for
+        self.asked_amounts = OOBTree()
+
+    def __setstate__(self, state: Dict[Any, Any]) -> None:
+        self.__dict__ = state
+        for name in ("support_bids", "oppose_bids",
+                     "support_asks", "oppose_asks"):
+            if isinstance(state[name], PersistentList):
+                # order book stored when the queues were lists (empty
+                # ones, until orders were matched, then heaps); the
+                # book is stored with the BTrees when the next order
+                # is added to it (see _push())
+                state[name] = OOBTree({(sort_key, sequence_number): order
+                                       for sort_key, sequence_number, order
+                                       in state[name]})
+
+    def _asked_amounts_from_queues(self) -> OOBTree:
+        asked_amounts: Final = OOBTree()
+        for pro_or_con, queue in ((ProOrCon.PRO, self.support_asks),
+                                  (ProOrCon.CON, self.oppose_asks)):
+            for order in queue.values():
+                key = (order.userid, pro_or_con.value)
+                asked_amounts[key] = asked_amounts.get(key, 0) + order.amount
+        return asked_amounts
+
+    def _count_asked(self, queue: OOBTree, userid: bytes,
+                     amount: int) -> None:
+        """ If queue is one of the ask queues, adds amount (negative
+            for contracts taken off) to the number of contracts offered
+            by the user in it.  Call before changing the queue.
+        """
+        pro_or_con: Final = ProOrCon.PRO if queue is self.support_asks \
+            else ProOrCon.CON if queue is self.oppose_asks \
+            else None
+        if pro_or_con is None:
+            return
+        if self.asked_amounts is None:
+            self.asked_amounts = self._asked_amounts_from_queues()
+        key: Final = (userid, pro_or_con.value)
+        total: Final = self.asked_amounts.get(key, 0) + amount
+        if total:
+            self.asked_amounts[key] = total
+        elif key in self.asked_amounts:
+            del self.asked_amounts[key]
+
+    def _push(self, queue: OOBTree, sort_key: float, order: Order) -> None:
+        self._count_asked(queue, order.userid, order.amount)
+        queue[(sort_key, self.next_sequence_number)] = order
+        self.next_sequence_number += 1
+
+    @staticmethod
+    def _best(queue: OOBTree) -> Optional[Tuple[_QueueKey, Order]]:
+        if not queue:
+            return None
+        key: Final[_QueueKey] = queue.minKey()
+        return key, queue[key]
+
+    def _reduce(self, queue: OOBTree, key: _QueueKey, order: Order,
+                amount: int) -> None:
+        """ Takes amount contracts off the waiting order with the key,
+            removing it if none are left
+        """
+        self._count_asked(queue, order.userid, -amount)
+        order.amount -= amount
+        if order.amount == 0:
+            del queue[key]
+        else:
+            # the order is stored in the BTree's bucket, so it has to
+            # be stored again for the change to be saved
+            queue[key] = order
+
+    def _match(self, order: Order,
+               counter_queues: List[Tuple[OOBTree,
+                                          Callable[[float], float],
+                                          Callable[[Order, int], Fill]]],
+               is_bid: bool) -> List[Fill]:
+        """ Matches order with the waiting orders in counter_queues,
+            each given with a function converting their prices to the
+            price for order's side and a function making the Fill for
+            an amount of a waiting order.  A bid is matched with the
+            lowest prices at most its price; an ask, with the highest
+            prices at least its price.
+        """
+        fills: Final[List[Fill]] = []
+        while order.amount > 0:
+            best: Optional[Tuple[float, _QueueKey, OOBTree, Order,
+                                 Callable[[Order, int], Fill]]] = None
+            for queue, to_order_price, make_fill in counter_queues:
+                entry = self._best(queue)
+                if entry is None:
+                    continue
+                key, waiting_order = entry
+                price = to_order_price(waiting_order.price)
+                if best is None or \
+                        (price < best[0] if is_bid else price > best[0]) or \
+                        (price == best[0] and key[1] < best[1][1]):
+                    best = (price, key, queue, waiting_order, make_fill)
+            if best is None or \
+                    (best[0] > order.price if is_bid else best[0] < order.price):
+                break
+            _, key, queue, waiting_order, make_fill = best
+            if waiting_order.userid == order.userid:
+                # self-trade prevention
+                self._reduce(queue, key, waiting_order, waiting_order.amount)
+                continue
+            amount = min(order.amount, waiting_order.amount)
+            fills.append(make_fill(waiting_order, amount))
+            order.amount -= amount
+            self._reduce(queue, key, waiting_order, amount)
+        return fills
+
+    def place_bid(self, userid: bytes, pro_or_con: ProOrCon,
+                  price: float, amount: int) -> List[Fill]:
+        """ Places a bid to buy amount contracts for the side pro_or_con
+            at (at most) price for that side.  Returns the fills.
+        """
+        order: Final = Order(userid, price, amount)
+        fills: Final[List[Fill]]
+        if pro_or_con is ProOrCon.PRO:
+            fills = self._match(
+                order,
+                [(self.oppose_bids,
+                  lambda oppose_price: CONTRACT_PRICE - oppose_price,
+                  lambda waiting, amount: Fill(
+                      ProOrCon.PRO, userid, waiting.userid,
+                      CONTRACT_PRICE - waiting.price, amount, True)),
+                 (self.support_asks,
+                  lambda ask_price: ask_price,
+                  lambda waiting, amount: Fill(
+                      ProOrCon.PRO, userid, waiting.userid,
+                      waiting.price, amount, False))],
+                is_bid=True)
+            if order.amount:
+                self._push(self.support_bids, -price, order)
+        else:
+            fills = self._match(
+                order,
+                [(self.support_bids,
+                  lambda support_price: CONTRACT_PRICE - support_price,
+                  lambda waiting, amount: Fill(
+                      ProOrCon.PRO, waiting.userid, userid,
+                      waiting.price, amount, True)),
+                 (self.oppose_asks,
+                  lambda ask_price: ask_price,
+                  lambda waiting, amount: Fill(
+                      ProOrCon.CON, userid, waiting.userid,
+                      waiting.price, amount, False))],
+                is_bid=True)
+            if order.amount:
+                self._push(self.oppose_bids, -price, order)
+        return fills
+
+    def place_ask(self, userid: bytes, pro_or_con: ProOrCon,
+                  price: float, amount: int) -> List[Fill]:
+        """ Places an ask to sell amount contracts for the side
+            pro_or_con, held by the user, at (at least) price for that
+            side.  Returns the fills.
+            (Whether the user holds the contracts is not checked here;
+            see BettingExchange.place_ask().)
+        """
+        order: Final = Order(userid, price, amount)
+        bids: Final = self.support_bids \
+            if pro_or_con is ProOrCon.PRO \
+            else self.oppose_bids
+        fills: Final = self._match(
+            order,
+            [(bids,
+              lambda bid_price: bid_price,
+              lambda waiting, amount: Fill(
+                  pro_or_con, waiting.userid, userid,
+                  waiting.price, amount, False))],
+            is_bid=False)
+        if order.amount:
+            self._push(self.support_asks
+                       if pro_or_con is ProOrCon.PRO
+                       else self.oppose_asks,
+                       price, order)
+        return fills
+
+    def get_asked_amount(self, userid: bytes, pro_or_con: ProOrCon) -> int:
+        """ The number of contracts for the side pro_or_con offered by
+            the user in asks waiting in the order book
+        """
+        asked_amounts: Final = self.asked_amounts \
+            if self.asked_amounts is not None \
+            else self._asked_amounts_from_queues()
+        return asked_amounts.get((userid, pro_or_con.value), 0)
+
+    def add_bid(self, userid: bytes, pro_or_con: ProOrCon,
+                price: float, amount: int) -> None:
+        """ Adds a bid like place_bid() does, but without matching it,
+            to wait for the next call auction (see clear_auction())
+        """
+        if pro_or_con is ProOrCon.PRO:
+            self._push(self.support_bids, -price,
+                       Order(userid, price, amount))
+        else:
+            self._push(self.oppose_bids, -price,
+                       Order(userid, price, amount))
+
+    def clear_auction(self) -> List[Fill]:
+        """ Clears a call auction among the waiting bids: matches the
+            highest support bids with the highest oppose bids, as long
+            as they cross, all at a single price, the midpoint of the
+            last (marginal) pair matched.  That makes as many contracts
+            as can be made, and an order placed a little earlier or
+            later in the auction gets the same price.
+            Bids by the same user are not matched; the earlier one is
+            canceled (as in place_bid()).
+            Only bids are matched; asks are matched when they are
+            placed.  Returns the fills.
+        """
+        # (support bidder, oppose bidder, amount)
+        matches: Final[List[Tuple[bytes, bytes, int]]] = []
+        marginal_prices = (0.0, 0.0)
+        while True:
+            support_entry = self._best(self.support_bids)
+            oppose_entry = self._best(self.oppose_bids)
+            if support_entry is None or oppose_entry is None:
+                break
+            support_key, support_bid = support_entry
+            oppose_key, oppose_bid = oppose_entry
+            if support_bid.price + oppose_bid.price < CONTRACT_PRICE:
+                break
+            if support_bid.userid == oppose_bid.userid:
+                if support_key[1] < oppose_key[1]:
+                    del self.support_bids[support_key]
+                else:
+                    del self.oppose_bids[oppose_key]
+                continue
+            amount = min(support_bid.amount, oppose_bid.amount)
+            matches.append((support_bid.userid, oppose_bid.userid, amount))
+            marginal_prices = (support_bid.price,
+                               CONTRACT_PRICE - oppose_bid.price)
+            self._reduce(self.support_bids, support_key, support_bid, amount)
+            self._reduce(self.oppose_bids, oppose_key, oppose_bid, amount)
+        clearing_price: Final = sum(marginal_prices) / 2.0
+        return [Fill(ProOrCon.PRO, support_userid, oppose_userid,
+                     clearing_price, amount, True)
+                for support_userid, oppose_userid, amount in matches]
+
+    def __len__(self) -> int:
+        """ The number of waiting orders """
+        return len(self.support_bids) + len(self.oppose_bids) + \
+            len(self.support_asks) + len(self.oppose_asks)
+
+
+def _support_price(fill: Fill) -> float:
+    return fill.price \
+        if fill.pro_or_con is ProOrCon.PRO \
+        else CONTRACT_PRICE - fill.price
+
+
+# the userid given in the Fills of contracts made with or sold to
+# a market maker
+MARKET_MAKER_USERID: Final = b""
+
+
+class LmsrMarketMaker(persistent.Persistent):
+    """ An automated market maker using Hanson's logarithmic market
+        scoring rule (LMSR; see Berg and Proebsting (2009), cited in
+        the module docstring), which takes the other side of every
+        order, so that orders are filled at once, without waiting for
+        a counterpart.
+        It keeps the number of support and oppose contracts that it
+        has made (net of those sold back to it), q_s and q_o, and
+        charges for them by the cost function
+         C(q_s, q_o) = b * ln(exp(q_s / b) + exp(q_o / b))
+         (times CONTRACT_PRICE);
+         buying contracts costs the change in C.  The support price
+         is the derivative, 1 / (1 + exp((q_o - q_s) / b)), so it is
+         updated in O(1) time.
+        The liquidity, b, is how many contracts it takes to move the
+         price much: the higher it is, the more slowly the price moves,
+         and the more the market maker can lose (at most
+         b * ln(2) * CONTRACT_PRICE).
+    """
+    def __init__(self, liquidity: float) -> None:
+        self.liquidity = liquidity
+        self.support_quantity = 0.0
+        self.oppose_quantity = 0.0
+
+    def _cost(self, support_quantity: float,
+              oppose_quantity: float) -> float:
+        b: Final = self.liquidity
+        highest: Final = max(support_quantity, oppose_quantity)
+        return CONTRACT_PRICE * (
+            highest
+            + b * math.log(math.exp((support_quantity - highest) / b)
+                           + math.exp((oppose_quantity - highest) / b)))
+
+    def get_support_price(self) -> float:
+        return CONTRACT_PRICE / (
+            1.0 + math.exp((self.oppose_quantity - self.support_quantity)
+                           / self.liquidity))
+
+    def _quantity_difference_at(self, support_price: float) -> float:
+        """ The value of q_s - q_o at which the support price is
+            support_price
+        """
+        if support_price >= CONTRACT_PRICE:
+            return math.inf
+        if support_price <= 0.0:
+            return -math.inf
+        return self.liquidity * math.log(support_price
+                                         / (CONTRACT_PRICE - support_price))
+
+    def _trade(self, pro_or_con: ProOrCon, amount: int) -> float:
+        """ Adds amount (negative to take back) contracts for the side
+            pro_or_con; returns their price per contract
+        """
+        cost_before: Final = self._cost(self.support_quantity,
+                                        self.oppose_quantity)
+        if pro_or_con is ProOrCon.PRO:
+            self.support_quantity += amount
+        else:
+            self.oppose_quantity += amount
+        return (self._cost(self.support_quantity, self.oppose_quantity)
+                - cost_before) / amount
+
+    def _fillable_amount(self, pro_or_con: ProOrCon, price: float,
+                         amount: int, is_bid: bool) -> int:
+        """ As many of amount contracts as can be bought (or, if not
+            is_bid, sold) before the price for the side pro_or_con
+            passes price, so that the price per contract does not
+            either
+        """
+        support_price: Final = price \
+            if pro_or_con is ProOrCon.PRO \
+            else CONTRACT_PRICE - price
+        difference: Final = self.support_quantity - self.oppose_quantity
+        # buying support or selling oppose increases q_s - q_o
+        increases: Final = (pro_or_con is ProOrCon.PRO) == is_bid
+        room: Final = \
+            self._quantity_difference_at(support_price) - difference \
+            if increases \
+            else difference - self._quantity_difference_at(support_price)
+        if room >= amount:
+            return amount
+        # (room is -inf at a price of 0 or CONTRACT_PRICE, which the
+        # market maker's prices never reach)
+        if not math.isfinite(room) or room <= 0:
+            return 0
+        # (a little less, for rounding errors)
+        return max(0, math.floor(room - 1e-9))
+
+    def place_bid(self, userid: bytes, pro_or_con: ProOrCon,
+                  price: float, amount: int) -> Tuple[List[Fill], int]:
+        """ Sells to a bid for amount contracts for the side pro_or_con
+            at (at most) price, as many as it can.
+            Returns the fills and the amount not filled.
+        """
+        filled: Final = self._fillable_amount(pro_or_con, price, amount,
+                                              is_bid=True)
+        if filled == 0:
+            return [], amount
+        fill_price: Final = self._trade(pro_or_con, filled)
+        # new contracts with the market maker on the other side
+        fill: Final = \
+            Fill(ProOrCon.PRO, userid, MARKET_MAKER_USERID,
+                 fill_price, filled, True) \
+            if pro_or_con is ProOrCon.PRO \
+            else Fill(ProOrCon.PRO, MARKET_MAKER_USERID, userid,
+                      CONTRACT_PRICE - fill_price, filled, True)
+        return [fill], amount - filled
+
+    def place_ask(self, userid: bytes, pro_or_con: ProOrCon,
+                  price: float, amount: int) -> Tuple[List[Fill], int]:
+        """ Buys back from an ask amount contracts for the side
+            pro_or_con at (at least) price, as many as it can.
+            Returns the fills and the amount not filled.
+        """
+        filled: Final = self._fillable_amount(pro_or_con, price, amount,
+                                              is_bid=False)
+        if filled == 0:
+            return [], amount
+        fill_price: Final = self._trade(pro_or_con, -filled)
+        return ([Fill(pro_or_con, MARKET_MAKER_USERID, userid,
+                      fill_price, filled, False)],
+                amount - filled)
+
 
 class BettingMarket(persistent.Persistent):
-    def __init__(self) -> None:
+    """ The market for one position.  Orders are matched in its order
+        book, unless it has a market maker (see LmsrMarketMaker), which
+        fills them instead.  (What is left of an order that the market
+        maker would only fill past its price waits in the order book.)
+    """
+    # for markets stored before there were market makers
+    market_maker: Optional[LmsrMarketMaker] = None
+    # the support price quoted by the latest bid waiting for the next
+    # call auction, if any (see add_bid())
+    auction_quote: Optional[float] = None
+    # for markets stored before there was a price history
+    price_history: Optional[PriceHistory] = None
+
+    def __init__(self,
+                 market_maker: Optional[LmsrMarketMaker] = None) -> None:
         self.market_id = int()
         self.orders = OrderBook()
-        self.support_ledger_ref = OOBTree()
-        self.oppose_ledger_ref = OOBTree()
-        self.last_support_price = float(50.0)
+        self.market_maker = market_maker
+        self.last_support_price = float(50.0) \
+            if market_maker is None \
+            else market_maker.get_support_price()
+        # the support prices set since the market was made
+        self.price_history = PriceHistory()
+
+    def _set_price(self, support_price: float) -> None:
+        self.last_support_price = support_price
+        if self.price_history is None:
+            self.price_history = PriceHistory()
+        self.price_history.append(time.time(), support_price)
+
+    def _update_price(self, fills: List[Fill],
+                      quoted_support_price: float) -> None:
+        if self.market_maker is not None:
+            self._set_price(self.market_maker.get_support_price())
+            return
+        # The price of the last contract made or sold, or, if the order
+        # was not matched, the price it quotes, as the best available
+        # information (e.g., when one user is betting alone).
+        self._set_price(_support_price(fills[-1])
+                        if fills
+                        else quoted_support_price)
+
+    def place_bid(self, userid: bytes, pro_or_con: ProOrCon,
+                  price: float, amount: int = 1) -> List[Fill]:
+        """ See OrderBook.place_bid() and LmsrMarketMaker.place_bid() """
+        fills: List[Fill] = []
+        if self.market_maker is not None:
+            fills, amount = self.market_maker.place_bid(userid, pro_or_con,
+                                                        price, amount)
+        if amount:
+            fills += self.orders.place_bid(userid, pro_or_con, price,
+                                           amount)
+        self._update_price(fills,
+                           price
+                           if pro_or_con is ProOrCon.PRO
+                           else CONTRACT_PRICE - price)
+        return fills
+
+    def place_ask(self, userid: bytes, pro_or_con: ProOrCon,
+                  price: float, amount: int = 1) -> List[Fill]:
+        """ See OrderBook.place_ask() and LmsrMarketMaker.place_ask() """
+        fills: List[Fill] = []
+        if self.market_maker is not None:
+            fills, amount = self.market_maker.place_ask(userid, pro_or_con,
+                                                        price, amount)
+        if amount:
+            fills += self.orders.place_ask(userid, pro_or_con, price,
+                                           amount)
+        self._update_price(fills,
+                           price
+                           if pro_or_con is ProOrCon.PRO
+                           else CONTRACT_PRICE - price)
+        return fills
+
+    def add_bid(self, userid: bytes, pro_or_con: ProOrCon,
+                price: float, amount: int = 1) -> None:
+        """ See OrderBook.add_bid() """
+        self.orders.add_bid(userid, pro_or_con, price, amount)
+        self.auction_quote = price \
+            if pro_or_con is ProOrCon.PRO \
+            else CONTRACT_PRICE - price
+
+    def clear_auction(self) -> List[Fill]:
+        """ See OrderBook.clear_auction() """
+        fills: Final = self.orders.clear_auction()
+        # the clearing price or, as in _update_price(), the latest quote
+        if fills:
+            self._set_price(_support_price(fills[-1]))
+        elif self.auction_quote is not None:
+            self._set_price(self.auction_quote)
+        self.auction_quote = None
+        return fills
+
+
+class ContractSale(NamedTuple):
+    """ A line of the ledger recording that amount of the contracts of
+        a BettingContract, for the side pro_or_con, were sold by
+        seller_userid to buyer_userid at price (for that side)
+    """
+    pro_or_con: ProOrCon
+    seller_userid: bytes
+    buyer_userid: bytes
+    price: float
+    amount: int
+
+
+class BettingContract(persistent.Persistent):
+    """ A record, in the Ledger, of amount betting contracts made in
+        the market for the position market_id at price (the support
+        price) between support_userid and oppose_userid.  Those are
+        never changed.  When contracts are resold, the sale is recorded
+        in sales, and support_owner or oppose_owner is changed to the
+        buyer, so that the current owners are found without following
+        the chain of sales.  If only some of the contracts are sold,
+        they are split off into a new record first (see split_from).
+    """
+    def __init__(self, contract_id: int, market_id: int,
+                 support_userid: bytes, oppose_userid: bytes,
+                 price: float, amount: int,
+                 split_from: Optional['BettingContract'] = None) -> None:
+        self.contract_id = contract_id
+        self.market_id = market_id
+        self.support_userid = support_userid
+        self.oppose_userid = oppose_userid
+        self.price = price
+        self.amount = amount
+        # the id of the record that this one's contracts were split
+        # off from, whose owners they had
+        self.split_from: Optional[int] = None
+        self.support_owner = support_userid
+        self.oppose_owner = oppose_userid
+        if split_from is not None:
+            self.split_from = split_from.contract_id
+            self.support_owner = split_from.support_owner
+            self.oppose_owner = split_from.oppose_owner
+        self.sales: Tuple[ContractSale, ...] = ()
+
+    def get_owner(self, pro_or_con: ProOrCon) -> bytes:
+        return self.support_owner \
+            if pro_or_con is ProOrCon.PRO \
+            else self.oppose_owner
 
-#    def add_orders(self, order_q: OrderQueue) -> None:
-#        #stub
-#        pass
+    def get_price(self, pro_or_con: ProOrCon) -> float:
+        """ The price paid for the side pro_or_con when the contracts
+            were made
+        """
+        return self.price \
+            if pro_or_con is ProOrCon.PRO \
+            else CONTRACT_PRICE - self.price
+
+
+class Ledger(persistent.Persistent):
+    """ Keeps track of the betting contracts made in the markets of a
+        BettingExchange and of their resales (see the module docstring).
+        The contract records are indexed in BTrees by contract id,
+        by current owner, and by market, so that finding the owners of
+        a contract, the contracts held by a user (their commitment
+        store), or the contracts made in a market takes O(log n) time
+        (plus the number of contracts found).
+    """
+    def __init__(self) -> None:
+        # BettingContract by contract id
+        self.contracts = IOBTree()
+        # (owner's userid, market id, side, contract id) of each side of
+        # each contract, where side is the value of its ProOrCon
+        self.by_owner = OOTreeSet()
+        # (market id, contract id)
+        self.by_market = OOTreeSet()
+        self.next_contract_id = 0
+
+    def _add_contract(self, market_id: int, support_userid: bytes,
+                      oppose_userid: bytes, price: float, amount: int,
+                      split_from: Optional[BettingContract] = None
+                      ) -> BettingContract:
+        contract: Final = BettingContract(self.next_contract_id, market_id,
+                                          support_userid, oppose_userid,
+                                          price, amount, split_from)
+        self.next_contract_id += 1
+        self.contracts[contract.contract_id] = contract
+        self.by_market.add((market_id, contract.contract_id))
+        for pro_or_con in ProOrCon:
+            self.by_owner.add((contract.get_owner(pro_or_con), market_id,
+                               pro_or_con.value, contract.contract_id))
+        return contract
+
+    def _owned_contract_ids(self, userid: bytes, market_id: int,
+                            pro_or_con: ProOrCon) -> List[int]:
+        """ The ids of the contracts whose side pro_or_con is held by
+            the user, oldest first
+        """
+        return [key[3]
+                for key in self.by_owner.keys(
+                    min=(userid, market_id, pro_or_con.value),
+                    max=(userid, market_id, pro_or_con.value + 1),
+                    excludemax=True)]
+
+    def _transfer(self, market_id: int, fill: Fill) -> None:
+        """ Transfers the contracts sold in fill from the seller to
+            the buyer, the seller's oldest first.
+            (The seller is assumed to hold them; see record_fills().)
+        """
+        pro_or_con: Final = fill.pro_or_con
+        remaining = fill.amount
+        for contract_id in self._owned_contract_ids(fill.seller_userid,
+                                                    market_id, pro_or_con):
+            if remaining == 0:
+                break
+            contract = self.contracts[contract_id]
+            if contract.amount > remaining:
+                # only some of them are sold
+                contract.amount -= remaining
+                contract = self._add_contract(
+                    market_id, contract.support_userid,
+                    contract.oppose_userid, contract.price, remaining,
+                    contract)
+            self.by_owner.remove((fill.seller_userid, market_id,
+                                  pro_or_con.value, contract.contract_id))
+            self.by_owner.add((fill.buyer_userid, market_id,
+                               pro_or_con.value, contract.contract_id))
+            if pro_or_con is ProOrCon.PRO:
+                contract.support_owner = fill.buyer_userid
+            else:
+                contract.oppose_owner = fill.buyer_userid
+            contract.sales += (ContractSale(pro_or_con, fill.seller_userid,
+                                            fill.buyer_userid, fill.price,
+                                            contract.amount),)
+            remaining -= contract.amount
+
+    def record_fills(self, market_id: int, fills: List[Fill]) -> None:
+        """ Records the fills of an order placed in the market for the
+            position market_id (see OrderBook and LmsrMarketMaker).
+            Raises ValueError, without recording any of them, if the
+            seller of a resale does not hold the contracts sold (after
+            the fills before it).
+        """
+        # changes of the holdings by the fills before each one, by
+        # (userid, side)
+        changes: Final[Dict[Tuple[bytes, ProOrCon], int]] = {}
+        for fill in fills:
+            if fill.new_contract:
+                for key in ((fill.buyer_userid, ProOrCon.PRO),
+                            (fill.seller_userid, ProOrCon.CON)):
+                    changes[key] = changes.get(key, 0) + fill.amount
+                continue
+            seller_key = (fill.seller_userid, fill.pro_or_con)
+            buyer_key = (fill.buyer_userid, fill.pro_or_con)
+            if self.get_holdings(fill.seller_userid, market_id,
+                                 fill.pro_or_con) \
+                    + changes.get(seller_key, 0) < fill.amount:
+                raise ValueError("the seller does not hold the contracts sold")
+            changes[seller_key] = changes.get(seller_key, 0) - fill.amount
+            changes[buyer_key] = changes.get(buyer_key, 0) + fill.amount
+        for fill in fills:
+            if fill.new_contract:
+                self._add_contract(market_id, fill.buyer_userid,
+                                   fill.seller_userid, fill.price,
+                                   fill.amount)
+            else:
+                self._transfer(market_id, fill)
+
+    def get_contract(self, contract_id: int) -> Optional[BettingContract]:
+        return self.contracts.get(contract_id)
+
+    def get_owners(self, contract_id: int) -> Optional[Tuple[bytes, bytes]]:
+        """ The current owners of the support and the oppose side of
+            the contracts, or None if there is no such contract
+        """
+        contract: Final = self.contracts.get(contract_id)
+        return (contract.support_owner, contract.oppose_owner) \
+            if contract is not None \
+            else None
+
+    def get_commitments(self, userid: bytes
+                        ) -> List[Tuple[ProOrCon, BettingContract]]:
+        """ The contracts held by the user and the side of each that
+            the user holds, by market, oldest first
+        """
+        return [(ProOrCon(side), self.contracts[contract_id])
+                for _, _, side, contract_id in self.by_owner.keys(
+                    min=(userid,), max=(userid, math.inf))]
+
+    def get_holdings(self, userid: bytes, market_id: int,
+                     pro_or_con: ProOrCon) -> int:
+        """ The number of contracts for the side pro_or_con in the
+            market for the position market_id held by the user
+        """
+        return sum(self.contracts[contract_id].amount
+                   for contract_id in self._owned_contract_ids(
+                       userid, market_id, pro_or_con))
+
+    def get_market_contracts(self, market_id: int) -> List[BettingContract]:
+        return [self.contracts[contract_id]
+                for _, contract_id in self.by_market.keys(
+                    min=(market_id,), max=(market_id, math.inf))]
 
-    def fill_orders_by_matching(self) -> None:
-        #stub
-        pass
 
 class BettingExchange(persistent.Persistent):
     """ A container for all of the markets.
         There is only one per issue.
     """
     _v_my_rwlock = rwlock.RWLockWrite()
+    # for exchanges stored before there was a ledger
+    ledger: Optional[Ledger] = None
+    # the ids of the markets with bids waiting for the next call
+    # auction (see add_auction_bid()); None if there have been none
+    auction_market_ids: Optional[IITreeSet] = None
+
     def __init__(self) -> None:
         self.markets = OOBTree()
-        self.support_ledger = OOBTree() #bidding contracts by: support
-                                   #bet user, oppose bet user, &
-                                   #contract number
-        self.oppose_ledger = OOBTree() #as above, but with oppose user
-                                  #as first value in key
+        # the betting contracts made in the markets
+        self.ledger = Ledger()
         self._v_my_wlock = BettingExchange._v_my_rwlock.gen_wlock()
         self._v_my_rlock = BettingExchange._v_my_rwlock.gen_rlock()
+
+    def record_fills(self, market_id: int, fills: List[Fill]) -> None:
+        """ See Ledger.record_fills() """
+        if not fills:
+            return
+        if self.ledger is None:
+            self.ledger = Ledger()
+        self.ledger.record_fills(market_id, fills)
+
+    def place_ask(self, market_id: int, userid: bytes,
+                  pro_or_con: ProOrCon, price: float,
+                  amount: int = 1) -> List[Fill]:
+        """ Places an ask in the market for the position market_id to
+            sell amount contracts for the side pro_or_con held by the
+            user (see BettingMarket.place_ask()) and records the fills.
+            Raises ValueError, without placing it, if the user does not
+            hold that many contracts besides those offered in the
+            user's asks already waiting.
+        """
+        market: Final = self.markets[market_id]
+        holdings: Final = \
+            self.ledger.get_holdings(userid, market_id, pro_or_con) \
+            if self.ledger is not None \
+            else 0
+        if holdings - market.orders.get_asked_amount(userid, pro_or_con) \
+                < amount:
+            raise ValueError("the user does not hold the contracts offered")
+        fills: Final = market.place_ask(userid, pro_or_con, price, amount)
+        self.record_fills(market_id, fills)
+        return fills
+
+    def add_auction_bid(self, market_id: int, userid: bytes,
+                        pro_or_con: ProOrCon, price: float,
+                        amount: int = 1) -> None:
+        """ Adds a bid to the market for the position market_id, to be
+            matched in the next call auction (see clear_auctions())
+        """
+        self.markets[market_id].add_bid(userid, pro_or_con, price, amount)
+        if self.auction_market_ids is None:
+            self.auction_market_ids = IITreeSet()
+        self.auction_market_ids.add(market_id)
+
+    def clear_auctions(self) -> List[int]:
+        """ Clears the call auctions of the markets with bids added
+            since the last time (see BettingMarket.clear_auction()) and
+            records the fills.
+            Returns the ids of the markets whose price changed.
+        """
+        if not self.auction_market_ids:
+            return []
+        repriced_market_ids: Final[List[int]] = []
+        for market_id in self.auction_market_ids:
+            market = self.markets[market_id]
+            last_support_price = market.last_support_price
+            self.record_fills(market_id, market.clear_auction())
+            if market.last_support_price != last_support_price:
+                repriced_market_ids.append(market_id)
+        self.auction_market_ids.clear()
+        return repriced_market_ids
@@ -17,7 +17,8 @@
 #   <https://www.gnu.org/licenses/>.
 #
 
-from typing import TypeVar, Generic
+import threading
+from typing import TypeVar, Generic, Optional
 from typing_extensions import Final
 
 T = TypeVar('T')
@@ -86,3 +87,47 @@ class FinalVar(Generic[T]):
     def get(self) -> T:
         return self._value
 
+
+class RevisionCounter:
+    """ A revision number that threads can wait on to change.
+    Unlike setting and immediately clearing a threading.Event,
+    this does not let a waiter miss an update made just before it
+    starts waiting, because the waiter says which revision it
+    last saw.
+    """
+    def __init__(self, revision_number: int = 0):
+        self._cond: Final = threading.Condition()
+        self._revision_number = revision_number
+        # changed by reset() so that waiters return even if the
+        # revision number is reset to the one they last saw
+        self._epoch = 0
+
+    def get(self) -> int:
+        return self._revision_number
+
+    def set(self, revision_number: int) -> None:
+        """ Sets the revision number and wakes all waiters.
+        """
+        with self._cond:
+            self._revision_number = revision_number
+            self._cond.notify_all()
+
+    def reset(self) -> None:
+        with self._cond:
+            self._revision_number = 0
+            self._epoch += 1
+            self._cond.notify_all()
+
+    def wait_for_change(self, last_seen_revision_number: int,
+                        timeout: Optional[float] = None) -> bool:
+        """ Returns as soon as the revision number differs from
+        last_seen_revision_number (immediately if it already does)
+        or it is reset; returns False if that did not happen before
+        the timeout.
+        """
+        with self._cond:
+            epoch: Final[int] = self._epoch
+            return self._cond.wait_for(
+                lambda: self._revision_number != last_seen_revision_number
+                        or self._epoch != epoch,
+                timeout)
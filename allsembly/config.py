@@ -20,6 +20,8 @@
 """ Globally available config settings
 """
 
+from typing import Optional
+
 from allsembly import CONSTANTS
 from allsembly.CONSTANTS import UserPasswordType
 
@@ -74,6 +76,101 @@ class Config:
     #whether to store userid as plaintext or as a secure hash of the userid
     store_userid_as_hashed_userid = True #currently not used
     long_polling_timeout_seconds = 60.0
+    # maximum number of issues whose most recently drawn graph is kept
+    # in memory by the RPyC server, to be returned without reading it
+    # from the database; the least recently requested are evicted
+    graph_snapshot_cache_max_issues = 1000
+    # number of the most recent revisions of each argument graph whose
+    # changes are kept, so that clients can get just the changes since
+    # the revision they have
+    graph_change_log_max_revisions = 100
+    # number of worker processes for Problog inference;
+    # zero to calculate probabilities synchronously when
+    # the argument graph is updated
+    inference_worker_processes = 0
+    # how long to wait after an issue is first updated before
+    # recalculating its probabilities and redrawing its graph,
+    # so that a burst of updates is handled all at once;
+    # zero to do it at the end of each batch of queue processing
+    graph_update_debounce_msec = 0
+    # connections to the RPyC server kept open by each client process
+    # (e.g., each web server worker); see rpyc_client.RpycConnectionPool
+    rpyc_client_pool_max_connections = 20
+    # how long a pooled connection may be idle before it is checked
+    # that the server still responds
+    rpyc_client_pool_health_check_seconds = 30.0
+    # how long a client thread waits for a pooled connection when all
+    # of them are in use before giving up (and, e.g., telling the
+    # browser to try again)
+    rpyc_client_pool_acquire_timeout_seconds = 10.0
+    # connections to the RPyC server kept open by each client process
+    # for long polling (see GraphRequest.subscribe_next_graph()), which
+    # holds a connection while waiting; a separate pool, so that long
+    # polls do not hold up other requests
+    rpyc_client_long_polling_pool_max_connections = 100
+    # queue items to process before committing them to the database
+    # together (each commit is a write and sync to disk);
+    # 1 to commit after every item
+    group_commit_max_items = 1
+    # also commit once the first uncommitted item was processed this
+    # many milliseconds ago; zero for no time limit.  (The items
+    # processed are always committed at the end of each batch of
+    # queue processing, anyway.)
+    group_commit_max_msec = 0
+    # most commands for one issue to process in a batch before
+    # turning to the commands queued for other issues
+    max_commands_per_issue_batch = 100
+    # what clients are told to wait before trying again
+    # when the command queue is full
+    command_queue_retry_after_seconds = 2.0
+    # number of worker processes that the issues are divided among
+    # (by hashing their ids); each processes the commands for its
+    # issues and updates their graphs and probabilities; the
+    # processes share the database through a ZEO server.
+    # zero to process all issues in the main server process
+    issue_shard_processes = 0
+    # how many times an issue shard tries to commit a transaction
+    # that conflicts with another process's
+    issue_shard_commit_attempts = 5
+    # "file" to open the argument database file directly, which only
+    # one process can do; or "zeo" to use it through a ZEO server, so
+    # that other processes (e.g., readers) can open it, too.  The ZEO
+    # server is started by the Allsembly server unless
+    # argument_db_zeo_address is set.  (Issue shard processes always
+    # use ZEO.)
+    argument_db_storage = "file"
+    # "host:port" or socket path of an already running ZEO server
+    # serving the argument database
+    argument_db_zeo_address: Optional[str] = None
+    # size of the cache of database records kept by each ZEO client
+    # (i.e., each process using the database)
+    zeo_client_cache_size_mb = 100
+    # maximum number of connections to the argument database kept open
+    # for reuse, along with their object caches (more may be opened;
+    # e.g., one per thread reading graphs)
+    argument_db_pool_size = 7
+    # target number of objects kept in the object cache of each
+    # connection to the argument database
+    argument_db_cache_size = 400
+    # target size of the object cache of each connection to the
+    # argument database, in megabytes; zero for no limit
+    argument_db_cache_size_mb = 0
+    # liquidity of the automated market maker (see
+    # betting_exchange.LmsrMarketMaker) given to each new betting
+    # market, in contracts: how many it takes to move the price much;
+    # zero for no market maker, so that orders wait in the order book
+    # until they are matched with other users' orders
+    market_maker_liquidity = 0.0
+    # how long to collect the bids placed in an issue's markets before
+    # clearing them all at once in a call auction (at one price per
+    # market), committing the fills together and updating the
+    # probabilities once; zero to match each bid as it is placed.
+    # (Markets with a market maker always fill bids as they are placed.)
+    call_auction_interval_msec = 0
+    # the most buckets of prices returned for a request for the price
+    # history of a market; for a longer span of time, the buckets are
+    # made wider
+    price_history_max_buckets = 1000
 
 
 def set_config(
@@ -90,7 +187,39 @@ def set_config(
         user_password_type: UserPasswordType = Config.user_password_type,
         rpyc_server_default_port: int = Config.rpyc_server_default_port,
         rpyc_server_default_address: str = Config.rpyc_server_default_address,
-        rpyc_server_default_ipv6: bool = Config.rpyc_server_default_ipv6
+        rpyc_server_default_ipv6: bool = Config.rpyc_server_default_ipv6,
+        inference_worker_processes: int = Config.inference_worker_processes,
+        graph_update_debounce_msec: int = Config.graph_update_debounce_msec,
+        rpyc_client_pool_max_connections: int =
+        Config.rpyc_client_pool_max_connections,
+        rpyc_client_pool_health_check_seconds: float =
+        Config.rpyc_client_pool_health_check_seconds,
+        rpyc_client_pool_acquire_timeout_seconds: float =
+        Config.rpyc_client_pool_acquire_timeout_seconds,
+        rpyc_client_long_polling_pool_max_connections: int =
+        Config.rpyc_client_long_polling_pool_max_connections,
+        group_commit_max_items: int = Config.group_commit_max_items,
+        group_commit_max_msec: int = Config.group_commit_max_msec,
+        max_commands_per_issue_batch: int =
+        Config.max_commands_per_issue_batch,
+        command_queue_retry_after_seconds: float =
+        Config.command_queue_retry_after_seconds,
+        issue_shard_processes: int = Config.issue_shard_processes,
+        issue_shard_commit_attempts: int = Config.issue_shard_commit_attempts,
+        argument_db_storage: str = Config.argument_db_storage,
+        argument_db_zeo_address: Optional[str] =
+        Config.argument_db_zeo_address,
+        zeo_client_cache_size_mb: int = Config.zeo_client_cache_size_mb,
+        argument_db_pool_size: int = Config.argument_db_pool_size,
+        argument_db_cache_size: int = Config.argument_db_cache_size,
+        argument_db_cache_size_mb: int = Config.argument_db_cache_size_mb,
+        graph_snapshot_cache_max_issues: int =
+        Config.graph_snapshot_cache_max_issues,
+        graph_change_log_max_revisions: int =
+        Config.graph_change_log_max_revisions,
+        market_maker_liquidity: float = Config.market_maker_liquidity,
+        call_auction_interval_msec: int = Config.call_auction_interval_msec,
+        price_history_max_buckets: int = Config.price_history_max_buckets
 ) -> None:
     Config.time_msec_for_one_iter_of_order_processing = \
         time_msec_for_one_iter_of_order_processing
@@ -107,3 +236,31 @@ def set_config(
     Config.rpyc_server_default_port = rpyc_server_default_port
     Config.rpyc_server_default_address = rpyc_server_default_address
     Config.rpyc_server_default_ipv6 = rpyc_server_default_ipv6
+    Config.inference_worker_processes = inference_worker_processes
+    Config.graph_update_debounce_msec = graph_update_debounce_msec
+    Config.rpyc_client_pool_max_connections = \
+        rpyc_client_pool_max_connections
+    Config.rpyc_client_pool_health_check_seconds = \
+        rpyc_client_pool_health_check_seconds
+    Config.rpyc_client_pool_acquire_timeout_seconds = \
+        rpyc_client_pool_acquire_timeout_seconds
+    Config.rpyc_client_long_polling_pool_max_connections = \
+        rpyc_client_long_polling_pool_max_connections
+    Config.group_commit_max_items = group_commit_max_items
+    Config.group_commit_max_msec = group_commit_max_msec
+    Config.max_commands_per_issue_batch = max_commands_per_issue_batch
+    Config.command_queue_retry_after_seconds = \
+        command_queue_retry_after_seconds
+    Config.issue_shard_processes = issue_shard_processes
+    Config.issue_shard_commit_attempts = issue_shard_commit_attempts
+    Config.argument_db_storage = argument_db_storage
+    Config.argument_db_zeo_address = argument_db_zeo_address
+    Config.zeo_client_cache_size_mb = zeo_client_cache_size_mb
+    Config.argument_db_pool_size = argument_db_pool_size
+    Config.argument_db_cache_size = argument_db_cache_size
+    Config.argument_db_cache_size_mb = argument_db_cache_size_mb
+    Config.graph_snapshot_cache_max_issues = graph_snapshot_cache_max_issues
+    Config.graph_change_log_max_revisions = graph_change_log_max_revisions
+    Config.market_maker_liquidity = market_maker_liquidity
+    Config.call_auction_interval_msec = call_auction_interval_msec
+    Config.price_history_max_buckets = price_history_max_buckets
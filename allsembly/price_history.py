@@ -0,0 +1,157 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+""" The history of the prices of a betting market (see the module
+    betting_exchange), e.g., to chart them.
+    The ticks (times and prices) are stored in arrays, in chunks of up
+    to PriceHistory.CHUNK_TICKS ticks, each a separate persistent
+    object, so that appending a tick only changes the last chunk, and
+    each tick takes 12 bytes (rather than a pickled object per tick).
+"""
+
+import array
+import bisect
+import math
+from typing import Iterator, List, Optional, Tuple
+from typing_extensions import Final
+
+import persistent  #type: ignore[import]
+from BTrees.LOBTree import LOBTree  #type: ignore[import]
+
+# (time in seconds since the epoch, price)
+Tick = Tuple[float, float]
+# (start time of the bucket, open, high, low, and close prices)
+Ohlc = Tuple[float, float, float, float, float]
+
+
+class PriceHistoryChunk(persistent.Persistent):
+    """ Consecutive ticks of a PriceHistory: the times, in milliseconds
+        since the epoch, as 64 bit integers and the prices as 32 bit
+        floats
+    """
+    def __init__(self) -> None:
+        self.times = array.array("q")
+        self.prices = array.array("f")
+
+    def append(self, time_msec: int, price: float) -> None:
+        self.times.append(time_msec)
+        self.prices.append(price)
+        # (the arrays are not persistent objects themselves)
+        self._p_changed = True
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+
+class PriceHistory(persistent.Persistent):
+    """ An append-only series of the prices of a market over time """
+    # ticks per chunk; only the last chunk is rewritten by an append,
+    # so this bounds the size of the write
+    CHUNK_TICKS: Final = 512
+
+    def __init__(self) -> None:
+        # PriceHistoryChunk by the time of its first tick
+        self.chunks = LOBTree()
+        self.last_chunk: Optional[PriceHistoryChunk] = None
+        self.last_time_msec = 0
+        self.number_of_ticks = 0
+
+    def append(self, time_seconds: float, price: float) -> None:
+        """ Records the price at the time (in seconds since the epoch).
+            The times are kept in order, so a time earlier than the
+            last one (e.g., if the clock was set back) is recorded as
+            the last one.
+        """
+        time_msec: Final = max(int(time_seconds * 1000.0),
+                               self.last_time_msec)
+        # (a chunk is keyed by the time of its first tick; so, if all
+        # of the last chunk's ticks are at the time of this one, it
+        # takes more of them rather than starting a chunk with its key)
+        if self.last_chunk is None or \
+                (len(self.last_chunk) >= PriceHistory.CHUNK_TICKS and
+                 self.chunks.maxKey() < time_msec):
+            self.last_chunk = PriceHistoryChunk()
+            self.chunks[time_msec] = self.last_chunk
+        self.last_chunk.append(time_msec, price)
+        self.last_time_msec = time_msec
+        self.number_of_ticks += 1
+
+    def _range(self, start_seconds: float, end_seconds: float
+               ) -> Iterator[Tuple[int, float]]:
+        """ The ticks (with times in milliseconds) from start_seconds
+            up to, but not including, end_seconds
+        """
+        start_msec: Final = int(start_seconds * 1000.0)
+        end_msec: Final = int(end_seconds * 1000.0) \
+            if end_seconds != math.inf \
+            else None
+        if not self.chunks or \
+                (end_msec is not None and end_msec <= start_msec):
+            return
+        # the chunk that the start is in, if any, and the ones after it
+        first_key: Final = self.chunks.maxKey(start_msec) \
+            if self.chunks.minKey() <= start_msec \
+            else self.chunks.minKey()
+        for chunk in self.chunks.values(min=first_key, max=end_msec,
+                                        excludemax=end_msec is not None):
+            times = chunk.times
+            begin = bisect.bisect_left(times, start_msec)
+            end = bisect.bisect_left(times, end_msec) \
+                if end_msec is not None \
+                else len(times)
+            for i in range(begin, end):
+                yield times[i], chunk.prices[i]
+
+    def get_ticks(self, start_seconds: float = 0.0,
+                  end_seconds: float = math.inf) -> List[Tick]:
+        """ The ticks from start_seconds up to, but not including,
+            end_seconds
+        """
+        return [(time_msec / 1000.0, price)
+                for time_msec, price in self._range(start_seconds,
+                                                    end_seconds)]
+
+    def get_ohlc(self, start_seconds: float, end_seconds: float,
+                 bucket_seconds: float) -> List[Ohlc]:
+        """ Downsamples the ticks from start_seconds up to, but not
+            including, end_seconds into buckets of bucket_seconds
+            (starting at start_seconds), giving the first, highest,
+            lowest, and last price in each.  Buckets without ticks are
+            left out.
+        """
+        if bucket_seconds <= 0.0:
+            raise ValueError("bucket_seconds must be positive")
+        bucket_msec: Final = bucket_seconds * 1000.0
+        start_msec: Final = int(start_seconds * 1000.0)
+        buckets: Final[List[Ohlc]] = []
+        bucket_index = -1
+        for time_msec, price in self._range(start_seconds, end_seconds):
+            index = int((time_msec - start_msec) // bucket_msec)
+            if index != bucket_index:
+                bucket_index = index
+                buckets.append((start_seconds + index * bucket_seconds,
+                                price, price, price, price))
+            else:
+                bucket_start, open_price, high, low, _ = buckets[-1]
+                buckets[-1] = (bucket_start, open_price, max(high, price),
+                               min(low, price), price)
+        return buckets
+
+    def __len__(self) -> int:
+        return self.number_of_ticks
@@ -21,20 +21,80 @@ the Problog python package).
 """
 
 import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
 from logging import Logger
+from threading import Event
 
 import persistent #type: ignore[import]
 import problog #type: ignore[import]
 from persistent.list import PersistentList #type: ignore[import]
 from persistent.mapping import PersistentMapping #type: ignore[import]
+from BTrees.OOBTree import OOBTree #type: ignore[import]
 from readerwriterlock import rwlock
 import re
 
-from typing import Any, Dict, cast
+from typing import Any, Dict, List, Optional, Set, Tuple, cast
 from typing_extensions import Final
 
 logger: Logger = logging.getLogger(__name__)
 
+# identifies a fragment of the Problog program,
+# e.g., ("a", 3) for argument 3 or ("p", 5) for position 5
+FragmentKey = Tuple[str, int]
+
+class ProblogProgramBuilder(persistent.Persistent):
+    """Keeps the Problog program of an argument graph as separate
+       clause fragments, one per argument node and one per position node.
+       Adding or changing a node only adds or replaces the fragments
+       it touches; the program text is produced by concatenating the
+       cached fragments instead of re-walking the whole graph.
+
+       The fragments are kept in a BTree so that storing one fragment
+       only writes the bucket containing it to the database.
+       Keys are ordered so that argument clauses come before position
+       terms and queries (since "a" < "p").
+
+       A fragment may depend on weights (i.e., betting market prices)
+       of positions.  Register such dependencies with
+       add_weight_dependent() so that the fragments that need to be
+       re-rendered when a price changes can be looked up directly.
+    """
+    def __init__(self) -> None:
+        self.fragments = OOBTree()
+        #position id -> tuple of keys of the fragments using its price
+        self.weight_dependents = OOBTree()
+        self._v_program_string: Optional[str] = None
+
+    def __setstate__(self, state: Dict[Any, Any]) -> None:
+        self.__dict__ = state
+        self._v_program_string = None
+
+    def set_fragment(self, key: FragmentKey, fragment: str) -> bool:
+        """Adds or replaces a fragment.
+        Returns True if the program text changed; False otherwise.
+        """
+        if self.fragments.get(key) == fragment:
+            return False
+        self.fragments[key] = fragment
+        self._v_program_string = None
+        return True
+
+    def add_weight_dependent(self, weight_key: int, key: FragmentKey) -> None:
+        dependents: Tuple[FragmentKey, ...] = self.weight_dependents.get(weight_key, ())
+        if key not in dependents:
+            self.weight_dependents[weight_key] = dependents + (key,)
+
+    def get_weight_dependents(self, weight_key: int) -> Tuple[FragmentKey, ...]:
+        return cast(Tuple[FragmentKey, ...], self.weight_dependents.get(weight_key, ()))
+
+    def get_program_string(self) -> str:
+        if self._v_program_string is None:
+            self._v_program_string = "".join(self.fragments.values())
+        return self._v_program_string
+
+
 class ProblogModel(persistent.Persistent):
     """Problog terms and rules that model the argument graph
        and allow Problog to do the inference.
@@ -48,17 +108,25 @@ class ProblogModel(persistent.Persistent):
        might only go in one direction.  Dealing most appropriately with 
        all major types is a longer-term goal.
     """
-       # In future it will be possible to update the model by reusing 
-       # the same program with different
-       # weights if no new arguments have been added--method taken from:
+       # The model is compiled once (to a d-DNNF or SDD circuit) and
+       # re-evaluated with different weights if no new arguments have
+       # been added--method taken from:
        # https://dtai.cs.kuleuven.be/problog/tutorial/01-compile-once.html
+       # The compiled circuit is volatile; it is rebuilt from pl_model
+       # the first time the marginals are calculated after loading.
     pl_model: Any
     _v_my_rwlock = rwlock.RWLockWrite()
 
     def set_problog_program(self, problog_program_string: str) -> None:
+        """Sets a new program; the next call to calculate_marginals()
+        will ground and compile it.  Only call this when the structure
+        of the program has changed.  Use update_term_weights() when
+        only the probabilities of the facts have changed.
+        """
         #parse the Problog string
         logger.debug(problog_program_string)
         self.pl_model: Any = problog.program.PrologString(problog_program_string)
+        self._v_compiled_model = None
 
     def get_problog_query_results(self) -> Dict[int, float]:
         with self._v_my_rlock:
@@ -73,25 +141,67 @@ class ProblogModel(persistent.Persistent):
         self.write_buffer_index = 1
         self._v_my_wlock = ProblogModel._v_my_rwlock.gen_wlock()
         self._v_my_rlock = ProblogModel._v_my_rwlock.gen_rlock()
+        self._init_compiled_model_state()
 
     def __setstate__(self, state: Dict[Any, Any]) -> None:
         self.__dict__ = state
         self._v_my_wlock = ProblogModel._v_my_rwlock.gen_wlock()
         self._v_my_rlock = ProblogModel._v_my_rwlock.gen_rlock()
+        self._init_compiled_model_state()
+
+    def _init_compiled_model_state(self) -> None:
+        self._v_compiled_model: Any = None
+        # weights of the compiled model by node index
+        self._v_weights: Dict[int, Any] = {}
+        # node indexes of the probabilistic facts for each term,
+        # e.g., "n5" -> [(3, True), (7, False)], where the boolean tells
+        # whether the fact is n5(t) (True) or n5(f) (False)
+        self._v_weight_slots: Dict[str, List[Tuple[int, bool]]] = {}
+
+    def is_compiled(self) -> bool:
+        return self._v_compiled_model is not None
+
+    def _compile(self) -> None:
+        self._init_compiled_model_state()
+        compiled_model: Final = problog.get_evaluatable()\
+                                       .create_from(self.pl_model)
+        self._v_weights = dict(compiled_model.get_weights())
+        for index, weight in self._v_weights.items():
+            if isinstance(weight, bool):
+                continue #deterministic node
+            name = compiled_model.get_node(index).name
+            #annotated disjunctions are compiled into "choice" facts
+            term = name.args[2] if name.functor == "choice" else name
+            if term.arity == 1:
+                self._v_weight_slots.setdefault(str(term.functor), [])\
+                    .append((index, str(term.args[0]) == "t"))
+        self._v_compiled_model = compiled_model
 
     def calculate_marginals(self) -> None:
-        """calculates the posterior probabilities"""
-        # compile the model
-        query_results: Final[Dict[str, float]] = problog.get_evaluatable()\
-                                                 .create_from(self.pl_model)\
-                                                 .evaluate()
+        """calculates the posterior probabilities,
+        compiling the model first if it has changed
+        """
+        if not self.is_compiled():
+            self._compile()
+        query_results: Final[Dict[str, float]] = \
+            self._v_compiled_model.evaluate(weights=self._v_weights)
         #logger.debug(query_results)
-        self._problog_query_results[self.write_buffer_index].update(
+        self.set_query_results(
             #making a dict with node number as key and posterior probability as value
             #by removing the leading character from the node name to get the node number
 #           {int(str(x)[1:]): y for x, y in query_results.items()}
            {int(re.sub(r'\(t\)', r'', str(x)[1:])): y for x, y in query_results.items()}
         )
+
+    def set_query_results(self, query_results: Dict[int, float]) -> None:
+        """Publishes posterior probabilities, keyed by node number,
+        through the double buffer read by get_problog_query_results().
+        Also used to publish results calculated elsewhere, e.g., by
+        an InferenceService worker process.
+        """
+        self._problog_query_results[self.write_buffer_index].update(
+            query_results
+        )
         swap_index: int = self.write_buffer_index
         self.write_buffer_index = self.read_buffer_index
         with self._v_my_wlock:
@@ -102,6 +212,169 @@ class ProblogModel(persistent.Persistent):
         #stub
 
     def update_term_weights(self, updated_weights: Dict[str, float]) -> None:
-        """updates model weights from dict"""
-        #stub
+        """updates model weights from dict
+        The keys are the term names (e.g., "n5") and the values are the
+        probabilities of the terms being true (e.g., of "n5(t)").
+        The compiled model is kept; call calculate_marginals() to
+        re-evaluate it with the new weights.
+        Does nothing when the model is not compiled, since the
+        program set with set_problog_program() is expected to already
+        contain the current weights in that case.
+        """
+        if not self.is_compiled():
+            return
+        for term_name, prob in updated_weights.items():
+            for index, is_true_fact in self._v_weight_slots.get(term_name, []):
+                self._v_weights[index] = prob if is_true_fact else 1.0 - prob
+
+
+
+# key of an issue in Issues.graphs: (hashed userid, issue number)
+IssueKey = Tuple[bytes, int]
+
+# Compiled models cached in an InferenceService worker process,
+# by issue, with the structure version they were compiled from.
+_worker_models: Dict[IssueKey, Tuple[int, ProblogModel]] = {}
+
+def _evaluate_in_worker(issue_key: IssueKey,
+                        structure_version: int,
+                        problog_program_string: str,
+                        weight_updates: Dict[str, float]
+                        ) -> Dict[int, float]:
+    """Runs in an InferenceService worker process.
+    Recompiles the issue's model only if its structure version has
+    changed (or the worker has not seen the issue before); otherwise
+    re-weights the model compiled earlier in this process.
+    """
+    cached: Final = _worker_models.get(issue_key)
+    try:
+        if cached is None or cached[0] != structure_version:
+            model = ProblogModel()
+            model.set_problog_program(problog_program_string)
+            _worker_models[issue_key] = (structure_version, model)
+        else:
+            model = cached[1]
+            model.update_term_weights(weight_updates)
+        model.calculate_marginals()
+    except Exception:
+        # the cached model might not match the program anymore
+        _worker_models.pop(issue_key, None)
+        raise
+    return dict(model.get_problog_query_results())
+
+
+class _InferenceRequest:
+    def __init__(self, structure_version: int,
+                 problog_program_string: str,
+                 weight_updates: Dict[str, float]) -> None:
+        self.structure_version = structure_version
+        self.problog_program_string = problog_program_string
+        self.weight_updates = weight_updates
+
+
+class InferenceService:
+    """ Runs the Problog inference for issues in worker processes so
+        that a slow compilation does not block the thread processing
+        the request queues.
+
+        Each issue is always sent to the same worker process, which
+        keeps the issue's compiled model (see ProblogModel) and only
+        recompiles it when the structure of the program has changed.
+        At most one calculation per issue is running at any time;
+        requests submitted for an issue while it is running are
+        coalesced into a single pending request (the latest program
+        and the union of the weight updates).
+
+        Results are collected by the caller with take_results() and
+        should be published from the thread that owns the database
+        connection (see ArgumentGraph.set_problog_query_results()).
+        If an Event object is given, it is set whenever a result
+        becomes available.
+    """
+    def __init__(self, number_of_processes: int,
+                 event_obj: Optional[Event] = None) -> None:
+        mp_context: Final = multiprocessing.get_context("spawn")
+        self._executors: Final[List[ProcessPoolExecutor]] = [
+            ProcessPoolExecutor(max_workers=1, mp_context=mp_context)
+            for _ in range(max(1, number_of_processes))
+        ]
+        self._event_obj = event_obj
+        # reentrant, since a done callback may run in the submitting thread
+        self._lock: Final = threading.RLock()
+        self._structure_versions: Final[Dict[IssueKey, int]] = {}
+        self._pending: Final[Dict[IssueKey, _InferenceRequest]] = {}
+        self._running: Final[Set[IssueKey]] = set()
+        self._results: Dict[IssueKey, Dict[int, float]] = {}
+
+    def submit(self, issue_key: IssueKey,
+               structure_changed: bool,
+               problog_program_string: str,
+               weight_updates: Dict[str, float]) -> None:
+        """ Requests a recalculation of an issue's probabilities.
+            problog_program_string should always be the current program
+            (containing the current weights) so that a worker that has
+            not compiled the issue's model yet can do so; weight_updates
+            are the prices changed since the previous request.
+        """
+        with self._lock:
+            if structure_changed or issue_key not in self._structure_versions:
+                self._structure_versions[issue_key] = \
+                    self._structure_versions.get(issue_key, 0) + 1
+            request = self._pending.get(issue_key)
+            if request is None:
+                request = _InferenceRequest(0, "", {})
+                self._pending[issue_key] = request
+            request.structure_version = self._structure_versions[issue_key]
+            request.problog_program_string = problog_program_string
+            request.weight_updates.update(weight_updates)
+            if issue_key not in self._running:
+                self._start(issue_key)
+
+    def _start(self, issue_key: IssueKey) -> None:
+        # must be called with self._lock held
+        request: Final = self._pending.pop(issue_key)
+        self._running.add(issue_key)
+        executor: Final = self._executors[hash(issue_key) % len(self._executors)]
+        future: Final = executor.submit(_evaluate_in_worker,
+                                        issue_key,
+                                        request.structure_version,
+                                        request.problog_program_string,
+                                        request.weight_updates)
+        future.add_done_callback(
+            lambda f: self._on_done(issue_key, f))
+
+    def _on_done(self, issue_key: IssueKey,
+                 future: "Future[Dict[int, float]]") -> None:
+        with self._lock:
+            self._running.discard(issue_key)
+            try:
+                self._results[issue_key] = future.result()
+            except Exception:
+                logger.exception("inference failed for issue %s", issue_key)
+                # make the next request recompile from the program string
+                self._structure_versions[issue_key] = \
+                    self._structure_versions.get(issue_key, 0) + 1
+                if issue_key in self._pending:
+                    self._pending[issue_key].structure_version = \
+                        self._structure_versions[issue_key]
+            if issue_key in self._pending:
+                self._start(issue_key)
+        if self._event_obj is not None:
+            self._event_obj.set()
+
+    def take_results(self) -> Dict[IssueKey, Dict[int, float]]:
+        """ Returns the latest results per issue completed since the
+            previous call.
+        """
+        with self._lock:
+            results: Final = self._results
+            self._results = {}
+        return results
+
+    def is_idle(self) -> bool:
+        with self._lock:
+            return not self._running and not self._pending
 
+    def shutdown(self) -> None:
+        for executor in self._executors:
+            executor.shutdown(wait=False)
@@ -0,0 +1,169 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+""" Provides connections to the Allsembly RPyC server (see the module
+ "rpyc_server") for its clients, such as the Django views.
+Connecting for every request adds a TCP handshake and the RPyC
+ protocol setup to each request.  So, connections are kept open in a
+ pool and reused.
+"""
+import contextlib
+import logging
+import os
+import threading
+import time
+from logging import Logger
+from typing import Any, Iterator, List, Optional, Tuple
+from typing_extensions import Final
+
+import rpyc  #type: ignore[import]
+
+from allsembly.config import Config
+
+logger: Logger = logging.getLogger(__name__)
+
+class RpycConnectionPool:
+    """ A bounded pool of connections to the Allsembly RPyC server,
+        for the threads of one process, e.g., one web server worker.
+        Use a connection in a 'with' statement, e.g.:
+
+        pool = RpycConnectionPool()
+        ...
+        with pool.connection() as client:
+            client.root.get_user_services(userid).get_arg_graph(0)
+
+        At most max_connections are open at once; other threads wait
+        for one of them to be returned to the pool for up to
+        acquire_timeout_seconds, and then Exhausted is raised.
+        A connection that has been idle for health_check_seconds is
+        checked before it is reused, and it is replaced if the
+        server does not respond.  A connection is closed and replaced,
+        rather than reused, if an exception was raised while it was
+        in use, because it might have been left in the middle of a
+        request.
+        The settings not given are taken from Config when the pool
+        is made.
+    """
+    class Exhausted(Exception):
+        """ Raised if no connection became available in time """
+        pass
+
+    def __init__(self,
+                 address: Optional[str] = None,
+                 port: Optional[int] = None,
+                 ipv6: Optional[bool] = None,
+                 max_connections: Optional[int] = None,
+                 health_check_seconds: Optional[float] = None,
+                 acquire_timeout_seconds: Optional[float] = None
+                 ) -> None:
+        self._address: Final[str] = address \
+            if address is not None \
+            else Config.rpyc_server_default_address
+        self._port: Final[int] = port \
+            if port is not None \
+            else Config.rpyc_server_default_port
+        self._ipv6: Final[bool] = ipv6 \
+            if ipv6 is not None \
+            else Config.rpyc_server_default_ipv6
+        self._max_connections: Final[int] = max_connections \
+            if max_connections is not None \
+            else Config.rpyc_client_pool_max_connections
+        self._health_check_seconds: Final[float] = health_check_seconds \
+            if health_check_seconds is not None \
+            else Config.rpyc_client_pool_health_check_seconds
+        self._acquire_timeout_seconds: Final[float] = \
+            acquire_timeout_seconds \
+            if acquire_timeout_seconds is not None \
+            else Config.rpyc_client_pool_acquire_timeout_seconds
+        self._init_pool_state()
+
+    def _init_pool_state(self) -> None:
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._available = threading.BoundedSemaphore(self._max_connections)
+        # idle connections and the (monotonic) time each was returned;
+        # the most recently returned is at the end
+        self._idle: List[Tuple[Any, float]] = []
+
+    def _connect(self) -> Any:
+        return rpyc.connect(self._address, self._port,
+                            config={"allow_public_attrs": True,
+                                    "sync_request_timeout": None},
+                            ipv6=self._ipv6)
+
+    @staticmethod
+    def _close_quietly(conn: Any) -> None:
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug("error closing RPyC connection: " + str(e))
+
+    def _is_healthy(self, conn: Any, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self._health_check_seconds:
+            return True
+        try:
+            conn.ping(timeout=self._health_check_seconds)
+            return True
+        except Exception as e:
+            logger.info("replacing RPyC connection: " + str(e))
+            return False
+
+    def _take_connection(self) -> Any:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, idle_since = self._idle.pop()
+            if self._is_healthy(conn, idle_since):
+                return conn
+            self._close_quietly(conn)
+        return self._connect()
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[Any]:
+        if self._pid != os.getpid():
+            # The process was forked (e.g., by the web server) after
+            # connections were opened.  They belong to the parent, so
+            # leave them to it rather than closing them.
+            self._init_pool_state()
+        if not self._available.acquire(timeout=self._acquire_timeout_seconds):
+            raise RpycConnectionPool.Exhausted()
+        try:
+            conn = self._take_connection()
+            try:
+                yield conn
+            except BaseException:
+                self._close_quietly(conn)
+                raise
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._available.release()
+
+    def close(self) -> None:
+        """ Closes the idle connections; connections in use are
+            returned to the pool as usual.
+        """
+        with self._lock:
+            idle: Final = self._idle
+            self._idle = []
+        for conn, _ in idle:
+            self._close_quietly(conn)
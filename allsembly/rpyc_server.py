@@ -19,46 +19,51 @@
 """ Provides the Allsembly services via RPC.
 The AllsemblyServices class is an RPyC (RPC server) which can be
  started to provide the services.
-And it needs to be provided with queues onto which to place
- the requests that will be handled elsewhere.
+And it needs to be provided with a queue onto which to place
+ the requests that will be handled elsewhere, as commands.
  (See the module "allsembly".)
-The caller maintains its own reference to the queues and reads
- off each request to handle it.
+The caller maintains its own reference to the queue and reads
+ off each command to handle it.
 Some requests directly get information; These are mediated through
- GraphRequest and LedgerRequest instances and IssuesQueue, which should
- perhaps be renamed to IssuesRequest.  Only GraphRequest and IssuesQueue
- are currently implemented.  A GraphRequest object can provide a drawn
- graph and the full text of a position.  In addition to adding an issue
- to the queue, the IssueQueue can provide the id of the next issue that
+ GraphRequest, LedgerRequest, and IssuesRequest instances.  A
+ GraphRequest object can provide a drawn graph and the full text of a
+ position.  A LedgerRequest object can provide a user's betting
+ contracts.  The IssuesRequest can provide the id of the next issue that
  will be used to identify it in the database and for any other requests
  referencing it.
 The RPyC server is threaded, so multiple threads might try to access
  information at the same time.  That is the reasond for mediation of
- the requests through thread safe queues and request objects.
+ the requests through a thread safe queue and request objects.
 """
+import gzip
+import heapq
 import pickle
 import logging
+import math
 import threading
+import time
 from threading import Event
 from logging import Logger
-from collections import deque
-from typing import Tuple, Optional, cast, Any, Deque, Union, NamedTuple, Dict
+from collections import deque, OrderedDict
+from typing import Tuple, Optional, cast, Any, Deque, Union, NamedTuple, \
+    Dict, Callable, List, Set
 from typing_extensions import Final
 import enum
 from dataclasses import dataclass
 
 import rpyc  #type: ignore[import]
 
-from allsembly.argument_graph import Issues, ArgumentGraph, IssuesDBAccessor
+from allsembly.argument_graph import Issues, ArgumentGraph, GraphChanges, \
+    IssuesDBAccessor
+from allsembly.betting_exchange import Ledger
+from allsembly.price_history import Ohlc, PriceHistory
 from allsembly.config import Config, Limits
-from allsembly.speech_act import IndependentBid, Argument, InitialPosition
+from allsembly.speech_act import IndependentBid, Argument, InitialPosition, \
+    ProOrCon, Ask
 from allsembly.user import UserInfo
 
 logger: Logger = logging.getLogger(__name__)
 
-#TODO: Use just one queue for posting all requests.  Use a Union type.
-# And probably use classes instead of type aliases for each Union member type.
-
 #TODO: In future, don't use the userid to index orders.  Instead, use an
 # anonymous identifier that is unique for each user, argument pair.
 # Store all of a user's anonymous identifiers in their UserInfo object
@@ -71,115 +76,188 @@ logger: Logger = logging.getLogger(__name__)
 # hashed password). The admins should store their private keys
 # passphrase-encrypted and elsewhere than on the server.
 
-OrderQueueElement = Tuple[bytes,  # (hashed) userid
-                         str,  # subuser
-                         IndependentBid
-]
-
-_OrderQueue = Deque[OrderQueueElement
-]
-
-class OrderQueue:
-    """ wraps a deque allowing us to pass an optional Event object to
-        notify another thread when items have been added and are,
-        therefore, ready for processing."""
-    def __init__(self, event_obj: Optional[Event] = None):
-        self.queue: _OrderQueue = deque([], Limits.max_queue_items)
-        self.event_obj = event_obj
-
-    def __bool__(self) -> bool:
-        return True if self.queue else False
+@dataclass(frozen=True)
+class AddPosition:
+    """ Adds a new (initial) position to an issue, creating the issue
+        if it does not exist, yet.
+    """
+    userid: bytes  # (hashed) userid
+    subuser: str
+    issue_id: Tuple[bytes, int]
+    position: InitialPosition
 
-    def append(self, item: OrderQueueElement) -> None:
-        self.queue.append(item)
-        if self.event_obj is not None:
-            self.event_obj.set()
 
-    def popleft(self) -> OrderQueueElement:
-        return self.queue.popleft()
+@dataclass(frozen=True)
+class AddArgument:
+    """ Adds an argument, its premises, and the bids on them """
+    userid: bytes  # (hashed) userid
+    subuser: str
+    issue_id: Tuple[bytes, int]
+    argument: Argument
 
-    def set_event_object(self, event_obj: Event) -> None:
-        self.event_obj = event_obj
 
+@dataclass(frozen=True)
+class PlaceOrder:
+    userid: bytes  # (hashed) userid
+    subuser: str
+    bid: IndependentBid
 
-GraphUpdateArgQueueElement = Tuple[bytes,  # (hashed) userid
-                                  str,  # subuser
-                                  Tuple[bytes, int],  # issue id
-                                  Argument
-]
+    @property
+    def issue_id(self) -> Tuple[bytes, int]:
+        return (self.userid, self.bid.market_locator.issue_id)
 
-_GraphUpdateArgQueue = Deque[GraphUpdateArgQueueElement
-]
 
-class GraphUpdateArgQueue:
-    """ wraps a deque allowing us to pass an optional Event object to
-        notify another thread when items have been added and are,
-        therefore, ready for processing."""
-    def __init__(self, event_obj: Optional[Event] = None):
-        self.queue: _GraphUpdateArgQueue = deque([], Limits.max_queue_items)
-        self.event_obj = event_obj
+@dataclass(frozen=True)
+class PlaceAsk:
+    """ Offers contracts held by the user for sale """
+    userid: bytes  # (hashed) userid
+    subuser: str
+    ask: Ask
 
-    def __bool__(self) -> bool:
-        return True if self.queue else False
+    @property
+    def issue_id(self) -> Tuple[bytes, int]:
+        return (self.userid, self.ask.market_locator.issue_id)
 
-    def append(self, item: GraphUpdateArgQueueElement) -> None:
-        self.queue.append(item)
-        if self.event_obj is not None:
-            self.event_obj.set()
 
-    def popleft(self) -> GraphUpdateArgQueueElement:
-        return self.queue.popleft()
+@dataclass(frozen=True)
+class DeleteIssue:
+    issue_id: Tuple[bytes, int]
 
-    def set_event_object(self, event_obj: Event) -> None:
-        self.event_obj = event_obj
 
+@dataclass(frozen=True)
+class ClearCallAuctions:
+    """ Clears the call auctions of the issue's markets (see
+        Config.call_auction_interval_msec).  Issued by the server
+        itself when they are due, not by clients.
+    """
+    issue_id: Tuple[bytes, int]
+
+
+Command = Union[AddPosition, AddArgument, PlaceOrder, PlaceAsk, DeleteIssue,
+                ClearCallAuctions]
+
+
+class CommandQueue:
+    """ The requests that update the database, as commands, in the
+        order that they arrived, for processing by one thread (see
+        the module "allsembly").
+        The commands are partitioned by issue.  Commands for different
+        issues are independent of each other, so only the order of the
+        commands for the same issue has to be kept.  pop_issue_batch()
+        takes the oldest command together with the commands for the
+        same issue that arrived after it, so that the work for one
+        issue can be done in a batch, and so that batches for
+        different issues could be handed to different workers.
+        Thread safe.  An optional Event object is set to notify another
+        thread when commands have been added and are, therefore, ready
+        for processing.
+        The queue is bounded: when it is full, append() refuses the
+        command, so that the caller can tell the client to try again
+        later, rather than the command being lost.
+    """
+    class Status(NamedTuple):
+        depth: int
+        # the greatest depth so far
+        high_water_mark: int
+        max_items: int
+        # the number of commands refused because the queue was full
+        rejected: int
 
-GraphUpdatePosQueueElement = Tuple[bytes,  # (hashed) userid
-                                  str,  # subuser
-                                  Tuple[bytes, int],  # issue id
-                                  InitialPosition
-]
-_GraphUpdatePosQueue = Deque[GraphUpdatePosQueueElement
-]
-
-class GraphUpdatePosQueue:
-    """ wraps a deque allowing us to pass an optional Event object to
-        notify another thread when items have been added and are,
-        therefore, ready for processing."""
-    def __init__(self, event_obj: Optional[Event] = None):
-        self.queue: _GraphUpdatePosQueue = deque([], Limits.max_queue_items)
+    def __init__(self,
+                 event_obj: Optional[Event] = None,
+                 max_items: Optional[int] = None) -> None:
         self.event_obj = event_obj
+        self._max_items: Final[int] = max_items \
+            if max_items is not None \
+            else Limits.max_queue_items
+        self._lock: Final = threading.Lock()
+        # (sequence number, command), oldest first, by issue;
+        # only issues with commands waiting are included
+        self._partitions: Dict[Tuple[bytes, int],
+                               Deque[Tuple[int, Command]]] = {}
+        # (sequence number of the oldest command, issue id) for each
+        # partition, so that the oldest command overall is at the top
+        self._oldest_by_issue: List[Tuple[int, Tuple[bytes, int]]] = []
+        self._next_sequence_number = 0
+        self._length = 0
+        self._high_water_mark = 0
+        self._rejected = 0
 
     def __bool__(self) -> bool:
-        return True if self.queue else False
+        return self._length > 0
+
+    def __len__(self) -> int:
+        return self._length
 
-    def append(self, item: GraphUpdatePosQueueElement) -> None:
-        self.queue.append(item)
+    def append(self, command: Command) -> bool:
+        """ Returns False, without adding the command, if the queue
+            already has max_items commands.
+        """
+        with self._lock:
+            if self._length >= self._max_items:
+                self._rejected += 1
+                logger.debug("command queue is full; refusing " +
+                             type(command).__name__)
+                return False
+            partition = self._partitions.get(command.issue_id)
+            if partition is None:
+                partition = deque()
+                self._partitions[command.issue_id] = partition
+                heapq.heappush(self._oldest_by_issue,
+                               (self._next_sequence_number,
+                                command.issue_id))
+            partition.append((self._next_sequence_number, command))
+            self._next_sequence_number += 1
+            self._length += 1
+            self._high_water_mark = max(self._high_water_mark, self._length)
         if self.event_obj is not None:
             self.event_obj.set()
+        return True
 
-    def popleft(self) -> GraphUpdatePosQueueElement:
-        return self.queue.popleft()
+    def popleft(self) -> Command:
+        """ Removes and returns the oldest command.
+            Raises IndexError if the queue is empty.
+        """
+        return self.pop_issue_batch(1)[1][0]
+
+    def pop_issue_batch(self, max_commands: int
+                        ) -> Tuple[Tuple[bytes, int], List[Command]]:
+        """ Removes and returns the oldest command and up to
+            max_commands - 1 more commands for the same issue, in
+            order, along with the issue id.
+            Raises IndexError if the queue is empty.
+        """
+        with self._lock:
+            if not self._oldest_by_issue:
+                raise IndexError("pop from an empty CommandQueue")
+            _, issue_id = heapq.heappop(self._oldest_by_issue)
+            partition: Final = self._partitions[issue_id]
+            commands: Final[List[Command]] = []
+            while partition and len(commands) < max_commands:
+                commands.append(partition.popleft()[1])
+            if partition:
+                heapq.heappush(self._oldest_by_issue,
+                               (partition[0][0], issue_id))
+            else:
+                del self._partitions[issue_id]
+            self._length -= len(commands)
+            return issue_id, commands
+
+    def get_status(self) -> 'CommandQueue.Status':
+        with self._lock:
+            return CommandQueue.Status(self._length,
+                                       self._high_water_mark,
+                                       self._max_items,
+                                       self._rejected)
 
     def set_event_object(self, event_obj: Event) -> None:
         self.event_obj = event_obj
 
 
-class IssueDeleteDirective:
-    def __init__(self, issue_id: Tuple[bytes, int]) -> None:
-        self.id_to_delete = issue_id
-
-
-# tuple contains the issue id and the issue name
-IssueAddDirective = Tuple[int, str]
-IssueUpdateQueue = Deque[Union[IssueAddDirective, IssueDeleteDirective]]
-
-
-class IssueQueue:
-    def __init__(self, issues: 'Issues', event_obj: Optional[Event] = None):
+class IssuesRequest:
+    """ Provides the id for a new issue """
+    def __init__(self, issues: 'Issues'):
         self.issues = issues
-        self.queue: IssueUpdateQueue = deque([], Limits.max_queue_items)
-        self.event_obj = event_obj
 
     def add_issue(self, issue_name: str) -> Optional[int]:
         """ return new issue number """
@@ -192,27 +270,163 @@ class IssueQueue:
             #			issue_id = self.issues.next_issue_id.get_and_set(
             #										 self.issues.next_issue_id.value + 1
             #										 )
-            # Actually enqueuing the new issue is unnecessary in this version
+            # Enqueuing the new issue is unnecessary in this version
             # since only one issue is used in the client and its name is
-            # not shown anywhere.  However, it might work.  It will have to
-            # be tested.
+            # not shown anywhere.
             # If an issue doesn't exist, it is created in
-            # allsembly.process_one_position_from_queue() as long as its
+            # allsembly.process_position() as long as its
             # id number is less than next_issue_id.
-            #			self.queue.append((issue_id, issue_name))
             issue_id = self.issues.next_issue_id
             self.issues.next_issue_id += 1
             return issue_id
         else:
             return None
 
-    def delete_issue(self, issue_id: Tuple[bytes, int]) -> None:
-        self.queue.append(IssueDeleteDirective(issue_id))
-        if self.event_obj is not None:
-            self.event_obj.set()
 
-    def set_event_object(self, event_obj: Event) -> None:
-        self.event_obj = event_obj
+class GraphSnapshotCache:
+    """ The most recently drawn graph (SVG) of each issue and its
+        revision number, for up to max_issues issues, so that they can
+        be returned without reading them from the database.  The
+        least recently used are evicted.  Thread-safe.
+        The thread updating the graphs publishes each new snapshot
+        (see GraphRequest.notify_graph_updated()); other threads may
+        only add snapshots read from the database for issues that are
+        missing, using the generation number obtained before reading
+        them (see add_if_unchanged()), so that they do not replace a
+        newer snapshot or restore a deleted one.
+        The gzip-compressed SVG of a snapshot is kept with it once it
+        has been compressed (see get_compressed()).
+        The changes between the snapshots published for an issue, for
+        up to Config.graph_change_log_max_revisions of them, are kept
+        with the latest one, so that clients can be sent the changes
+        since the revision they have without reading the database
+        (see get_changes_since()).
+    """
+    def __init__(self, max_issues: Optional[int] = None) -> None:
+        self._max_issues: Final[int] = \
+            Config.graph_snapshot_cache_max_issues \
+            if max_issues is None else max_issues
+        self._lock: Final = threading.Lock()
+        self._snapshots: OrderedDict[Tuple[bytes, int], Tuple[str, int]] = \
+            OrderedDict()
+        # the compressed SVG of snapshots that have been compressed
+        self._compressed: Dict[Tuple[bytes, int], bytes] = {}
+        # (revision number of the previous snapshot, the changes made
+        # since then) for each snapshot published after another one
+        # with changes, oldest first, by issue
+        self._change_logs: Dict[Tuple[bytes, int],
+                                Deque[Tuple[int, GraphChanges]]] = {}
+        # incremented whenever a snapshot is published or removed
+        self._generation = 0
+
+    def get(self, issue: Tuple[bytes, int]) -> Optional[Tuple[str, int]]:
+        with self._lock:
+            snapshot: Final = self._snapshots.get(issue)
+            if snapshot is not None:
+                self._snapshots.move_to_end(issue)
+            return snapshot
+
+    def get_generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def get_compressed(self, issue: Tuple[bytes, int],
+                       snapshot: Tuple[str, int]) -> bytes:
+        """ Returns the gzip-compressed SVG of the snapshot, which is
+            only compressed the first time for the snapshot that is
+            cached for the issue
+        """
+        with self._lock:
+            if self._snapshots.get(issue) is snapshot and \
+                    issue in self._compressed:
+                return self._compressed[issue]
+        # not holding the lock while compressing
+        compressed: Final = gzip.compress(snapshot[0].encode("utf-8"))
+        with self._lock:
+            if self._snapshots.get(issue) is snapshot:
+                self._compressed[issue] = compressed
+        return compressed
+
+    def _add(self, issue: Tuple[bytes, int],
+             snapshot: Tuple[str, int],
+             changes: Optional[Tuple[int, GraphChanges]] = None) -> None:
+        previous: Final = self._snapshots.get(issue)
+        if previous is None or previous[1] != snapshot[1]:
+            change_log = self._change_logs.get(issue)
+            if changes is None or previous is None or \
+                    previous[1] != changes[0] or change_log is None:
+                # the changes since the snapshots before are not known
+                change_log = deque(
+                    maxlen=Config.graph_change_log_max_revisions)
+                self._change_logs[issue] = change_log
+            if changes is not None:
+                change_log.append(changes)
+        self._snapshots[issue] = snapshot
+        self._snapshots.move_to_end(issue)
+        self._compressed.pop(issue, None)
+        while len(self._snapshots) > self._max_issues:
+            evicted_issue, _ = self._snapshots.popitem(last=False)
+            self._compressed.pop(evicted_issue, None)
+            self._change_logs.pop(evicted_issue, None)
+
+    def publish(self, issue: Tuple[bytes, int],
+                snapshot: Tuple[str, int],
+                changes: Optional[Tuple[int, GraphChanges]] = None
+                ) -> None:
+        """ changes, if given, are the revision number of the snapshot
+            published before and the changes made since then
+        """
+        with self._lock:
+            self._generation += 1
+            self._add(issue, snapshot, changes)
+
+    def remove(self, issue: Tuple[bytes, int]) -> None:
+        with self._lock:
+            self._generation += 1
+            self._snapshots.pop(issue, None)
+            self._compressed.pop(issue, None)
+            self._change_logs.pop(issue, None)
+
+    def get_changes_since(self, issue: Tuple[bytes, int],
+                          revision_number: int
+                          ) -> Optional[Tuple[str, GraphChanges]]:
+        """ Returns the drawn graph of the latest snapshot and the
+            changes made after revision_number up to it, or None if
+            they are not known (e.g., the snapshot is not cached, or
+            revision_number is older than the changes kept)
+        """
+        with self._lock:
+            snapshot: Final = self._snapshots.get(issue)
+            if snapshot is None:
+                return None
+            self._snapshots.move_to_end(issue)
+            if snapshot[1] == revision_number:
+                return snapshot[0], GraphChanges(revision_number, (), (), ())
+            changes: Optional[GraphChanges] = None
+            for since_revision_number, logged_changes in \
+                    self._change_logs.get(issue, ()):
+                if changes is not None:
+                    changes = changes.followed_by(logged_changes)
+                elif since_revision_number == revision_number:
+                    changes = logged_changes
+            if changes is None:
+                return None
+            return snapshot[0], changes
+
+    def add_if_unchanged(self, issue: Tuple[bytes, int],
+                         snapshot: Tuple[str, int],
+                         generation: int) -> None:
+        """ Adds a snapshot read from the database unless another
+            snapshot has been published or removed since generation
+            was obtained from get_generation().
+        """
+        with self._lock:
+            if generation == self._generation:
+                self._add(issue, snapshot)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._snapshots)
 
 
 class GraphRequest:
@@ -220,6 +434,16 @@ class GraphRequest:
         graph.
         In particular, use this to draw the SVG representation
         of the graph or get the pre-drawn SVG.
+        The drawn graphs are returned from a GraphSnapshotCache,
+        which the caller that updates the graphs keeps current by
+        calling notify_graph_updated(); only graphs missing from it
+        are read from the database.
+        Clients waiting for the next revision of a graph can either
+        block in get_next_graph() or subscribe with
+        subscribe_next_graph(), which does not tie up the calling
+        thread while waiting.  The subscribers are notified by one
+        thread, started on the first subscription, when the caller
+        that updates the graphs calls notify_graph_updated().
     """
     # This seems no longer really to be needed since the read-lock
     # is taken out in the ArgumentGraph class instance itself and not here
@@ -232,32 +456,335 @@ class GraphRequest:
     class Error:
         code: 'GraphRequest.ErrCodes';
 
+    # the drawn graph, if it has to be drawn again, and the changes
+    # (see get_changes())
+    ChangesResult = Tuple[Optional[str], GraphChanges]
+
+    NextGraphCallback = Callable[
+        [Union[Tuple[str, int], 'GraphRequest.ChangesResult',
+               'GraphRequest.Error']], None]
+
+    @dataclass
+    class _Subscription:
+        last_received_graph_revision_number: int
+        callback: 'GraphRequest.NextGraphCallback'
+        deadline: float  # from time.monotonic()
+        # whether to send the changes (see get_changes()) rather than
+        # the drawn graph
+        changes_only: bool = False
+
     def __init__(self,
                  issues_from_db: IssuesDBAccessor,
                  issues_obj_not_safe_to_write: Issues) -> None:
         self._issues_accessor: Final[IssuesDBAccessor] = issues_from_db
         self._issues_not_safe_to_write: Final[Issues] = issues_obj_not_safe_to_write
+        # guards the subscriptions; notified when there is
+        # something for the notifier thread to do
+        self._subscriptions_cond: Final = threading.Condition()
+        # one subscription per subscriber (a user) for each issue
+        self._subscriptions: Dict[Tuple[bytes, int],
+                                  Dict[bytes, GraphRequest._Subscription]] = {}
+        # (deadline, sequence number, issue, subscriber, subscription);
+        # entries whose subscription has already been answered are
+        # skipped when they are popped
+        self._deadlines: List[Tuple[float, int, Tuple[bytes, int], bytes,
+                                    GraphRequest._Subscription]] = []
+        self._next_subscription_number = 0
+        self._updated_issues: Set[Tuple[bytes, int]] = set()
+        self._notifier_thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._snapshots: Final = GraphSnapshotCache()
 
     def draw(self, issue: Tuple[bytes, int]) -> str:
+        result: Final = self.draw_with_revision_number(issue)
+        if isinstance(result, GraphRequest.Error):
+            return ""
+        return result[0]
+
+    def draw_with_revision_number(self, issue: Tuple[bytes, int],
+                                  revision_number: Optional[int] = None
+                                  ) -> Union[Tuple[str, int],
+                                             'GraphRequest.Error']:
+        """ Returns the drawn graph together with its revision number,
+            both from the same committed state of the database: from
+            the snapshot cache, unless it is missing or, if
+            revision_number is given, has another revision number.
+        """
+        snapshot: Final = self._snapshots.get(issue)
+        if snapshot is not None and \
+                (revision_number is None or snapshot[1] == revision_number):
+            return snapshot
+        generation: Final = self._snapshots.get_generation()
         # Each thread needs its own context (provided by its own IssuesAccessor copy).
-        #issues_accessor = copy.copy(self._issues_accessor)
         with self._issues_accessor.get_context() as issues:
             if issues.graphs.has_key(issue):
                 graph_ref: Final[ArgumentGraph] = issues.graphs[issue]
-                return graph_ref.get_drawn_graph()
-        return ""
+                read_snapshot: Final = (
+                    graph_ref.get_drawn_graph(),
+                    graph_ref.get_drawn_graph_revision_number())
+                self._snapshots.add_if_unchanged(issue, read_snapshot,
+                                                 generation)
+                return read_snapshot
+        return GraphRequest.Error(GraphRequest.ErrCodes.GRAPH_UNAVAILABLE)
+
+    def draw_compressed(self, issue: Tuple[bytes, int]
+                        ) -> Union[Tuple[bytes, int], 'GraphRequest.Error']:
+        """ Like draw_with_revision_number(), but the drawn graph is
+            gzip-compressed, which is done once per revision
+        """
+        result: Final = self.draw_with_revision_number(issue)
+        if isinstance(result, GraphRequest.Error):
+            return result
+        return self._snapshots.get_compressed(issue, result), result[1]
+
+    def get_changes(self, issue: Tuple[bytes, int],
+                    last_received_graph_revision_number: int
+                    ) -> Union['GraphRequest.ChangesResult',
+                               'GraphRequest.Error']:
+        """ Returns the changes made to the graph since the revision
+            the caller has (see ArgumentGraph.get_changes_since()),
+            with the drawn graph if nodes or edges were added or the
+            changes are no longer logged (and then the changes only
+            give the revision number); otherwise, the drawn graph is
+            None, and the caller can update the prices and
+            probabilities shown in the graph that it has.
+            The changes are read from the database only if the snapshot
+            cache does not have them.
+        """
+        cached: Final = self._snapshots.get_changes_since(
+            issue, last_received_graph_revision_number)
+        if cached is not None:
+            cached_svg, cached_changes = cached
+            return (cached_svg if cached_changes.changes_layout() else None,
+                    cached_changes)
+        with self._issues_accessor.get_context() as issues:
+            if not issues.graphs.has_key(issue):
+                return GraphRequest.Error(
+                    GraphRequest.ErrCodes.GRAPH_UNAVAILABLE)
+            graph_ref: Final[ArgumentGraph] = issues.graphs[issue]
+            changes: Final = graph_ref.get_changes_since(
+                last_received_graph_revision_number)
+            revision_number: Final[int] = \
+                graph_ref.get_drawn_graph_revision_number()
+            if changes is not None and not changes.changes_layout():
+                return None, changes
+            snapshot: Final = self._snapshots.get(issue)
+            graph_svg: Final[str] = snapshot[0] \
+                if snapshot is not None and snapshot[1] == revision_number \
+                else graph_ref.get_drawn_graph()
+            return (graph_svg,
+                    changes
+                    if changes is not None
+                    else GraphChanges(revision_number, (), (), ()))
 
     def get_next_graph(self,
                        issue: Tuple[bytes, int],
-                       last_received_graph_revision_number: int) -> Union[int, 'GraphRequest.Error']:
+                       last_received_graph_revision_number: int
+                       ) -> Union[Tuple[str, int], 'GraphRequest.Error']:
+        """ Waits (for up to Config.long_polling_timeout_seconds) until
+            the graph's revision number differs from
+            last_received_graph_revision_number; then returns the drawn
+            graph and its revision number.
+        """
         if self._issues_not_safe_to_write.graphs.has_key(issue):
             graph_ref: Final[ArgumentGraph] = self._issues_not_safe_to_write.graphs[issue]
-            if last_received_graph_revision_number >= graph_ref.get_revision_number():
-                if not graph_ref.get_update_graph_event_obj().wait(Config.long_polling_timeout_seconds):
-                    return GraphRequest.Error(GraphRequest.ErrCodes.TIMED_OUT)
-            return graph_ref.get_revision_number()
+            # The revision number is compared while holding the lock
+            # that it is changed under, so an update made after
+            # the caller received its last graph is not missed.
+            if not graph_ref.wait_for_revision_change(
+                    last_received_graph_revision_number,
+                    Config.long_polling_timeout_seconds):
+                return GraphRequest.Error(GraphRequest.ErrCodes.TIMED_OUT)
+            # The revision is changed as soon as it is committed, which
+            # can be before its snapshot is published.
+            return self.draw_with_revision_number(
+                issue, graph_ref.get_revision_number())
         return GraphRequest.Error(GraphRequest.ErrCodes.GRAPH_UNAVAILABLE)
 
+    def subscribe_next_graph(self,
+                             issue: Tuple[bytes, int],
+                             last_received_graph_revision_number: int,
+                             subscriber: bytes,
+                             callback: 'GraphRequest.NextGraphCallback',
+                             changes_only: bool = False
+                             ) -> None:
+        """ Returns immediately.  Later, callback is called once, from
+            the notifier thread, with the drawn graph and its revision
+            number when the graph's revision number differs from
+            last_received_graph_revision_number (right away if it
+            already does); or with an error if it has not after
+            Config.long_polling_timeout_seconds (TIMED_OUT), or if the
+            subscriber subscribes again for the same issue before then
+            (GRAPH_UNAVAILABLE).
+            If changes_only is True, the callback is called with the
+            changes since last_received_graph_revision_number (see
+            get_changes()) instead of the drawn graph.
+            The callback should not block; e.g., for an RPyC client's
+            callback, wrap it with rpyc.async_().
+        """
+        subscription: Final = GraphRequest._Subscription(
+            last_received_graph_revision_number,
+            callback,
+            time.monotonic() + Config.long_polling_timeout_seconds,
+            changes_only)
+        with self._subscriptions_cond:
+            if self._notifier_thread is None:
+                self._notifier_thread = threading.Thread(
+                    target=self._notify_subscribers,
+                    name="graph revision notifier",
+                    daemon=True)
+                self._notifier_thread.start()
+            superseded: Final = self._subscriptions.setdefault(issue, {}).get(
+                subscriber)
+            self._subscriptions[issue][subscriber] = subscription
+            heapq.heappush(self._deadlines,
+                           (subscription.deadline,
+                            self._next_subscription_number,
+                            issue,
+                            subscriber,
+                            subscription))
+            self._next_subscription_number += 1
+            # let the notifier thread check whether there is
+            # already a newer revision
+            self._updated_issues.add(issue)
+            self._subscriptions_cond.notify()
+        if superseded is not None:
+            self._call_subscriber(superseded.callback,
+                                  GraphRequest.Error(
+                                      GraphRequest.ErrCodes.GRAPH_UNAVAILABLE))
+
+    def notify_graph_updated(self, issue: Tuple[bytes, int]) -> None:
+        """ Call after committing an update to the issue's graph
+            (or deleting it), from the thread that made the update, so
+            that the snapshot of the graph is published and its
+            subscribers are notified.
+        """
+        if self._issues_not_safe_to_write.graphs.has_key(issue):
+            graph_ref: Final[ArgumentGraph] = \
+                self._issues_not_safe_to_write.graphs[issue]
+            revision_number: Final[int] = \
+                graph_ref.get_drawn_graph_revision_number()
+            # the changes since the snapshot published before, if known
+            previous: Final = self._snapshots.get(issue)
+            changes: Optional[Tuple[int, GraphChanges]] = None
+            if previous is not None and previous[1] < revision_number:
+                changes_since_previous = graph_ref.get_changes_since(
+                    previous[1])
+                if changes_since_previous is not None:
+                    changes = (previous[1], changes_since_previous)
+            self._snapshots.publish(
+                issue,
+                (graph_ref.get_drawn_graph(), revision_number),
+                changes)
+        else:
+            self._snapshots.remove(issue)
+        with self._subscriptions_cond:
+            if issue in self._subscriptions:
+                self._updated_issues.add(issue)
+                self._subscriptions_cond.notify()
+
+    def get_cache_status(self) -> IssuesDBAccessor.CacheStatus:
+        return self._issues_accessor.get_cache_status()
+
+    def close(self) -> None:
+        """ Stops the notifier thread; remaining subscribers are
+            not notified.
+        """
+        with self._subscriptions_cond:
+            self._closed = True
+            self._subscriptions_cond.notify()
+        if self._notifier_thread is not None:
+            self._notifier_thread.join()
+
+    @staticmethod
+    def _call_subscriber(callback: 'GraphRequest.NextGraphCallback',
+                         result: Union[Tuple[str, int], 'GraphRequest.Error']
+                         ) -> None:
+        try:
+            callback(result)
+        except Exception as e:
+            # e.g., the client has disconnected
+            logger.debug("unable to notify subscriber: " + str(e))
+
+    def _remove_subscription(self, issue: Tuple[bytes, int],
+                             subscriber: bytes) -> None:
+        del self._subscriptions[issue][subscriber]
+        if not self._subscriptions[issue]:
+            del self._subscriptions[issue]
+
+    def _notify_subscribers(self) -> None:
+        while True:
+            # subscriptions answered this time through the loop
+            timed_out: List[GraphRequest._Subscription] = []
+            unavailable: List[GraphRequest._Subscription] = []
+            # subscriptions to be sent the graph, by issue
+            ready: Dict[Tuple[bytes, int],
+                        List[GraphRequest._Subscription]] = {}
+            # the revision number they are to be sent, by issue
+            ready_revision_numbers: Dict[Tuple[bytes, int], int] = {}
+            with self._subscriptions_cond:
+                while not self._closed and not self._updated_issues and \
+                        not (self._deadlines and
+                             self._deadlines[0][0] <= time.monotonic()):
+                    self._subscriptions_cond.wait(
+                        self._deadlines[0][0] - time.monotonic()
+                        if self._deadlines
+                        else None)
+                if self._closed:
+                    return
+                now: Final[float] = time.monotonic()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    _, _, issue, subscriber, subscription = \
+                        heapq.heappop(self._deadlines)
+                    if self._subscriptions.get(issue, {}).get(subscriber) \
+                            is subscription:
+                        self._remove_subscription(issue, subscriber)
+                        timed_out.append(subscription)
+                updated_issues: Final = self._updated_issues
+                self._updated_issues = set()
+                for issue in updated_issues:
+                    if issue not in self._subscriptions:
+                        continue
+                    if not self._issues_not_safe_to_write.graphs.has_key(issue):
+                        unavailable.extend(
+                            self._subscriptions.pop(issue).values())
+                        continue
+                    revision_number: int = self._issues_not_safe_to_write\
+                        .graphs[issue].get_revision_number()
+                    for subscriber, subscription in \
+                            list(self._subscriptions[issue].items()):
+                        if subscription.last_received_graph_revision_number \
+                                != revision_number:
+                            self._remove_subscription(issue, subscriber)
+                            ready.setdefault(issue, []).append(subscription)
+                            ready_revision_numbers[issue] = revision_number
+            for subscription in timed_out:
+                self._call_subscriber(subscription.callback,
+                                      GraphRequest.Error(
+                                          GraphRequest.ErrCodes.TIMED_OUT))
+            for subscription in unavailable:
+                self._call_subscriber(subscription.callback,
+                                      GraphRequest.Error(
+                                          GraphRequest.ErrCodes.GRAPH_UNAVAILABLE))
+            for issue, subscriptions in ready.items():
+                # read after getting the revision number, so it is at
+                # least as new as that revision
+                result: Optional[Union[Tuple[str, int],
+                                       GraphRequest.Error]] = None
+                for subscription in subscriptions:
+                    if subscription.changes_only:
+                        self._call_subscriber(
+                            subscription.callback,
+                            self.get_changes(
+                                issue,
+                                subscription
+                                .last_received_graph_revision_number))
+                        continue
+                    if result is None:
+                        result = self.draw_with_revision_number(
+                            issue, ready_revision_numbers[issue])
+                    self._call_subscriber(subscription.callback, result)
+
     def get_position_details(self, issue: Tuple[bytes, int],
                              pos_id: int) -> str:
         # Each thread needs its own context (provided by its own IssuesAccessor copy).
@@ -272,15 +799,98 @@ class GraphRequest:
 class LedgerRequest:
     """ Provides a thread-safe way to get ledger data from the
         betting exchange.
-        The ledger contains all previous bets and bids.
-        Use this to get a user's commitment store (bets and bids).
-        Gets a read lock on the ledger data.
+        The ledger contains all previous bets.
+        Use this to get a user's commitment store (bets), or the
+        price history of a market.
+        The ledger is read through an IssuesDBAccessor, so each
+        thread reads its own consistent view of it.
     """
-    pass
+    # a betting contract held by a user: the contract id, the position
+    # id (of its market), whether the user holds the support side
+    # (otherwise, the oppose side), the price paid for that side when
+    # the contract was made, and the number of contracts
+    Commitment = Tuple[int, int, bool, float, int]
+
+    class ErrCodes(enum.Enum):
+        INVALID_REQUEST = 1
+
+    @dataclass
+    class Error:
+        code: 'LedgerRequest.ErrCodes'
+
+    def __init__(self, issues_accessor: IssuesDBAccessor) -> None:
+        self._issues_accessor: Final = issues_accessor
+
+    @staticmethod
+    def _get_ledger(issues: Issues, issue: Tuple[bytes, int]
+                    ) -> Optional[Ledger]:
+        return issues.graphs[issue].betting_exchange.ledger \
+            if issues.graphs.has_key(issue) \
+            else None
+
+    def get_commitments(self, issue: Tuple[bytes, int], userid: bytes
+                        ) -> Tuple['LedgerRequest.Commitment', ...]:
+        with self._issues_accessor.get_context() as issues:
+            ledger: Final = self._get_ledger(issues, issue)
+            if ledger is None:
+                return ()
+            return tuple((contract.contract_id,
+                          contract.market_id,
+                          pro_or_con is ProOrCon.PRO,
+                          contract.get_price(pro_or_con),
+                          contract.amount)
+                         for pro_or_con, contract
+                         in ledger.get_commitments(userid))
+
+    def get_price_history(self, issue: Tuple[bytes, int], market_id: int,
+                          start_seconds: float, end_seconds: float,
+                          bucket_seconds: float
+                          ) -> Union[Tuple[Ohlc, ...], 'LedgerRequest.Error']:
+        """ See PriceHistory.get_ohlc().  The buckets are made wider if
+            there would be more than Config.price_history_max_buckets
+            of them between the first and the last price in the range.
+            Returns an error (INVALID_REQUEST) if bucket_seconds is not
+            positive or the times are not in order.
+        """
+        if not (0.0 < bucket_seconds < math.inf) or \
+                not (-math.inf < start_seconds <= end_seconds):
+            return LedgerRequest.Error(LedgerRequest.ErrCodes.INVALID_REQUEST)
+        with self._issues_accessor.get_context() as issues:
+            if not issues.graphs.has_key(issue):
+                return ()
+            markets: Final = issues.graphs[issue].betting_exchange.markets
+            price_history: Final[Optional[PriceHistory]] = \
+                markets[market_id].price_history \
+                if markets.has_key(market_id) \
+                else None
+            if price_history is None or not price_history.chunks:
+                return ()
+            span_seconds: Final = \
+                min(end_seconds, price_history.last_time_msec / 1000.0) \
+                - max(start_seconds, price_history.chunks.minKey() / 1000.0)
+            # (a span of n bucket widths touches at most n + 1 buckets)
+            min_bucket_seconds: Final = \
+                span_seconds / max(Config.price_history_max_buckets - 1, 1)
+            return tuple(price_history.get_ohlc(
+                start_seconds, end_seconds,
+                max(bucket_seconds, min_bucket_seconds)))
+
+    def get_owners(self, issue: Tuple[bytes, int], contract_id: int
+                   ) -> Optional[Tuple[bytes, bytes]]:
+        """ See Ledger.get_owners() """
+        with self._issues_accessor.get_context() as issues:
+            ledger: Final = self._get_ledger(issues, issue)
+            return ledger.get_owners(contract_id) \
+                if ledger is not None \
+                else None
 
 
 latest_thread_for_user: Final[Dict[bytes, int]] = {}
 
+def _graph_error_code(error: GraphRequest.Error) -> int:
+    """ error codes returned to clients waiting for the next graph """
+    return 1 if error.code == GraphRequest.ErrCodes.GRAPH_UNAVAILABLE else 2
+
 class AuthCredentialsStr(NamedTuple):
     userid: str
     password: str
@@ -345,23 +955,38 @@ class AllsemblyServices(rpyc.Service):
             #stub
             return True
 
+        def _queue_command(self, command: Command) -> Tuple[bool, float]:
+            """ Returns (True, 0.0) if the command was queued or, if the
+                queue is full, (False, the number of seconds after which
+                the client should try again).
+                (A plain tuple, so that RPyC passes it by value.)
+            """
+            if not self._services.command_queue.append(command):
+                return False, Config.command_queue_retry_after_seconds
+            return True, 0.0
+
         def delete_issue(self,
                                  issue: int
                                  #subuser: str,
-                                 ) -> None:
+                                 ) -> Tuple[bool, float]:
             """ attempt to delete a presumably existing issue.
-            No feedback given regarding failure or success.
+            No feedback given regarding failure or success of the
+            deletion itself.
             This function just puts the request on the queue.
+            Returns (accepted, retry_after_seconds), as argue() does.
             """
-            self._services.issue_queue.delete_issue((self._userid_hashed, issue))
+            return self._queue_command(
+                DeleteIssue((self._userid_hashed, issue)))
 
         def argue(self,
                           issue: int,
                           subuser: str,
                           argument: bytes  # ArgueSpeechAct
-                          ) -> bool:
-            """Always returns True.
-            Just puts the request on the queue.
+                          ) -> Tuple[bool, float]:
+            """Just puts the request on the queue.
+            Returns (accepted, retry_after_seconds): (True, 0.0) or, if
+            the queue is full, False and the number of seconds after
+            which the client should try again.
             """
             issue #mentioning variable so it isn't considered unused
                   #but it is not used currently; it is here for later
@@ -369,30 +994,46 @@ class AllsemblyServices(rpyc.Service):
             # and will have only one issue, not shared with others
             my_argument = pickle.loads(argument)
             logger.debug(my_argument.argument.pro_or_con)
-            self._services.graph_arg_queue.append((self._userid_hashed,
-                                         subuser,
-                                         (self._userid_hashed, 0),  # ignore issue number
-                                         my_argument.argument)
-                                        )
-            return True
+            return self._queue_command(
+                AddArgument(self._userid_hashed,
+                            subuser,
+                            (self._userid_hashed, 0),  # ignore issue number
+                            my_argument.argument))
 
 
         def propose(self,
                             issue: int,
                             subuser: str,
                             proposal: bytes  # ProposeSpeechAct
-                            ) -> bool:
-            """Always returns True.
-            Just puts the request on the queue.
+                            ) -> Tuple[bool, float]:
+            """Just puts the request on the queue.
+            Returns (accepted, retry_after_seconds), as argue() does.
             """
             issue  # mentioning variable so it isn't considered unused
                    # but it is not used currently; it is here for later
-            self._services.graph_pos_queue.append((self._userid_hashed,
-                                             subuser,
-                                             (self._userid_hashed, 0),  # issue,
-                                             pickle.loads(proposal).position)
-                                            )
-            return True
+            return self._queue_command(
+                AddPosition(self._userid_hashed,
+                            subuser,
+                            (self._userid_hashed, 0),  # issue,
+                            pickle.loads(proposal).position))
+
+
+        def place_ask(self,
+                      issue: int,
+                      subuser: str,
+                      ask: bytes  # Ask
+                      ) -> Tuple[bool, float]:
+            """Just puts the request on the queue; the ask is refused
+            when it is processed if the user does not hold the
+            contracts offered (see BettingExchange.place_ask()).
+            Returns (accepted, retry_after_seconds), as argue() does.
+            """
+            issue  # mentioning variable so it isn't considered unused
+                   # but it is not used currently; it is here for later
+            my_ask: Final[Ask] = pickle.loads(ask)
+            my_ask.market_locator.issue_id = 0  # ignore issue number
+            return self._queue_command(
+                PlaceAsk(self._userid_hashed, subuser, my_ask))
 
 
         #	def expose_bid(self, userid, password, position: ExistingPosition, bid: IndependentBid)
@@ -412,6 +1053,20 @@ class AllsemblyServices(rpyc.Service):
             """
             return self._services.graph_req.draw((self._userid_hashed, issue))
 
+        def get_arg_graph_gzip(self,
+                               issue: int
+                               ) -> bytes:
+            """Like get_arg_graph(...), but returns the graph
+            compressed with gzip, which is much smaller to transfer
+            and can be sent on to web browsers as is (with
+            "Content-Encoding: gzip").
+            """
+            result: Final = self._services.graph_req.draw_compressed(
+                (self._userid_hashed, issue))
+            if isinstance(result, GraphRequest.Error):
+                return gzip.compress(b"")
+            return result[0]
+
         def get_next_arg_graph(self,
                                issue: int,
                                # user: str,
@@ -424,20 +1079,82 @@ class AllsemblyServices(rpyc.Service):
             """
             my_thread_id: Final[int] = threading.get_ident()
             latest_thread_for_user[self._userid_hashed] = my_thread_id
-            available_graph: Final[Union[int, GraphRequest.Error]] = self._services.graph_req.get_next_graph(
+            available_graph: Final[Union[Tuple[str, int], GraphRequest.Error]] = self._services.graph_req.get_next_graph(
                 (self._userid_hashed, issue),
                 last_graph_revision_number
             )
             if not isinstance(available_graph, GraphRequest.Error):
                 if latest_thread_for_user[self._userid_hashed] == my_thread_id:
-                    return (
-                        self.get_arg_graph(issue),
-                        available_graph
-                    )
+                    return available_graph
                 else:
                     return 1
-            errcode: Final[int] = 1 if available_graph.code == GraphRequest.ErrCodes.GRAPH_UNAVAILABLE else 2
-            return errcode
+            return _graph_error_code(available_graph)
+
+        def subscribe_next_arg_graph(self,
+                                     issue: int,
+                                     last_graph_revision_number: int,
+                                     callback: Callable[
+                                         [Union[Tuple[str, int], int]], None]
+                                     ) -> None:
+            """Like get_next_arg_graph(...), but returns immediately,
+            without waiting for the next revision of the graph.
+            Instead, the result that get_next_arg_graph(...) would
+            return is passed to the callback, a function provided by
+            the client.  The client should serve its connection (e.g.,
+            by calling its serve() method) until the callback is called.
+            A subscription replaces the user's previous one, which
+            gets error code 1.
+            """
+            async_callback: Final = rpyc.async_(callback)
+            def deliver(result: Union[Tuple[str, int], GraphRequest.Error]
+                        ) -> None:
+                async_callback(_graph_error_code(result)
+                               if isinstance(result, GraphRequest.Error)
+                               else result)
+            self._services.graph_req.subscribe_next_graph(
+                (self._userid_hashed, issue),
+                last_graph_revision_number,
+                self._userid_hashed,
+                deliver)
+
+        def subscribe_next_arg_graph_changes(
+                self,
+                issue: int,
+                last_graph_revision_number: int,
+                callback: Callable[
+                    [Union[Tuple[Optional[str], int,
+                                 Tuple[Tuple[int, str], ...],
+                                 Tuple[Tuple[int, bool, int,
+                                             Tuple[int, ...]], ...],
+                                 Tuple[Tuple[int, Optional[float],
+                                             float], ...]],
+                           int]], None]
+                ) -> None:
+            """Like subscribe_next_arg_graph(...), but the callback is
+            passed only the changes since last_graph_revision_number:
+            the argument graph (svg string), only if it has to be
+            drawn again (otherwise None), the graph revision number,
+            and the positions added, the arguments added, and the
+            positions whose price or probability changed (see
+            argument_graph.GraphChanges); or an error code.
+            """
+            async_callback: Final = rpyc.async_(callback)
+            def deliver(result: Union[GraphRequest.ChangesResult,
+                                      GraphRequest.Error]) -> None:
+                if isinstance(result, GraphRequest.Error):
+                    async_callback(_graph_error_code(result))
+                    return
+                graph_svg, changes = result
+                # as a plain tuple, so that RPyC passes it by value
+                async_callback((graph_svg, changes.revision_number,
+                                changes.positions, changes.arguments,
+                                changes.values))
+            self._services.graph_req.subscribe_next_graph(
+                (self._userid_hashed, issue),
+                last_graph_revision_number,
+                self._userid_hashed,
+                deliver,
+                changes_only=True)
 
 
         def get_position_details(self,
@@ -451,32 +1168,52 @@ class AllsemblyServices(rpyc.Service):
                 pos_id
             )
 
-    # NOT IMPLEMENTED YET
-    #	def exposed_get_commitments(self, userid, password, issue, subuser):
-    #		user_or_none = user_auth.authenticate_user(userid, password)
-    #		if user_or_none is not None:
-    #			user_or_none.last_login = time.time()
-    #			user_or_none.current_issue = issue
-    #			user_or_none.current_subuser = subuser
-    #			transaction.commit()
-    #			return ledger_ref.get_items(issue,
-    #			                            user_or_none.userid_hashed,
-    #			                            subuser
-    #			                            )
+        def get_price_history(self,
+                              issue: int,
+                              pos_id: int,
+                              start_seconds: float,
+                              end_seconds: float,
+                              bucket_seconds: float
+                              ) -> Union[Tuple[Ohlc, ...], int]:
+            """ Returns the support prices of the position's market
+            from start_seconds up to end_seconds (in seconds since the
+            epoch), downsampled into buckets of (at least)
+            bucket_seconds, as (bucket start time, open, high, low,
+            close) tuples, leaving out the buckets without prices.
+            Returns the error code 1 if bucket_seconds is not positive
+            or the times are not in order (see LedgerRequest).
+            """
+            result: Final = self._services.ledger_req.get_price_history(
+                (self._userid_hashed, issue),
+                pos_id,
+                start_seconds,
+                end_seconds,
+                bucket_seconds
+            )
+            if isinstance(result, LedgerRequest.Error):
+                return result.code.value
+            return result
+
+        def get_commitments(self,
+                            issue: int
+                            ) -> Tuple[LedgerRequest.Commitment, ...]:
+            """ Returns the betting contracts that the user holds in
+            the issue's markets (see LedgerRequest.Commitment).
+            """
+            return self._services.ledger_req.get_commitments(
+                (self._userid_hashed, issue),
+                self._userid_hashed
+            )
 
     def __init__(self,
-                 order_queue: OrderQueue,
-                 graph_arg_queue: GraphUpdateArgQueue,
-                 graph_pos_queue: GraphUpdatePosQueue,
-                 issue_queue: IssueQueue,
+                 command_queue: CommandQueue,
+                 issues_req: IssuesRequest,
                  graph_req: GraphRequest,
                  ledger_req: LedgerRequest):
-        self.order_queue = order_queue
-        self.graph_arg_queue = graph_arg_queue
-        self.graph_pos_queue = graph_pos_queue
+        self.command_queue = command_queue
         self.graph_req = graph_req
         self.ledger_req = ledger_req
-        self.issue_queue = issue_queue
+        self.issues_req = issues_req
 
     def on_connect(self, conn: Any) -> None:
         #RPyC boilerplate
@@ -493,9 +1230,33 @@ class AllsemblyServices(rpyc.Service):
                                   ) -> 'AllsemblyServices.UserServices':
         return AllsemblyServices.UserServices(self, userid)
 
+    def exposed_get_queue_status(self) -> Tuple[int, int, int, int]:
+        """ Returns the depth of the command queue, its greatest depth
+            so far (high-water mark), its capacity, and the number of
+            requests refused because it was full, so that clients can
+            back off before it fills up.
+        """
+        status: Final = self.command_queue.get_status()
+        # as a plain tuple, so that RPyC passes it by value
+        return (status.depth, status.high_water_mark, status.max_items,
+                status.rejected)
+
+    def exposed_get_database_status(self) -> Tuple[int, int, int, int]:
+        """ Returns the number of objects in the object caches of the
+            connections used to read the argument database, how many of
+            them are loaded (not ghosts), how many objects were loaded
+            from storage by the graph requests (cache misses), and how
+            many records were found in the ZEO client cache, if any.
+            (See IssuesDBAccessor.get_cache_status().)
+        """
+        status: Final = self.graph_req.get_cache_status()
+        # as a plain tuple, so that RPyC passes it by value
+        return (status.cached_objects, status.non_ghost_objects,
+                status.loads, status.storage_cache_hits)
+
     def _add_issue(self,
                    issue_name: str) -> Optional[int]:
         """ creates a new issue, allocating an arg graph for it
             and returns its issue number.
         """
-        return self.issue_queue.add_issue(issue_name)
+        return self.issues_req.add_issue(issue_name)
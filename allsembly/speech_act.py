@@ -72,13 +72,18 @@ class IndependentBid:
         Bid prices should be between 0 and 1 in certain
         increments (e.g., .001).
     """
+    # for bids pickled before the amount was added
+    amount = 1
+
     def __init__(self, max_price: float, min_price: float,
                  market_locator: MarketLocator,
-                 pro_or_con: ProOrCon) -> None:
+                 pro_or_con: ProOrCon,
+                 amount: int = 1) -> None:
         self.max_price = max_price
         self.min_price = min_price
         self.market_locator = market_locator
         self.pro_or_con = pro_or_con
+        self.amount = amount #number of betting contracts to purchase
 
 
 class ExistingPosition:
@@ -225,11 +230,19 @@ class ProposeSpeechAct:
         self.position = initial_position
 
 class Ask:
-    """ Represents an offer to sell an existing bidding
-        contract held by the user-owner.
-        Not implemented yet.
+    """ Represents an offer to sell existing betting
+        contracts held by the user-owner: amount contracts
+        for the side pro_or_con of a specific position at
+        (at least) min_price for that side.
     """
-    pass
+    def __init__(self, min_price: float,
+                 market_locator: MarketLocator,
+                 pro_or_con: ProOrCon,
+                 amount: int = 1) -> None:
+        self.min_price = min_price
+        self.market_locator = market_locator
+        self.pro_or_con = pro_or_con
+        self.amount = amount #number of betting contracts to sell
 
 class ArgumentScheme:
     # might not be a separate category from Argument
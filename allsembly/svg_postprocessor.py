@@ -0,0 +1,131 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+""" Post-processing of the SVG drawn by Graphviz before it is
+    sent to the participants' browsers.
+"""
+
+import html
+import logging
+from typing import Dict, List, Optional, Tuple
+from typing_extensions import Final
+from xml.parsers import expat
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+class _SvgPostProcessor:
+    """ Parses an SVG document incrementally, in one linear pass,
+        noting the edits to make:
+        - make the text and the text box of each position node
+          clickable (calling show_position_details(pos_id));
+        - wrap the contents of text elements in CDATA sections,
+          to prevent a participant injecting html or javascript into
+          other participants' browsers.
+        Then copies the document with those edits, writing '-'
+        instead of '&#45;'.
+        Everything else is copied unchanged from the input, so only
+        elements are reported by the parser, not character data.
+    """
+    def __init__(self, svg: bytes) -> None:
+        self._svg = svg
+        self._parser = expat.ParserCreate()
+        self._parser.StartElementHandler = self._start_element
+        self._parser.EndElementHandler = self._end_element
+        # (start, end, replacement), in order of position in self._svg
+        self._edits: List[Tuple[int, int, bytes]] = []
+        self._depth = 0
+        # depth of the <g class="node"> element being parsed, if any
+        self._node_group_depth: Optional[int] = None
+        self._title_start: Optional[int] = None
+        # the position whose node is being parsed, if any
+        self._pos_id: Optional[bytes] = None
+        self._text_start = 0
+
+    def process(self) -> str:
+        self._parser.Parse(self._svg, True)
+        output: List[bytes] = []
+        copied_up_to = 0
+        for start, end, replacement in self._edits:
+            output.append(self._svg[copied_up_to:start])
+            output.append(replacement)
+            copied_up_to = end
+        output.append(self._svg[copied_up_to:])
+        return b"".join(output).replace(b"&#45;", b"-").decode("utf-8")
+
+    def _end_of_start_tag(self) -> int:
+        return self._svg.index(b">", self._parser.CurrentByteIndex) + 1
+
+    def _start_element(self, name: str, attributes: Dict[str, str]) -> None:
+        self._depth += 1
+        if name == "g":
+            if attributes.get("class") == "node":
+                self._node_group_depth = self._depth
+                self._pos_id = None
+        elif name == "title":
+            if self._node_group_depth is not None:
+                self._title_start = self._end_of_start_tag()
+        elif name == "text" or name == "polygon":
+            if name == "text":
+                self._text_start = self._end_of_start_tag()
+            if self._pos_id is not None:
+                onclick: Final[bytes] = b' onclick="show_position_details(' \
+                                        + self._pos_id + b');"'
+                # the polygon is the space around a position's text
+                new_attributes: Final[bytes] = \
+                    b' cursor="pointer" pointer-events="visible"' + onclick \
+                    if name == "polygon" \
+                    else b' cursor="pointer"' + onclick
+                after_name: Final[int] = \
+                    self._parser.CurrentByteIndex + 1 + len(name)
+                self._edits.append((after_name, after_name, new_attributes))
+
+    def _end_element(self, name: str) -> None:
+        end: Final[int] = self._parser.CurrentByteIndex
+        if name == "text":
+            # nothing to wrap if the element is empty, e.g., <text/>
+            if self._svg[self._text_start - 2:self._text_start] != b"/>":
+                text: Final[str] = html.unescape(
+                    self._svg[self._text_start:end].decode("utf-8"))
+                self._edits.append(
+                    (self._text_start, end,
+                     b"<![CDATA["
+                     + text.replace("]]>", "]]]]><![CDATA[>").encode("utf-8")
+                     + b"]]>"))
+        elif name == "title":
+            if self._title_start is not None:
+                title: Final[bytes] = self._svg[self._title_start:end]
+                # only positions' nodes are named with just their pos_id
+                self._pos_id = title if title.isdigit() else None
+                self._title_start = None
+        elif self._depth == self._node_group_depth:
+            self._node_group_depth = None
+            self._pos_id = None
+        self._depth -= 1
+
+
+def postprocess_svg(svg: bytes) -> str:
+    """ Returns the SVG drawn by Graphviz, made clickable and safe to
+        display (see _SvgPostProcessor), or an empty string if it
+        could not be parsed.
+    """
+    try:
+        return _SvgPostProcessor(svg).process()
+    except expat.ExpatError as e:
+        logger.error("unable to post-process the drawn graph: " + str(e))
+        return ""
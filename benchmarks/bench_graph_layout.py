@@ -0,0 +1,94 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+""" Counts the Graphviz layouts and measures the time taken per
+    ArgumentGraph.add_argument() call on graphs of increasing size.
+
+    Usage: python benchmarks/bench_graph_layout.py [NODES ...]
+"""
+
+import sys
+import time
+from typing import Any, List
+from typing_extensions import Final
+
+import pygraphviz as pgv #type: ignore[import]
+
+from allsembly.argument_graph import ArgumentGraph, build_ArgumentNode, \
+    build_PositionNode
+
+PREMISES_PER_ARGUMENT = 2
+TIMED_ARGUMENTS = 5
+
+layout_calls = 0
+original_layout = pgv.AGraph.layout
+
+def counting_layout(self: Any, *args: Any, **kwargs: Any) -> Any:
+    global layout_calls
+    layout_calls += 1
+    return original_layout(self, *args, **kwargs)
+
+pgv.AGraph.layout = counting_layout
+
+
+def add_argument(graph: ArgumentGraph, conclusion_id: int,
+                 update_graph: bool = True) -> None:
+    new_arg_node = build_ArgumentNode(b"benchmark", True, conclusion_id)
+    for i in range(PREMISES_PER_ARGUMENT):
+        new_arg_node.premises_ids.append(
+            graph.add_position(build_PositionNode(b"benchmark",
+                                                  "premise " + str(i)),
+                               update_graph=False))
+    graph.add_argument(new_arg_node, update_graph=update_graph)
+
+
+def run(number_of_nodes: int) -> None:
+    global layout_calls
+    graph = ArgumentGraph("benchmark")
+    graph.add_position(build_PositionNode(b"benchmark", "root"),
+                       update_graph=False)
+    # grow a tree of the requested size, drawing it just once
+    while graph.next_pos_id < number_of_nodes:
+        add_argument(graph, graph.next_pos_id // 2, update_graph=False)
+    graph.update_graph()
+    layout_calls = 0
+    start = time.perf_counter()
+    for _ in range(TIMED_ARGUMENTS):
+        add_argument(graph, graph.next_pos_id - 1)
+    elapsed = time.perf_counter() - start
+    print("{:>6} nodes: {:.1f} layouts and {:.3f} s per add_argument".format(
+        graph.next_pos_id,
+        layout_calls / TIMED_ARGUMENTS,
+        elapsed / TIMED_ARGUMENTS))
+
+
+def main(argv: List[str]) -> None:
+    # probabilities are not what is being measured here, so they are
+    # not calculated
+    problog_calculate: Final = ArgumentGraph._problog_calculate
+    ArgumentGraph._problog_calculate = lambda self: None  #type: ignore[assignment]
+    try:
+        for number_of_nodes in [int(arg) for arg in argv] or [10, 100, 500]:
+            run(number_of_nodes)
+    finally:
+        ArgumentGraph._problog_calculate = problog_calculate  #type: ignore[assignment]
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,80 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+""" Measures the throughput of processing queued requests (a new
+    position followed by bids on it) with a commit after every
+    request compared with group commits, on a FileStorage database.
+
+    Usage: python benchmarks/bench_group_commit.py [REQUESTS [GROUP_SIZE ...]]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+from allsembly.allsembly import AllsemblyServer
+from allsembly.config import Config
+from allsembly.rpyc_server import AddPosition, PlaceOrder
+from allsembly.speech_act import IndependentBid, InitialPosition, \
+    MarketLocator, ProOrCon
+
+ISSUE_ID = (b"benchmark", 0)
+BIDS_PER_POSITION = 3
+
+
+def run(number_of_requests: int, group_commit_max_items: int) -> None:
+    Config.group_commit_max_items = group_commit_max_items
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        server = AllsemblyServer(os.path.join(tmpdirname, "userdb"),
+                                 os.path.join(tmpdirname, "argdb"))
+        try:
+            number_of_positions = number_of_requests // (1 + BIDS_PER_POSITION)
+            for pos_id in range(number_of_positions):
+                server.command_queue.append(
+                    AddPosition(b"benchmark", "", ISSUE_ID,
+                                InitialPosition("position " + str(pos_id))))
+                for i in range(BIDS_PER_POSITION):
+                    server.command_queue.append(
+                        PlaceOrder(b"benchmark", "", IndependentBid(
+                            60 + i, 40, MarketLocator(ISSUE_ID[1], pos_id),
+                            ProOrCon.PRO)))
+            start = time.perf_counter()
+            server.process_all_commands_from_queue(None, None)
+            elapsed = time.perf_counter() - start
+            print("{:>6} requests, group of {:>4}: {:.3f} s, "
+                  "{:.0f} requests/s".format(
+                      number_of_positions * (1 + BIDS_PER_POSITION),
+                      group_commit_max_items,
+                      elapsed,
+                      number_of_positions * (1 + BIDS_PER_POSITION) / elapsed))
+        finally:
+            server.cleanup()
+
+
+def main(argv: List[str]) -> None:
+    number_of_requests = int(argv[0]) if argv else 2000
+    for group_commit_max_items in [int(arg) for arg in argv[1:]] \
+            or [1, 10, 100, 1000]:
+        run(number_of_requests, group_commit_max_items)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,88 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+""" Measures the time to process arguments added to many issues at
+    once in the main server process compared with issue shard worker
+    processes (see allsembly.allsembly.IssueShards).
+
+    Usage: python benchmarks/bench_issue_shards.py [ISSUES [SHARDS ...]]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+from allsembly.allsembly import AllsemblyServer
+from allsembly.config import Config
+from allsembly.rpyc_server import AddArgument, AddPosition
+from allsembly.speech_act import Argument, Bid, InitialPosition, Premise, \
+    ProOrCon, UnconcededPosition
+
+ARGUMENTS_PER_ISSUE = 10
+WORKER_STARTUP_SECONDS = 5.0
+
+
+def run(number_of_issues: int, issue_shard_processes: int) -> None:
+    Config.issue_shard_processes = issue_shard_processes
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        server = AllsemblyServer(os.path.join(tmpdirname, "userdb"),
+                                 os.path.join(tmpdirname, "argdb"))
+        try:
+            server.start_worker_processes()
+            if server.issue_shards is not None:
+                time.sleep(WORKER_STARTUP_SECONDS)
+            for i in range(number_of_issues):
+                userid = b"benchmark" + bytes(str(i), "utf-8")
+                issue_id = (userid, 0)
+                server.command_queue.append(
+                    AddPosition(userid, "", issue_id, InitialPosition("root")))
+                for j in range(ARGUMENTS_PER_ISSUE):
+                    server.command_queue.append(
+                        AddArgument(userid, "", issue_id,
+                                    Argument(ProOrCon.PRO,
+                                             Premise("premise " + str(j),
+                                                     Bid(70, 50, 1)),
+                                             UnconcededPosition(j // 2),
+                                             None, None, [])))
+            start = time.perf_counter()
+            server.process_all_commands_from_queue(None, None)
+            if server.issue_shards is not None:
+                # waits for the workers to finish
+                server.issue_shards.shutdown()
+                server.issue_shards = None
+            else:
+                server.process_dirty_issues(force=True)
+            elapsed = time.perf_counter() - start
+            print("{:>4} issues, {} shard processes: {:.2f} s".format(
+                number_of_issues, issue_shard_processes, elapsed))
+        finally:
+            server.cleanup()
+
+
+def main(argv: List[str]) -> None:
+    number_of_issues = int(argv[0]) if argv else 40
+    for issue_shard_processes in [int(arg) for arg in argv[1:]] \
+            or [0, 1, 2, 4]:
+        run(number_of_issues, issue_shard_processes)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,108 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+
+""" Measures the sustained rate of orders placed in a single market
+    whose order book has 100k waiting orders.  The orders are around
+    the market price, so that some of them are matched, partially
+    filling the waiting orders, and the rest wait in the order book.
+    The order book is kept in a FileStorage database, committing after
+    every COMMIT_EVERY orders (0 for not committing at all), to also
+    measure how much is written to the database for each order.
+
+    Usage: python benchmarks/bench_order_book.py
+               [WAITING_ORDERS [ORDERS [COMMIT_EVERY ...]]]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List
+
+import transaction
+import ZODB
+import ZODB.FileStorage
+
+from allsembly.betting_exchange import OrderBook
+from allsembly.speech_act import ProOrCon
+
+USERS = 1000
+
+
+def make_order_book(waiting_orders: int) -> OrderBook:
+    order_book = OrderBook()
+    # support bids below 50 and oppose bids below 50 (i.e., asking
+    # more than 50 for support), so that none of them are matched
+    for i in range(waiting_orders):
+        order_book.place_bid(str(i % USERS).encode(),
+                             ProOrCon.PRO if i % 2 else ProOrCon.CON,
+                             float(random.randint(1, 49)),
+                             random.randint(1, 10))
+    return order_book
+
+
+def run(waiting_orders: int, orders: int, commit_every: int) -> None:
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        storage = ZODB.FileStorage.FileStorage(
+            os.path.join(tmpdirname, "orderdb"))
+        db = ZODB.DB(storage)
+        try:
+            conn = db.open()
+            conn.root.order_book = make_order_book(waiting_orders)
+            transaction.commit()
+            order_book = conn.root.order_book
+            size_at_start = storage.getSize()
+            fills = 0
+            start = time.perf_counter()
+            for i in range(orders):
+                fills += len(order_book.place_bid(
+                    str(random.randrange(USERS)).encode(),
+                    ProOrCon.PRO if i % 2 else ProOrCon.CON,
+                    float(random.randint(40, 60)),
+                    random.randint(1, 10)))
+                if commit_every and (i + 1) % commit_every == 0:
+                    transaction.commit()
+            if commit_every:
+                transaction.commit()
+            elapsed = time.perf_counter() - start
+            written = storage.getSize() - size_at_start
+            print("commit every {:>4}: {} orders in {:.2f} s"
+                  " ({:.0f} orders/s, {:.0f} bytes written/order), {} fills;"
+                  " {} orders waiting at the start, {} at the end".format(
+                      commit_every or "-", orders, elapsed, orders / elapsed,
+                      written / orders, fills, waiting_orders,
+                      len(order_book)))
+            transaction.abort()
+            conn.close()
+        finally:
+            db.close()
+
+
+def main(argv: List[str]) -> None:
+    waiting_orders = int(argv[0]) if argv else 100000
+    orders = int(argv[1]) if len(argv) > 1 else 10000
+    for commit_every in [int(arg) for arg in argv[2:]] or [0, 1, 100]:
+        run(waiting_orders, orders, commit_every)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,100 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+""" Measures the post-processing of SVGs shaped like those drawn by
+    Graphviz for argument graphs with 1k and 10k position nodes, compared
+    with the sequence of regular expression substitutions that was used
+    before.
+
+    Usage: python benchmarks/bench_svg_postprocessor.py [NODES ...]
+"""
+
+import re
+import sys
+import time
+from typing import Any, Callable, List
+
+from allsembly.svg_postprocessor import postprocess_svg
+
+POSITION_NODE = """<!-- {0} -->
+<g id="node{0}" class="node">
+<title>{0}</title>
+<path fill="none" stroke="black" d="M12,&#45;30.75C12,&#45;30.75 147.25,&#45;30.75 147.25,&#45;30.75 153.25,&#45;30.75 159.25,&#45;36.75 159.25,&#45;42.75"/>
+<text xml:space="preserve" text-anchor="start" x="81.69" y="&#45;69.25" font-family="Times,serif" font-size="14.00">57.1%</text>
+<polygon fill="none" stroke="black" points="8,&#45;36.25 8,&#45;65.5 151.25,&#45;65.5 151.25,&#45;36.25 8,&#45;36.25"/>
+<text xml:space="preserve" text-anchor="start" x="14" y="&#45;46" font-family="Times,serif" font-size="14.00">Statement number {0}</text>
+<text xml:space="preserve" text-anchor="start" x="14" y="&#45;30" font-family="Times,serif" font-size="14.00">continued on a second line</text>
+</g>
+<!-- a{0} -->
+<g id="arg{0}" class="node">
+<title>a{0}</title>
+<ellipse fill="none" stroke="black" cx="214.89" cy="&#45;59" rx="19.64" ry="19.64"/>
+<text xml:space="preserve" text-anchor="middle" x="214.89" y="&#45;54.33" font-family="Times,serif" font-size="14.00">+</text>
+</g>
+<!-- {0}&#45;&gt;a{0} -->
+<g id="edge{0}" class="edge">
+<title>{0}&#45;&gt;a{0}</title>
+<path fill="none" stroke="black" d="M166.13,&#45;59C176.96,&#45;59 187.05,&#45;59 195.15,&#45;59"/>
+</g>
+"""
+
+def make_svg(number_of_nodes: int) -> str:
+    return ('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+            '<svg width="449pt" height="135pt" '
+            'xmlns="http://www.w3.org/2000/svg">\n'
+            '<g id="graph0" class="graph">\n'
+            + "".join(POSITION_NODE.format(i) for i in range(number_of_nodes))
+            + "</g>\n</svg>\n")
+
+
+def regex_cascade(svg: str) -> str:
+    """ The post-processing done before, for comparison """
+    svg = re.sub(r'&#45;', r'-', svg)
+    svg = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<polygon (.*)/>\n<text ', r'<g id="node\1<title>\2</title>\n<polygon \3/>\n<text style="cursor:pointer;" onclick="show_position_details(\2);" ', svg)
+    svg = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text style="cursor:pointer;" onclick="show_position_details(\2);" ', svg)
+    svg = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text style="cursor:pointer;" onclick="show_position_details(\2);" ', svg)
+    svg = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<polygon (.*)/>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<polygon \5/>\n<text style="cursor:pointer;" onclick="show_position_details(\2);" ', svg)
+    svg = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text (.*)</text>\n<polygon ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text \5</text>\n<polygon cursor="pointer" pointer-events="visible" onclick="show_position_details(\2);" ', svg)
+    svg = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text (.*)</text>\n<polygon (.*)\>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text \5</text>\n<polygon \6/>\n<text cursor="pointer" onclick="show_position_details(\2);" ', svg)
+    svg = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text (.*)</text>\n<polygon (.*)\>\n<text (.*)</text>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text \5</text>\n<polygon \6/>\n<text \7</text>\n<text cursor="pointer" onclick="show_position_details(\2);" ', svg)
+    svg = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text (.*)</text>\n<polygon (.*)\>\n<text (.*)</text>\n<text (.*)</text>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text \5</text>\n<polygon \6/>\n<text \7</text>\n<text \8</text>\n<text cursor="pointer" onclick="show_position_details(\2);" ', svg)
+    svg = re.sub(r'<g id="node(.*)\n?<title>(.*)</title>\n<path (.*)/>\n<text (.*)</text>\n<text (.*)</text>\n<polygon (.*)\>\n<text (.*)</text>\n<text (.*)</text>\n<text (.*)</text>\n<text ', r'<g id="node\1<title>\2</title>\n<path \3/>\n<text \4</text>\n<text \5</text>\n<polygon \6/>\n<text \7</text>\n<text \8</text>\n<text \9</text>\n<text cursor="pointer" onclick="show_position_details(\2);" ', svg)
+    svg = re.sub(r'<text (.*)>(.*)</text>', r'<text \1><![CDATA[\2]]></text>', svg)
+    return svg
+
+
+def time_once(postprocess: Callable[[Any], str], svg: Any) -> float:
+    start = time.perf_counter()
+    postprocess(svg)
+    return time.perf_counter() - start
+
+
+def main(argv: List[str]) -> None:
+    for number_of_nodes in [int(arg) for arg in argv] or [1000, 10000]:
+        svg = make_svg(number_of_nodes)
+        print("{:>6} nodes ({:.1f} MB): single pass {:.3f} s,"
+              " regex cascade {:.3f} s".format(
+                  number_of_nodes,
+                  len(svg) / 1e6,
+                  time_once(postprocess_svg, svg.encode("utf-8")),
+                  time_once(regex_cascade, svg)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
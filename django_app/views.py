@@ -16,20 +16,24 @@
 #   License along with Allsembly™ Prototype.  If not, see
 #   <https://www.gnu.org/licenses/>.
 #
+import functools
+import math
 import pickle
+import time
+import zlib
 
 from django.db import IntegrityError
 from typing_extensions import Final
-import rpyc #type: ignore[import]
-from typing import Optional, Union, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Union, Tuple
 
 from allsembly.config import Config, Limits
+from allsembly.rpyc_client import RpycConnectionPool
 from allsembly.speech_act import ArgueSpeechAct, Argument, Premise, Bid, \
     UnconcededPosition, ProposeSpeechAct, InitialPosition, ProOrCon
 
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import HttpResponseRedirect, HttpResponse, JsonResponse
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django_app.models import RegistrationComment
@@ -45,6 +49,16 @@ SERVER_PORT_NUMBER: Final[int] = Config.rpyc_server_default_port
 SUPPORT: Final[str] = 'Pro'
 OPPOSE: Final[str] = 'Con'
 
+# connections to the Allsembly server, reused across requests
+rpyc_connection_pool: Final[RpycConnectionPool] = \
+    RpycConnectionPool(port=SERVER_PORT_NUMBER)
+# and for long polling, which holds a connection while waiting for the
+# next graph, so that waiting browsers do not hold up other requests
+rpyc_long_polling_pool: Final[RpycConnectionPool] = \
+    RpycConnectionPool(
+        port=SERVER_PORT_NUMBER,
+        max_connections=Config.rpyc_client_long_polling_pool_max_connections)
+
 
 @require_http_methods(["GET", "POST"])
 def login_view(request):
@@ -124,8 +138,47 @@ def demo(request):
     context = {'propose_form': propose_form, 'argue_form': argue_form}
     return render(request, 'django_app/demo.html', context)
 
+def _busy_response(retry_after: float) -> JsonResponse:
+    """ Response telling the browser to try again after retry_after
+        seconds because the server is busy
+    """
+    retry_after_seconds: Final[int] = math.ceil(retry_after)
+    response: Final = JsonResponse({
+        'success': False,
+        'error': 2,
+        'error_text': 'The server is busy. Please try again in '
+                      + str(retry_after_seconds) + ' seconds.',
+        'retry_after': retry_after_seconds})
+    response['Retry-After'] = str(retry_after_seconds)
+    return response
+
+def _retry_if_busy(view):
+    """ Decorator for views using a connection pool: if no connection
+        to the server becomes available in time, the browser is told
+        to try again
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except RpycConnectionPool.Exhausted:
+            return _busy_response(Config.command_queue_retry_after_seconds)
+    return wrapper
+
+def _queued_request_response(ret: Tuple[bool, float]) -> JsonResponse:
+    """ Response for a request that the server puts on its queue:
+        ret is (accepted, retry_after_seconds), where retry_after_seconds
+        is the number of seconds after which to try again because the
+        queue is full when accepted is False.
+    """
+    accepted, retry_after_seconds = ret
+    if accepted:
+        return JsonResponse({'success': True, 'error': 0})
+    return _busy_response(retry_after_seconds)
+
 @login_required
 @require_http_methods(["POST"])
+@_retry_if_busy
 def argue(request):
     form = ArgueForm(request.POST)
     if not form.is_valid():
@@ -142,7 +195,6 @@ def argue(request):
 		     + ("" if argument_is_PRO else "NOT ") \
              + target_position_text
 
-    client = rpyc.connect("::1", SERVER_PORT_NUMBER, config = {"allow_public_attrs": True, "sync_request_timeout": None}, ipv6=True)
     my_argue_speech_act = ArgueSpeechAct(
       Argument(
         ProOrCon.PRO if
@@ -175,23 +227,24 @@ def argue(request):
     #I'm picking the my_argue_speech_act object because it will otherwise
     #be passed by reference (as a "netref") by RPyC.
     #Maybe it would also work to arrange it so the variable goes out of
-    #scope before client.close() or is unbound.  I haven't tried it, and I
-    #also imagine it could create a race condition.  It might work to
-    #to not use a variable at all, but would make the call harder to read.
-    ret = client.root.get_user_services(
-        bytes(request.user.username, 'utf-8')
-        ).argue(0, "", pickle.dumps(my_argue_speech_act))
-    client.close()
-    return JsonResponse({'success': ret, 'error' : 0 if ret else 1})
+    #scope before the connection is returned to the pool or is unbound.
+    #I haven't tried it, and I also imagine it could create a race condition.
+    #It might work to not use a variable at all, but would make the call
+    #harder to read.
+    with rpyc_connection_pool.connection() as client:
+        ret = client.root.get_user_services(
+            bytes(request.user.username, 'utf-8')
+            ).argue(0, "", pickle.dumps(my_argue_speech_act))
+    return _queued_request_response(ret)
 
 @login_required
 @require_http_methods(["POST"])
+@_retry_if_busy
 def propose(request):
     form = ProposeForm(request.POST)
     if not form.is_valid():
         return JsonResponse({'success': False, 'error': 1, 'error_text': 'Invalid input.' })
 
-    client = rpyc.connect("::1", SERVER_PORT_NUMBER, config = {"allow_public_attrs": True, "sync_request_timeout": None}, ipv6=True)
     my_propose_speech_act = ProposeSpeechAct(
                          InitialPosition(form.cleaned_data['position_text'],
                                          [(Premise("premise", Bid(50,50,10)
@@ -201,26 +254,53 @@ def propose(request):
                            )
     #I'm picking the my_propose_speech_act object because it will otherwise
     #be passed by reference (as a "netref") by RPyC.
-    #Maybe it would also work to arrange it so the variable goes out of
-    #scope before client.close() or is unbound.  I haven't tried it, and I
-    #also imagine it could create a race condition.  It might work to
-    #to not use a variable at all, but would make the call harder to read.
-    client.root.get_user_services(
-        bytes(request.user.username, 'utf-8')
-        ).propose(0, "", pickle.dumps(my_propose_speech_act))
-    client.close()
-    return JsonResponse({'success': True, 'error' : 0})
+    #(See the comment in argue, above.)
+    with rpyc_connection_pool.connection() as client:
+        ret = client.root.get_user_services(
+            bytes(request.user.username, 'utf-8')
+            ).propose(0, "", pickle.dumps(my_propose_speech_act))
+    return _queued_request_response(ret)
+
+
+#size of the pieces that graphs are streamed to the browser in
+GRAPH_CHUNK_BYTES: Final = 64 * 1024
+
+
+def _chunks(data: bytes) -> Iterator[bytes]:
+    for start in range(0, len(data), GRAPH_CHUNK_BYTES):
+        yield data[start:start + GRAPH_CHUNK_BYTES]
+
+
+def _decompressed_chunks(gzip_data: bytes) -> Iterator[bytes]:
+    #for browsers that do not accept gzip; decompressed a piece at a
+    #time, so that the whole graph is not in memory at once
+    decompressor: Final = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in _chunks(gzip_data):
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
 
 
 @login_required
 @require_http_methods(["GET"])
+@_retry_if_busy
 def get_arg_graph(request):
-    client = rpyc.connect("::1", SERVER_PORT_NUMBER, config = {"allow_public_attrs": True, "sync_request_timeout": None}, ipv6=True)
-    my_graph: Final[str] = client.root.get_user_services(
-        bytes(request.user.username, 'utf-8')
-        ).get_arg_graph(0)
-    client.close()
-    return HttpResponse(my_graph)
+    #The graph is compressed (once per revision) by the server, which
+    #makes it much smaller to transfer, and is streamed on to the
+    #browser still compressed, if the browser accepts that.
+    with rpyc_connection_pool.connection() as client:
+        my_graph_gzip: Final[bytes] = client.root.get_user_services(
+            bytes(request.user.username, 'utf-8')
+            ).get_arg_graph_gzip(0)
+    if 'gzip' not in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        return StreamingHttpResponse(_decompressed_chunks(my_graph_gzip))
+    response: Final = StreamingHttpResponse(_chunks(my_graph_gzip))
+    response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept-Encoding'
+    return response
 
 
 def _atoi(a):
@@ -232,16 +312,26 @@ def _atoi(a):
 
 @login_required
 @require_http_methods(["GET"])
+@_retry_if_busy
 def get_next_arg_graph(request):
-    client = rpyc.connect("::1", SERVER_PORT_NUMBER, config = {"allow_public_attrs": True, "sync_request_timeout": None}, ipv6=True)
     last_arg_graph_revision_number = (
         _atoi(request.GET['last_arg_graph_revision_number'])
         if 'last_arg_graph_revision_number' in request.GET
         else 0)
-    retval: Final[Union[Tuple[str, int], int]] = client.root.get_user_services(
-        bytes(request.user.username, 'utf-8')
-        ).get_next_arg_graph(0, last_arg_graph_revision_number)
-    client.close()
+    #The server passes the result to results.append when the next graph is
+    #available (or after Config.long_polling_timeout_seconds) instead of
+    #keeping one of its threads waiting until then.
+    results: Final[List[Union[Tuple[str, int], int]]] = []
+    with rpyc_long_polling_pool.connection() as client:
+        client.root.get_user_services(
+            bytes(request.user.username, 'utf-8')
+            ).subscribe_next_arg_graph(0, last_arg_graph_revision_number,
+                                       results.append)
+        deadline: Final[float] = time.monotonic() \
+                                 + 2 * Config.long_polling_timeout_seconds
+        while not results and time.monotonic() < deadline:
+            client.serve(deadline - time.monotonic())
+    retval: Final[Union[Tuple[str, int], int]] = results[0] if results else 2
     if type(retval) is tuple:
         my_graph, current_arg_graph_revision_number = retval
         return JsonResponse({'success': True, 'error': 0, 'graph': my_graph, 'graph_rev_number': current_arg_graph_revision_number})
@@ -251,13 +341,57 @@ def get_next_arg_graph(request):
 
 @login_required
 @require_http_methods(["GET"])
+@_retry_if_busy
+def get_next_arg_graph_changes(request):
+    """ Like get_next_arg_graph, but the graph is only included if it
+        has to be drawn again; otherwise, the client updates the prices
+        and probabilities ('values') shown in the graph that it has.
+    """
+    last_arg_graph_revision_number = (
+        _atoi(request.GET['last_arg_graph_revision_number'])
+        if 'last_arg_graph_revision_number' in request.GET
+        else 0)
+    results: Final[List[Union[tuple, int]]] = []
+    with rpyc_long_polling_pool.connection() as client:
+        client.root.get_user_services(
+            bytes(request.user.username, 'utf-8')
+            ).subscribe_next_arg_graph_changes(0,
+                                               last_arg_graph_revision_number,
+                                               results.append)
+        deadline: Final[float] = time.monotonic() \
+                                 + 2 * Config.long_polling_timeout_seconds
+        while not results and time.monotonic() < deadline:
+            client.serve(deadline - time.monotonic())
+    retval: Final[Union[tuple, int]] = results[0] if results else 2
+    if type(retval) is not tuple:
+        return JsonResponse({'success': False, 'error': retval})
+    my_graph, current_arg_graph_revision_number, positions, arguments, \
+        values = retval
+    response: Final[Dict[str, Any]] = {
+        'success': True,
+        'error': 0,
+        'graph_rev_number': current_arg_graph_revision_number,
+        'positions': {pos_id: statement for pos_id, statement in positions},
+        'arguments': [[arg_id, supports_conclusion, conclusion_id,
+                       list(premise_ids)]
+                      for arg_id, supports_conclusion, conclusion_id,
+                      premise_ids in arguments],
+        'values': {pos_id: [price, probability]
+                   for pos_id, price, probability in values}}
+    if my_graph is not None:
+        response['graph'] = my_graph
+    return JsonResponse(response)
+
+
+@login_required
+@require_http_methods(["GET"])
+@_retry_if_busy
 def get_position_details(request):
-    client = rpyc.connect("::1", SERVER_PORT_NUMBER, config = {"allow_public_attrs": True, "sync_request_timeout": None}, ipv6=True)
-    my_pos: Final[Optional[str]] = client.root.get_user_services(bytes(request.user.username, 'utf-8'))\
-        .get_position_details(0, int(request.GET['id'])) \
-        if 'id' in request.GET \
-        else None
-    client.close()
+    with rpyc_connection_pool.connection() as client:
+        my_pos: Final[Optional[str]] = client.root.get_user_services(bytes(request.user.username, 'utf-8'))\
+            .get_position_details(0, int(request.GET['id'])) \
+            if 'id' in request.GET \
+            else None
     if my_pos is not None:
         return JsonResponse({'success': True, 'error': 0, 'result': my_pos})
     else:
@@ -266,15 +400,15 @@ def get_position_details(request):
 
 @login_required
 @require_http_methods(["GET"])
+@_retry_if_busy
 def clear_graph(request):
-    client = rpyc.connect("::1", SERVER_PORT_NUMBER, config = {"allow_public_attrs": True, "sync_request_timeout": None}, ipv6=True)
     #Trying lambda method of invoking services without the
     # posibility of exceptions. This might not eliminate the risk
     # of exceptions.  (See comment under get_position_details, above.)
     #Delete issue if authenticated; otherwise,
     # client.root.get_user_services_noexcept
     # returns None and the lambda returns False.
-    client.root.get_user_services(bytes(request.user.username, 'utf-8'))\
-        .delete_issue(0)
-    client.close()
-    return JsonResponse({'success': True, 'error': 0})
+    with rpyc_connection_pool.connection() as client:
+        ret = client.root.get_user_services(
+            bytes(request.user.username, 'utf-8')).delete_issue(0)
+    return _queued_request_response(ret)
@@ -60,7 +60,7 @@ from typing_extensions import Final
 
 from allsembly.allsembly import ServerControl, AllsemblyServer
 from allsembly.common import FinalVar
-from allsembly.config import Config
+from allsembly.config import Config, set_config
 
 logger: Logger = logging.getLogger(__name__)
 
@@ -128,8 +128,115 @@ parser.add_argument("--argdb_filename",
 						 "argument graphs, bids, and bets."
 						 "defaults to: /var/allsembly-prototype/data/argdb",
                     default="/var/allsembly-prototype/data/argdb")
+parser.add_argument("--inference_workers",
+                    help="number of worker processes for calculating "
+						 "probabilities; zero to calculate them in the "
+						 "main server loop; defaults to "
+						 + str(Config.inference_worker_processes),
+                    type=int,
+                    default=Config.inference_worker_processes)
+parser.add_argument("--graph_update_debounce_msec",
+                    help="milliseconds to wait after an issue is updated "
+						 "before recalculating probabilities and redrawing "
+						 "its graph, to handle bursts of updates at once; "
+						 "defaults to "
+						 + str(Config.graph_update_debounce_msec),
+                    type=int,
+                    default=Config.graph_update_debounce_msec)
+parser.add_argument("--group_commit_max_items",
+                    help="number of queued requests to commit to the "
+						 "database together; 1 to commit each one "
+						 "separately; defaults to "
+						 + str(Config.group_commit_max_items),
+                    type=int,
+                    default=Config.group_commit_max_items)
+parser.add_argument("--group_commit_max_msec",
+                    help="commit a group of requests at most this many "
+						 "milliseconds after the first of them was "
+						 "processed; zero for no limit; defaults to "
+						 + str(Config.group_commit_max_msec),
+                    type=int,
+                    default=Config.group_commit_max_msec)
+parser.add_argument("--issue_shards",
+                    help="number of worker processes that the issues are "
+						 "divided among, sharing the database through a "
+						 "ZEO server; zero to process all issues in the "
+						 "main server process; defaults to "
+						 + str(Config.issue_shard_processes),
+                    type=int,
+                    default=Config.issue_shard_processes)
+parser.add_argument("--argdb_storage",
+                    help="\"file\" to open the argument database file "
+						 "directly; \"zeo\" to serve it through a ZEO server, "
+						 "so that other processes can open it, too; "
+						 "defaults to \"" + Config.argument_db_storage + "\"",
+                    choices=["file", "zeo"],
+                    default=Config.argument_db_storage)
+parser.add_argument("--argdb_zeo_address",
+                    help="with --argdb_storage=zeo, the address "
+						 "(host:port or socket path) of an already running "
+						 "ZEO server serving the argument database; by default, "
+						 "a ZEO server is started for the argument database file",
+                    default=Config.argument_db_zeo_address)
+parser.add_argument("--zeo_cache_size_mb",
+                    help="size of the cache of database records of each "
+						 "process using the argument database through ZEO; "
+						 "defaults to " + str(Config.zeo_client_cache_size_mb),
+                    type=int,
+                    default=Config.zeo_client_cache_size_mb)
+parser.add_argument("--argdb_pool_size",
+                    help="number of connections to the argument database "
+						 "kept open for reuse, along with their object caches; "
+						 "defaults to " + str(Config.argument_db_pool_size),
+                    type=int,
+                    default=Config.argument_db_pool_size)
+parser.add_argument("--argdb_cache_size",
+                    help="number of objects kept in the object cache of "
+						 "each connection to the argument database; "
+						 "defaults to " + str(Config.argument_db_cache_size),
+                    type=int,
+                    default=Config.argument_db_cache_size)
+parser.add_argument("--argdb_cache_size_mb",
+                    help="size in megabytes of the object cache of each "
+						 "connection to the argument database; zero for no "
+						 "limit; defaults to " + str(Config.argument_db_cache_size_mb),
+                    type=int,
+                    default=Config.argument_db_cache_size_mb)
+parser.add_argument("--graph_cache_issues",
+                    help="number of issues whose drawn graph is kept in "
+						 "memory to be served without reading the database; "
+						 "defaults to " + str(Config.graph_snapshot_cache_max_issues),
+                    type=int,
+                    default=Config.graph_snapshot_cache_max_issues)
+parser.add_argument("--market_maker_liquidity",
+                    help="liquidity, in contracts, of the automated market "
+						 "maker of each new betting market; zero for no "
+						 "market maker; defaults to " + str(Config.market_maker_liquidity),
+                    type=float,
+                    default=Config.market_maker_liquidity)
+parser.add_argument("--call_auction_interval_msec",
+                    help="milliseconds to collect the bids placed in an "
+						 "issue's markets before clearing them together in a "
+						 "call auction; zero to match each bid as it is placed; "
+						 "defaults to " + str(Config.call_auction_interval_msec),
+                    type=int,
+                    default=Config.call_auction_interval_msec)
 
 args: Final = parser.parse_args()
+set_config(inference_worker_processes=args.inference_workers,
+           graph_update_debounce_msec=args.graph_update_debounce_msec,
+           group_commit_max_items=args.group_commit_max_items,
+           group_commit_max_msec=args.group_commit_max_msec,
+           issue_shard_processes=args.issue_shards,
+           argument_db_storage=args.argdb_storage,
+           argument_db_zeo_address=args.argdb_zeo_address,
+           zeo_client_cache_size_mb=args.zeo_cache_size_mb,
+           argument_db_pool_size=args.argdb_pool_size,
+           argument_db_cache_size=args.argdb_cache_size,
+           argument_db_cache_size_mb=args.argdb_cache_size_mb,
+           graph_snapshot_cache_max_issues=args.graph_cache_issues,
+           market_maker_liquidity=args.market_maker_liquidity,
+           call_auction_interval_msec=args.call_auction_interval_msec)
 
 USERDB_FILENAME: Final = args.userdb_filename
 ARGDB_FILENAME: Final = args.argdb_filename
@@ -18,19 +18,23 @@
 #
 
 import pickle
+import time
 
 import transaction
+import ZEO
 import ZODB, ZODB.FileStorage
 import os
 import tempfile
-from collections import deque
 
-from allsembly.allsembly import OrderQueue, GraphUpdateArgQueue, GraphUpdatePosQueue, process_one_position_from_queue
+from allsembly.allsembly import process_command, AllsemblyServer, \
+    open_zeo_db, parse_zeo_address
 from allsembly.betting_exchange import BettingExchange
 from allsembly.argument_graph import Issues, IssuesDBAccessor
-from allsembly.rpyc_server import IssueQueue, GraphRequest, LedgerRequest, \
-    AllsemblyServices
-from allsembly.speech_act import ProposeSpeechAct, InitialPosition, Bid, Premise
+from allsembly.rpyc_server import IssuesRequest, GraphRequest, LedgerRequest, \
+    AllsemblyServices, CommandQueue, AddPosition, AddArgument, PlaceOrder
+from allsembly.config import Config
+from allsembly.speech_act import ProposeSpeechAct, InitialPosition, Bid, Premise, Argument, ProOrCon, \
+    UnconcededPosition, IndependentBid, MarketLocator, Ask
 
 
 def test_allsembly():
@@ -39,9 +43,7 @@ def test_allsembly():
         argumentdb_storage = ZODB.FileStorage.FileStorage(os.path.join(tmpdirname, "allsembly_test_argdb"))
         argumentdb = ZODB.DB(argumentdb_storage)
         argdb_conn = argumentdb.open()
-        order_queue: OrderQueue = deque()
-        graph_arg_queue: GraphUpdateArgQueue = deque()
-        graph_pos_queue: GraphUpdatePosQueue = deque()
+        command_queue = CommandQueue()
 
         #test setting up the databases with
         #the pre-defined structures
@@ -57,24 +59,18 @@ def test_allsembly():
             assert hasattr(dbroot, "betxch")
         issues = dbroot.issues
         betting_exchange = dbroot.betxch
-        issue_queue = IssueQueue(issues)
+        issues_request = IssuesRequest(issues)
 
-        server = AllsemblyServices(order_queue, graph_arg_queue, graph_pos_queue, issue_queue,
-                                   GraphRequest(IssuesDBAccessor(argumentdb, read_only=True)), LedgerRequest())
+        server = AllsemblyServices(command_queue, issues_request,
+                                   GraphRequest(IssuesDBAccessor(argumentdb, read_only=True), issues), LedgerRequest(IssuesDBAccessor(argumentdb, read_only=True)))
         userid = "testuser"
 
-        assert not issue_queue.queue #nothing on the queue
-        #assert server.exposed_add_issue(username, password, "my_issue") == 0
-        #assert issue_queue.queue
-        #assert not allsembly.process_one_issue_from_queue(issues, issue_queue)
-        #assert not issue_queue.queue
-
         #add an initial prosition to the graph from the services API
-        #the result should be an item on the graph_pos_queue
+        #the result should be a command on the command_queue
         #which will be processed later
         #(in the actual allsembly program it will be processed
         # in another thread).
-        assert not graph_pos_queue #nothing on the queue
+        assert not command_queue #nothing on the queue
         my_user_services = server.exposed_get_user_services(bytes(userid, 'utf-8'))
         assert my_user_services is not None
         assert my_user_services.propose(0, "",
@@ -82,17 +78,16 @@ def test_allsembly():
                                                          InitialPosition("my proposal")
                                         )
                                     )
-                                )
+                                )[0]
                        
-        assert graph_pos_queue #something on the queue, now
-        current_update = graph_pos_queue[0]
+        assert command_queue #something on the queue, now
+        current_update = command_queue.popleft()
         print(current_update)
-        updating_user_userid = current_update[0]
-        update_issue = current_update[2]
-        new_pos = current_update[3]
+        assert isinstance(current_update, AddPosition)
+        update_issue = current_update.issue_id
         #mimic what the allsembly program does, but for just one iteration
-        assert not process_one_position_from_queue(issues, graph_pos_queue)
-        assert not graph_pos_queue
+        process_command(issues, current_update)
+        assert not command_queue
         assert issues.graphs.has_key(update_issue)
         print(issues.graphs[update_issue].pos_node_index.values())
         print(issues.graphs[update_issue].get_position_copy(0))
@@ -108,3 +103,222 @@ def test_allsembly():
         print(my_user_services.get_arg_graph(0))
         print(os.listdir(tmpdirname))
 
+
+
+def _argue_speech_act_for(target_pos_id: int, statement: str) -> Argument:
+    return Argument(ProOrCon.PRO, Premise(statement, Bid(70, 50, 1)),
+                    UnconcededPosition(target_pos_id), None, None, [])
+
+
+def test_burst_of_updates_is_coalesced():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        server = AllsemblyServer(os.path.join(tmpdirname, "allsembly_test_userdb"),
+                                 os.path.join(tmpdirname, "allsembly_test_argdb"))
+        try:
+            issue_id = (b"testuser", 0)
+            server.command_queue.append(AddPosition(b"testuser", "", issue_id,
+                                                   InitialPosition("my proposal")))
+            for i in range(5):
+                server.command_queue.append(AddArgument(b"testuser", "", issue_id,
+                                                       _argue_speech_act_for(0, "premise " + str(i))))
+            server.process_all_commands_from_queue(None, None)
+            graph = server.issues.graphs[issue_id]
+            # nothing calculated or drawn, yet
+            assert graph.get_revision_number() == 0
+            assert issue_id in server.dirty_issues
+            assert server.process_dirty_issues() is None
+            assert graph.get_revision_number() == 1
+            assert not server.dirty_issues
+            assert "premise 4" in graph.get_drawn_graph()
+            assert 0 in graph.problog_model.get_problog_query_results()
+
+            # with a debounce window, the update waits
+            Config.graph_update_debounce_msec = 60000
+            server.command_queue.append(PlaceOrder(b"testuser", "", IndependentBid(
+                90, 50, MarketLocator(0, 1), ProOrCon.PRO)))
+            server.process_all_commands_from_queue(None, None)
+            next_due_seconds = server.process_dirty_issues()
+            assert next_due_seconds is not None and next_due_seconds > 0.0
+            assert graph.get_revision_number() == 1
+            assert server.process_dirty_issues(force=True) is None
+            assert graph.get_revision_number() == 2
+        finally:
+            Config.graph_update_debounce_msec = 0
+            server.cleanup()
+
+
+def test_call_auctions():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        server = AllsemblyServer(os.path.join(tmpdirname, "allsembly_test_userdb"),
+                                 os.path.join(tmpdirname, "allsembly_test_argdb"))
+        try:
+            issue_id = (b"testuser", 0)
+            server.command_queue.append(AddPosition(b"testuser", "", issue_id,
+                                                   InitialPosition("my proposal")))
+            server.process_all_commands_from_queue(None, None)
+            server.process_dirty_issues()
+            assert server.process_call_auctions() is None
+            Config.call_auction_interval_msec = 60000
+            # (the bids at 0 and 100 are refused)
+            for max_price in (0, 60, 80, 100):
+                server.command_queue.append(PlaceOrder(b"testuser", "", IndependentBid(
+                    max_price, 50, MarketLocator(0, 0), ProOrCon.PRO)))
+            server.process_all_commands_from_queue(None, None)
+            market = server.issues.graphs[issue_id].betting_exchange.markets[0]
+            # the bids wait for the auction
+            assert len(market.orders) == 2
+            assert market.last_support_price == 50.0
+            assert not server.dirty_issues
+            next_due_seconds = server.process_call_auctions()
+            assert next_due_seconds is not None and next_due_seconds > 0.0
+            transactions_before = len(list(server.argumentdb_storage.iterator()))
+            assert server.process_call_auctions(force=True) is None
+            assert len(list(server.argumentdb_storage.iterator())) == \
+                transactions_before + 1
+            assert market.last_support_price == 80.0
+            assert issue_id in server.dirty_issues
+        finally:
+            Config.call_auction_interval_msec = 0
+            server.cleanup()
+
+
+def test_asks_resell_contracts_held():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        server = AllsemblyServer(os.path.join(tmpdirname, "allsembly_test_userdb"),
+                                 os.path.join(tmpdirname, "allsembly_test_argdb"))
+        try:
+            Config.market_maker_liquidity = 10.0
+            issue_id = (b"testuser", 0)
+            server.command_queue.append(AddPosition(b"testuser", "", issue_id,
+                                                   InitialPosition("my proposal")))
+            # bought from the market maker
+            server.command_queue.append(PlaceOrder(b"testuser", "", IndependentBid(
+                60, 50, MarketLocator(0, 0), ProOrCon.PRO, 3)))
+            server.process_all_commands_from_queue(None, None)
+            services = AllsemblyServices(
+                server.command_queue,
+                IssuesRequest(server.issues),
+                GraphRequest(IssuesDBAccessor(server.argumentdb, read_only=True),
+                             server.issues),
+                LedgerRequest(IssuesDBAccessor(server.argumentdb, read_only=True)))
+            user_services = services.exposed_get_user_services(b"testuser")
+
+            def held():
+                return sum(amount for _, _, is_pro, _, amount
+                           in user_services.get_commitments(0) if is_pro)
+            assert held() == 3
+            market = server.issues.graphs[issue_id].betting_exchange.markets[0]
+            support_price = market.last_support_price
+            # more than the user holds, so refused
+            assert user_services.place_ask(0, "", pickle.dumps(Ask(
+                1.0, MarketLocator(0, 0), ProOrCon.PRO, 5))) == (True, 0.0)
+            server.process_all_commands_from_queue(None, None)
+            assert held() == 3
+            assert market.last_support_price == support_price
+            assert len(market.orders) == 0
+            # sold back to the market maker
+            assert user_services.place_ask(0, "", pickle.dumps(Ask(
+                1.0, MarketLocator(0, 0), ProOrCon.PRO, 2))) == (True, 0.0)
+            server.process_all_commands_from_queue(None, None)
+            assert held() == 1
+            assert market.last_support_price < support_price
+        finally:
+            Config.market_maker_liquidity = 0.0
+            server.cleanup()
+
+
+def test_group_commit():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        server = AllsemblyServer(os.path.join(tmpdirname, "allsembly_test_userdb"),
+                                 os.path.join(tmpdirname, "allsembly_test_argdb"))
+        try:
+            Config.group_commit_max_items = 3
+            transactions_before = len(list(server.argumentdb_storage.iterator()))
+            issue_id = (b"testuser", 0)
+            server.command_queue.append(AddPosition(b"testuser", "", issue_id,
+                                                   InitialPosition("my proposal")))
+            for i in range(5):
+                server.command_queue.append(AddArgument(b"testuser", "", issue_id,
+                                                       _argue_speech_act_for(0, "premise " + str(i))))
+            server.process_all_commands_from_queue(None, None)
+            # six items: two groups of three
+            assert len(list(server.argumentdb_storage.iterator())) == \
+                transactions_before + 2
+            # each premise's bid was committed along with its argument
+            transaction.abort()
+            markets = server.issues.graphs[issue_id].betting_exchange.markets
+            assert sorted(markets.keys()) == [1, 2, 3, 4, 5]
+            assert markets[5].last_support_price == 70
+        finally:
+            Config.group_commit_max_items = 1
+            server.cleanup()
+
+
+def test_issue_shards():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        Config.issue_shard_processes = 2
+        server = AllsemblyServer(os.path.join(tmpdirname, "allsembly_test_userdb"),
+                                 os.path.join(tmpdirname, "allsembly_test_argdb"))
+        try:
+            server.start_worker_processes()
+            issue_ids = [(b"testuser" + bytes(str(i), 'utf-8'), 0) for i in range(4)]
+            for issue_id in issue_ids:
+                server.command_queue.append(AddPosition(issue_id[0], "", issue_id,
+                                                        InitialPosition("my proposal")))
+                server.command_queue.append(AddArgument(issue_id[0], "", issue_id,
+                                                        _argue_speech_act_for(0, "premise")))
+            server.process_all_commands_from_queue(None, None)
+            updated_issues = set()
+            deadline = time.monotonic() + 60
+            while len(updated_issues) < len(issue_ids) and time.monotonic() < deadline:
+                updated_issues |= server.process_issue_shard_updates()
+                time.sleep(0.05)
+            assert updated_issues == set(issue_ids)
+            for issue_id in issue_ids:
+                graph = server.issues.graphs[issue_id]
+                assert graph.get_revision_number() == 1
+                assert "premise" in graph.get_drawn_graph()
+                assert graph.betting_exchange.markets[1].last_support_price == 70
+        finally:
+            Config.issue_shard_processes = 0
+            server.cleanup()
+
+
+def test_parse_zeo_address():
+    assert parse_zeo_address("localhost:8100") == ("localhost", 8100)
+    assert parse_zeo_address("[::1]:8100") == ("::1", 8100)
+    assert parse_zeo_address("/tmp/zeo.sock") == "/tmp/zeo.sock"
+
+
+def test_zeo_storage_is_shared_with_readers():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        zeo_address, stop_zeo_server = ZEO.server(
+            path=os.path.join(tmpdirname, "allsembly_test_argdb"),
+            threaded=False)
+        Config.argument_db_storage = "zeo"
+        Config.argument_db_zeo_address = "{}:{}".format(*zeo_address)
+        try:
+            server = AllsemblyServer(os.path.join(tmpdirname, "allsembly_test_userdb"),
+                                     os.path.join(tmpdirname, "unused_argdb"))
+            try:
+                assert server.zeo_address == zeo_address
+                issue_id = (b"testuser", 0)
+                server.command_queue.append(AddPosition(issue_id[0], "", issue_id,
+                                                        InitialPosition("my proposal")))
+                server.process_all_commands_from_queue(None, None)
+                server.process_dirty_issues()
+                reader_db = open_zeo_db(server.zeo_address, read_only=True)
+                try:
+                    reader_conn = reader_db.open()
+                    issues = reader_conn.root().issues
+                    assert "my proposal" in issues.graphs[issue_id].get_drawn_graph()
+                    reader_conn.close()
+                finally:
+                    reader_db.close()
+            finally:
+                server.cleanup()
+        finally:
+            Config.argument_db_storage = "file"
+            Config.argument_db_zeo_address = None
+            stop_zeo_server()
+        assert not os.path.exists(os.path.join(tmpdirname, "unused_argdb"))
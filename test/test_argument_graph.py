@@ -0,0 +1,252 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+import pygraphviz as pgv #type: ignore[import]
+import pytest
+import transaction
+import ZODB
+
+from allsembly.argument_graph import ArgumentGraph, Issues, \
+    IssuesDBAccessor, PRICE_PLACEHOLDER, build_ArgumentNode, \
+    build_PositionNode
+from allsembly.betting_exchange import BettingMarket
+from allsembly.config import Config
+
+
+def _add_argument(graph: ArgumentGraph, conclusion_id: int,
+                  supports: bool, statements: list) -> int:
+    new_arg_node = build_ArgumentNode(b"testuser", supports, conclusion_id)
+    for statement in statements:
+        new_arg_node.premises_ids.append(
+            graph.add_position(build_PositionNode(b"testuser", statement)))
+    return graph.add_argument(new_arg_node)
+
+
+def _build_test_graph() -> ArgumentGraph:
+    graph = ArgumentGraph("")
+    graph.add_position(build_PositionNode(b"testuser", "Socrates is mortal"))
+    _add_argument(graph, 0, True, ["Socrates is a man", "All men are mortal"])
+    _add_argument(graph, 0, False, ["Socrates is a god"])
+    _add_argument(graph, 1, True, ["Socrates has a heel"])
+    return graph
+
+
+@pytest.fixture
+def layout_calls(monkeypatch):
+    """ The arguments of each call to lay out a graph with Graphviz """
+    calls = []
+    original_layout = pgv.AGraph.layout
+    def counting_layout(self, *args, **kwargs):
+        calls.append(args)
+        return original_layout(self, *args, **kwargs)
+    monkeypatch.setattr(pgv.AGraph, "layout", counting_layout)
+    return calls
+
+
+def test_incremental_problog_program_matches_full_rebuild():
+    graph = _build_test_graph()
+    incremental_program = graph.get_problog_program_string()
+    assert "n0(t) :- n1(t),n2(t).\n" in incremental_program
+    assert "n0(f) :- n3(t).\n" in incremental_program
+    # node 0 and node 1 are conclusions, so they have no prior
+    assert "::n0(t).\n" not in incremental_program
+    assert "::n1(t).\n" not in incremental_program
+    assert "0.5::n2(t).\n" in incremental_program
+    graph._build_problog_program()
+    assert graph.problog_program_builder.get_program_string() == \
+        incremental_program
+
+
+def test_price_change_updates_only_dependent_fragments():
+    graph = _build_test_graph()
+    graph.betting_exchange.markets[0] = BettingMarket()
+    graph.betting_exchange.markets[0].last_support_price = 80.0
+    graph.refresh_position_price(0)
+    graph.betting_exchange.markets[2] = BettingMarket()
+    graph.betting_exchange.markets[2].last_support_price = 30.0
+    graph.refresh_position_price(2)
+    program = graph.problog_program_builder.get_program_string()
+    assert program.count("0.8::n0(t);") == 2
+    assert "0.3::n2(t).\n" in program
+    graph._build_problog_program()
+    assert graph.problog_program_builder.get_program_string() == program
+
+
+def test_price_change_reweights_without_recompiling():
+    graph = _build_test_graph()
+    compiled_model = graph.problog_model._v_compiled_model
+    assert compiled_model is not None
+    revision_number = graph.get_revision_number()
+    graph.betting_exchange.markets[2] = BettingMarket()
+    graph.betting_exchange.markets[2].last_support_price = 90.0
+    graph.refresh_position_price(2)
+    graph.update_graph()
+    assert graph.problog_model._v_compiled_model is compiled_model
+    assert graph.get_revision_number() == revision_number + 1
+    reweighted_results = dict(graph.problog_model.get_problog_query_results())
+    graph._v_problog_program_is_stale = True
+    graph._problog_calculate()
+    assert graph.problog_model._v_compiled_model is not compiled_model
+    assert dict(graph.problog_model.get_problog_query_results()) == \
+        pytest.approx(reweighted_results)
+
+
+def test_inference_request_when_calculated_elsewhere():
+    Config.inference_worker_processes = 1
+    try:
+        graph = _build_test_graph()
+    finally:
+        Config.inference_worker_processes = 0
+    assert not graph.problog_model.is_compiled()
+    request = graph.take_problog_inference_request()
+    assert request is not None
+    structure_changed, program, weight_updates = request
+    assert structure_changed
+    assert program == graph.get_problog_program_string()
+    assert graph.take_problog_inference_request() is None
+    graph.refresh_position_price(2)
+    assert graph.take_problog_inference_request() == \
+        (False, program, {"n2": 0.5})
+    revision_number = graph.get_revision_number()
+    graph.set_problog_query_results({0: 0.25, 99: 1.0})
+    assert graph.problog_model.get_problog_query_results()[0] == 0.25
+    assert 99 not in graph.problog_model.get_problog_query_results()
+    assert graph.get_revision_number() == revision_number + 1
+
+
+def test_one_layout_per_add_argument(layout_calls):
+    graph = _build_test_graph()
+    layout_calls.clear()
+    new_arg_node = build_ArgumentNode(b"testuser", True, 3)
+    for statement in ["Gods are immortal", "Socrates drank hemlock"]:
+        new_arg_node.premises_ids.append(
+            graph.add_position(build_PositionNode(b"testuser", statement),
+                               update_graph=False))
+    assert len(layout_calls) == 0
+    graph.add_argument(new_arg_node)
+    assert len(layout_calls) == 1
+    assert "Socrates drank hemlock" in graph.get_drawn_graph()
+    # nothing has changed, so there is nothing to lay out
+    graph.update_graph()
+    assert len(layout_calls) == 1
+    graph.betting_exchange.markets[2] = BettingMarket()
+    graph.betting_exchange.markets[2].last_support_price = 70.0
+    graph.refresh_position_price(2)
+    graph.update_graph()
+    # only the values have changed, so they are filled in without
+    # laying out the graph again
+    assert len(layout_calls) == 1
+    assert "<![CDATA[70.0¢]]>" in graph.get_drawn_graph()
+    assert PRICE_PLACEHOLDER not in graph.get_drawn_graph()
+
+
+def test_loading_a_graph_does_not_lay_it_out(layout_calls):
+    db = ZODB.DB(None)
+    conn = db.open()
+    conn.root().issues = Issues()
+    conn.root().issues.graphs[0] = _build_test_graph()
+    transaction.commit()
+    drawn_graph = conn.root().issues.graphs[0].get_drawn_graph()
+    assert "Socrates has a heel" in drawn_graph
+    layout_calls.clear()
+    with IssuesDBAccessor(db, read_only=True).get_context() as issues:
+        graph = issues.graphs[0]
+        assert graph.get_drawn_graph() == drawn_graph
+        assert graph.get_position_copy(3).statement == "Socrates is a god"
+    assert len(layout_calls) == 0
+    # after the graph is unloaded, it is built when it is next drawn
+    conn.cacheMinimize()
+    graph = conn.root().issues.graphs[0]
+    _add_argument(graph, 4, False, ["Socrates is a philosopher"])
+    transaction.commit()
+    assert len(layout_calls) == 2
+    assert "Socrates has a heel" in graph.get_drawn_graph()
+    assert "Socrates is a philosopher" in graph.get_drawn_graph()
+    conn.close()
+    db.close()
+
+
+def test_changes_since_a_revision():
+    graph = _build_test_graph()
+    revision_number = graph.get_drawn_graph_revision_number()
+    assert graph.get_changes_since(revision_number) == \
+        (revision_number, (), (), ())
+    _add_argument(graph, 2, False, ["All men are gods"])
+    changes = graph.get_changes_since(revision_number)
+    assert changes.revision_number == revision_number + 2
+    assert changes.positions == ((5, "All men are gods"),)
+    assert changes.arguments == ((3, False, 2, (5,)),)
+    assert changes.changes_layout()
+    assert {pos_id for pos_id, _, _ in changes.values} >= {2, 5}
+    # only the values changed
+    revision_number = changes.revision_number
+    graph.betting_exchange.markets[5] = BettingMarket()
+    graph.betting_exchange.markets[5].last_support_price = 30.0
+    graph.refresh_position_price(5)
+    # only the positions whose values may have changed are compared
+    # with the logged values
+    assert list(graph.unlogged_pos_ids) == [5]
+    graph.update_graph()
+    changes = graph.get_changes_since(revision_number)
+    assert not changes.changes_layout()
+    assert (5, 30.0) in [value[:2] for value in changes.values]
+    # from before the oldest logged revision
+    assert graph.get_changes_since(0) is not None
+    graph_change_log_max_revisions = Config.graph_change_log_max_revisions
+    Config.graph_change_log_max_revisions = 2
+    try:
+        graph.betting_exchange.markets[5].last_support_price = 40.0
+        graph.refresh_position_price(5)
+        graph.update_graph()
+    finally:
+        Config.graph_change_log_max_revisions = graph_change_log_max_revisions
+    assert graph.get_changes_since(0) is None
+    assert graph.get_changes_since(revision_number) is not None
+    assert graph.get_changes_since(graph.get_drawn_graph_revision_number()
+                                   + 1) is None
+
+
+def test_no_revision_is_published_without_changes():
+    graph = _build_test_graph()
+    graph.update_graph()
+    revision_number = graph.get_drawn_graph_revision_number()
+    graph.update_graph()
+    assert graph.get_drawn_graph_revision_number() == revision_number
+    graph.betting_exchange.markets[2] = BettingMarket()
+    graph.betting_exchange.markets[2].last_support_price = 30.0
+    graph.refresh_position_price(2)
+    graph.update_graph()
+    assert graph.get_drawn_graph_revision_number() == revision_number + 1
+
+
+def test_values_are_filled_in_only_in_their_slots():
+    graph = ArgumentGraph("")
+    graph.add_position(build_PositionNode(b"testuser", "100.0%"))
+    drawn_graph = graph.get_drawn_graph()
+    assert "<![CDATA[50.0%]]>" in drawn_graph
+    # the statement is not a slot for the probability
+    assert "<![CDATA[100.0%]]>" in drawn_graph
+    # no market, so no price
+    assert "<![CDATA[]]>" in drawn_graph
+    # a price is rounded to fit in the space laid out for it
+    graph.betting_exchange.markets[0] = BettingMarket()
+    graph.betting_exchange.markets[0].last_support_price = 62.245933120185456
+    graph.refresh_position_price(0)
+    graph.update_graph()
+    assert "<![CDATA[62.2¢]]>" in graph.get_drawn_graph()
@@ -0,0 +1,259 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+import math
+
+import pytest
+import transaction
+import ZODB
+
+from allsembly.betting_exchange import BettingExchange, BettingMarket, \
+    ContractSale, Fill, Ledger, LmsrMarketMaker, MARKET_MAKER_USERID, \
+    OrderBook
+from allsembly.speech_act import ProOrCon
+
+PRO = ProOrCon.PRO
+CON = ProOrCon.CON
+
+
+def test_bids_are_matched_in_price_time_priority():
+    order_book = OrderBook()
+    assert order_book.place_bid(b"a", CON, 30.0, 2) == []
+    assert order_book.place_bid(b"b", CON, 40.0, 1) == []
+    assert order_book.place_bid(b"c", CON, 40.0, 1) == []
+    # too low to match any of them
+    assert order_book.place_bid(b"d", PRO, 55.0, 1) == []
+    # the best (highest oppose, i.e., lowest support) prices first,
+    # the earliest first among equal prices; partially filling a's
+    assert order_book.place_bid(b"e", PRO, 70.0, 3) == [
+        Fill(PRO, b"e", b"b", 60.0, 1, True),
+        Fill(PRO, b"e", b"c", 60.0, 1, True),
+        Fill(PRO, b"e", b"a", 70.0, 1, True)]
+    assert len(order_book) == 2
+    # the rest of a's bid
+    assert order_book.place_bid(b"f", PRO, 80.0, 5) == [
+        Fill(PRO, b"f", b"a", 70.0, 1, True)]
+    assert len(order_book) == 2
+    # matched with the waiting support bids, f's first
+    assert order_book.place_bid(b"g", CON, 50.0, 5) == [
+        Fill(PRO, b"f", b"g", 80.0, 4, True),
+        Fill(PRO, b"d", b"g", 55.0, 1, True)]
+    assert len(order_book) == 0
+
+
+def test_a_user_does_not_trade_with_self():
+    order_book = OrderBook()
+    order_book.place_bid(b"a", CON, 40.0, 1)
+    order_book.place_bid(b"b", CON, 30.0, 1)
+    # a's own crossing bid is canceled instead
+    assert order_book.place_bid(b"a", PRO, 75.0, 2) == [
+        Fill(PRO, b"a", b"b", 70.0, 1, True)]
+    assert len(order_book.oppose_bids) == 0
+    assert len(order_book.support_bids) == 1
+
+
+def test_partially_filled_orders_are_saved():
+    db = ZODB.DB(None)
+    conn = db.open()
+    conn.root.order_book = OrderBook()
+    conn.root.order_book.place_bid(b"a", CON, 40.0, 3)
+    transaction.commit()
+    conn.root.order_book.place_bid(b"b", PRO, 60.0, 1)
+    transaction.commit()
+    conn.close()
+    conn = db.open()
+    conn.cacheMinimize()
+    assert [order.amount
+            for order in conn.root.order_book.oppose_bids.values()] == [2]
+    conn.close()
+    db.close()
+
+
+def test_contracts_are_resold_with_asks():
+    order_book = OrderBook()
+    order_book.place_bid(b"a", PRO, 60.0, 1)
+    order_book.place_bid(b"b", CON, 30.0, 1)
+    # sold to the best bid for its side, not to the other side
+    assert order_book.place_ask(b"c", PRO, 50.0, 2) == [
+        Fill(PRO, b"a", b"c", 60.0, 1, False)]
+    assert order_book.place_ask(b"d", CON, 35.0, 1) == []
+    # bought from the cheaper of the ask and a new contract
+    assert order_book.place_bid(b"e", PRO, 70.0, 1) == [
+        Fill(PRO, b"e", b"c", 50.0, 1, False)]
+    assert order_book.place_bid(b"e", CON, 40.0, 1) == [
+        Fill(CON, b"e", b"d", 35.0, 1, False)]
+
+
+def test_market_price_is_the_last_trade_or_quote():
+    market = BettingMarket()
+    market.place_bid(b"a", PRO, 70.0)
+    assert market.last_support_price == 70.0
+    market.place_bid(b"b", CON, 45.0)
+    assert market.last_support_price == 70.0
+    market.place_bid(b"c", CON, 20.0)
+    assert market.last_support_price == 80.0
+
+
+def test_market_maker_fills_orders_without_a_counterpart():
+    market = BettingMarket(LmsrMarketMaker(10.0))
+    assert market.last_support_price == 50.0
+    [fill] = market.place_bid(b"a", PRO, 90.0, 5)
+    assert fill[:2] == (PRO, b"a")
+    assert fill.seller_userid == MARKET_MAKER_USERID
+    assert fill.amount == 5 and fill.new_contract
+    # the price per contract is between the prices before and after
+    price_after = 100.0 / (1.0 + math.exp(-0.5))
+    assert 50.0 < fill.price < price_after
+    assert market.last_support_price == pytest.approx(price_after)
+    # the market maker takes the support side of an oppose bid
+    [fill] = market.place_bid(b"b", CON, 60.0, 5)
+    assert fill.buyer_userid == MARKET_MAKER_USERID
+    assert fill.seller_userid == b"b"
+    assert market.last_support_price == pytest.approx(50.0)
+    assert len(market.orders) == 0
+
+
+def test_market_maker_fills_orders_only_up_to_their_price():
+    market_maker = LmsrMarketMaker(10.0)
+    market = BettingMarket(market_maker)
+    # the support price reaches 60 after about 4.05 contracts
+    [bought] = market.place_bid(b"a", PRO, 60.0, 10)
+    assert bought.amount == 4
+    assert bought.price < 60.0
+    assert market.last_support_price < 60.0
+    # the rest waits in the order book
+    assert len(market.orders.support_bids) == 1
+    assert market.place_bid(b"b", PRO, 50.0, 1) == []
+    # sold back at the price paid for them
+    [sold] = market.place_ask(b"a", PRO, 1.0, 4)
+    assert sold[:3] == (PRO, MARKET_MAKER_USERID, b"a")
+    assert sold.price == pytest.approx(bought.price)
+    assert market_maker.support_quantity == 0.0
+    assert market.last_support_price == pytest.approx(50.0)
+    # nothing at a price the market maker never reaches
+    assert market.place_bid(b"c", PRO, 0.0, 1) == []
+    assert market.place_bid(b"c", CON, 0.0, 1) == []
+    assert market_maker.support_quantity == 0.0
+
+
+def test_ledger_finds_the_current_owners():
+    ledger = Ledger()
+    ledger.record_fills(7, [Fill(PRO, b"a", b"b", 70.0, 3, True)])
+    ledger.record_fills(8, [Fill(PRO, b"b", b"c", 40.0, 1, True)])
+    # b resells 2 of its oppose contracts in market 7 to d
+    ledger.record_fills(7, [Fill(CON, b"d", b"b", 25.0, 2, False)])
+    assert ledger.get_owners(0) == (b"a", b"b")
+    assert ledger.get_contract(0).amount == 1
+    split = ledger.get_contract(2)
+    assert (split.split_from, split.amount) == (0, 2)
+    # the original parties are kept
+    assert (split.support_userid, split.oppose_userid) == (b"a", b"b")
+    assert ledger.get_owners(2) == (b"a", b"d")
+    assert split.sales == (ContractSale(CON, b"b", b"d", 25.0, 2),)
+    assert ledger.get_owners(3) is None
+    assert [(side, contract.contract_id)
+            for side, contract in ledger.get_commitments(b"b")] == \
+        [(CON, 0), (PRO, 1)]
+    assert ledger.get_holdings(b"a", 7, PRO) == 3
+    assert ledger.get_holdings(b"d", 7, CON) == 2
+    assert [contract.contract_id
+            for contract in ledger.get_market_contracts(7)] == [0, 2]
+    # d then resells all of them, and cannot sell more
+    ledger.record_fills(7, [Fill(CON, b"e", b"d", 30.0, 2, False)])
+    assert ledger.get_owners(2) == (b"a", b"e")
+    assert len(ledger.get_contract(2).sales) == 2
+    assert ledger.get_commitments(b"d") == []
+    with pytest.raises(ValueError):
+        ledger.record_fills(7, [Fill(CON, b"f", b"d", 30.0, 1, False)])
+    # nothing is recorded if any of the fills cannot be
+    with pytest.raises(ValueError):
+        ledger.record_fills(7, [Fill(PRO, b"f", b"a", 70.0, 2, False),
+                                Fill(PRO, b"g", b"a", 70.0, 2, False)])
+    assert ledger.get_holdings(b"a", 7, PRO) == 3
+    assert ledger.get_commitments(b"f") == []
+    # but a fill may resell contracts bought in an earlier one
+    ledger.record_fills(7, [Fill(PRO, b"f", b"a", 70.0, 2, False),
+                            Fill(PRO, b"g", b"f", 75.0, 1, False)])
+    assert ledger.get_holdings(b"f", 7, PRO) == 1
+    assert ledger.get_holdings(b"g", 7, PRO) == 1
+
+
+def test_asks_are_placed_only_for_contracts_held():
+    exchange = BettingExchange()
+    exchange.markets[0] = BettingMarket()
+    market = exchange.markets[0]
+    market.place_bid(b"b", CON, 40.0, 2)
+    exchange.record_fills(0, market.place_bid(b"a", PRO, 60.0, 2))
+    market.place_bid(b"c", PRO, 55.0, 1)
+    support_price = market.last_support_price
+    with pytest.raises(ValueError):
+        exchange.place_ask(0, b"a", PRO, 50.0, 3)
+    # the order book and the price are unchanged
+    assert len(market.orders) == 1
+    assert market.last_support_price == support_price
+    assert len(market.price_history.get_ticks()) == 3
+    assert exchange.place_ask(0, b"a", PRO, 58.0, 1) == []
+    # the contract offered in the waiting ask cannot be offered again
+    with pytest.raises(ValueError):
+        exchange.place_ask(0, b"a", PRO, 58.0, 2)
+    assert exchange.place_ask(0, b"a", PRO, 50.0, 1) == [
+        Fill(PRO, b"c", b"a", 55.0, 1, False)]
+    assert exchange.ledger.get_holdings(b"c", 0, PRO) == 1
+    assert market.orders.get_asked_amount(b"a", PRO) == 1
+    # a's own bid cancels the waiting ask instead of matching it
+    market.place_bid(b"a", PRO, 60.0, 1)
+    assert market.orders.get_asked_amount(b"a", PRO) == 0
+
+
+def test_call_auction_clears_at_one_price():
+    order_book = OrderBook()
+    order_book.add_bid(b"a", PRO, 80.0, 2)
+    order_book.add_bid(b"b", CON, 45.0, 1)
+    order_book.add_bid(b"c", PRO, 60.0, 1)
+    order_book.add_bid(b"d", CON, 30.0, 3)
+    order_book.add_bid(b"e", PRO, 50.0, 1)
+    # nothing is matched until the auction
+    assert len(order_book) == 5
+    # a's 2 are matched with b's 1 and 1 of d's (c's 60 and d's 30 do
+    # not cross); both at the midpoint of a's 80 and d's 100 - 30
+    assert order_book.clear_auction() == [
+        Fill(PRO, b"a", b"b", 75.0, 1, True),
+        Fill(PRO, b"a", b"d", 75.0, 1, True)]
+    assert len(order_book) == 3
+    assert order_book.clear_auction() == []
+    # the earlier of a user's crossing bids is canceled
+    order_book.add_bid(b"c", CON, 45.0, 1)
+    assert order_book.clear_auction() == []
+    assert [order.userid for order in order_book.support_bids.values()] \
+        == [b"e"]
+
+
+def test_call_auctions_reprice_only_their_markets():
+    exchange = BettingExchange()
+    exchange.markets[1] = BettingMarket()
+    exchange.markets[2] = BettingMarket()
+    exchange.add_auction_bid(1, b"a", PRO, 70.0)
+    exchange.add_auction_bid(1, b"b", CON, 40.0)
+    exchange.add_auction_bid(2, b"a", PRO, 50.0)
+    assert exchange.markets[1].last_support_price == 50.0
+    # market 2's price is quoted at 50, as it was
+    assert exchange.clear_auctions() == [1]
+    assert exchange.markets[1].last_support_price == 65.0
+    assert exchange.ledger.get_owners(0) == (b"a", b"b")
+    assert exchange.clear_auctions() == []
@@ -0,0 +1,78 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+import pickle
+
+import pytest
+
+from allsembly.price_history import PriceHistory, PriceHistoryChunk
+
+
+def test_ticks_are_appended_in_chunks():
+    price_history = PriceHistory()
+    for i in range(PriceHistory.CHUNK_TICKS * 2 + 1):
+        price_history.append(1000.0 + i, 50.0 + i % 10)
+    assert len(price_history) == PriceHistory.CHUNK_TICKS * 2 + 1
+    assert len(price_history.chunks) == 3
+    assert price_history.last_chunk is price_history.chunks[
+        (1000 + PriceHistory.CHUNK_TICKS * 2) * 1000]
+    # across the end of the first chunk
+    assert price_history.get_ticks(1000.0 + PriceHistory.CHUNK_TICKS - 2,
+                                   1000.0 + PriceHistory.CHUNK_TICKS + 1) == [
+        (1000.0 + PriceHistory.CHUNK_TICKS - 2, 50.0),
+        (1000.0 + PriceHistory.CHUNK_TICKS - 1, 51.0),
+        (1000.0 + PriceHistory.CHUNK_TICKS, 52.0)]
+    assert price_history.get_ticks(0.0, 1000.0) == []
+    assert len(price_history.get_ticks()) == len(price_history)
+
+
+def test_ticks_take_a_few_bytes_each():
+    chunk = PriceHistoryChunk()
+    for i in range(1000):
+        chunk.append(i, 50.0)
+    assert len(pickle.dumps(chunk.__getstate__(), 3)) < 1000 * 13
+
+
+def test_times_stay_in_order():
+    price_history = PriceHistory()
+    price_history.append(10.0, 60.0)
+    # the clock was set back
+    price_history.append(5.0, 70.0)
+    assert price_history.get_ticks() == [(10.0, 60.0), (10.0, 70.0)]
+    # many ticks at the same time stay in one chunk
+    for _ in range(PriceHistory.CHUNK_TICKS):
+        price_history.append(10.0, 65.0)
+    assert len(price_history.chunks) == 1
+    price_history.append(11.0, 55.0)
+    assert len(price_history.chunks) == 2
+
+
+def test_ticks_are_downsampled():
+    price_history = PriceHistory()
+    for time_seconds, price in [(0.0, 50.0), (10.0, 70.0), (20.0, 40.0),
+                                (59.0, 45.0), (60.0, 60.0), (200.0, 30.0)]:
+        price_history.append(time_seconds, price)
+    assert price_history.get_ohlc(0.0, 180.0, 60.0) == [
+        (0.0, 50.0, 70.0, 40.0, 45.0),
+        (60.0, 60.0, 60.0, 60.0, 60.0)]
+    assert price_history.get_ohlc(10.0, 300.0, 100.0) == [
+        (10.0, 70.0, 70.0, 40.0, 60.0),
+        (110.0, 30.0, 30.0, 30.0, 30.0)]
+    with pytest.raises(ValueError):
+        price_history.get_ohlc(0.0, 180.0, 0.0)
@@ -0,0 +1,107 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+from threading import Event
+
+import pytest
+
+from allsembly.prob_logic import ProblogModel, InferenceService
+
+PROGRAM_TEMPLATE = """n0(t) :- n1(t),n2(t).
+{p0}::n0(t);{q0}::n0(f).
+n0_and_not_n0 :- n0(t), n0(f).
+evidence(n0_and_not_n0, false).
+n0(f) :- n3(t).
+{p0}::n0(t);{q0}::n0(f).
+n0_and_not_n0 :- n0(t), n0(f).
+evidence(n0_and_not_n0, false).
+query(n0(t)).
+{p1}::n1(t).
+query(n1(t)).
+0.5::n2(t).
+query(n2(t)).
+0.5::n3(t).
+query(n3(t)).
+"""
+
+
+def _program(p0: float, p1: float) -> str:
+    return PROGRAM_TEMPLATE.format(p0=p0, q0=1 - p0, p1=p1)
+
+
+def test_reweighting_matches_recompiling():
+    model = ProblogModel()
+    model.set_problog_program(_program(0.5, 0.5))
+    model.calculate_marginals()
+    assert model.is_compiled()
+    compiled_model = model._v_compiled_model
+
+    model.update_term_weights({"n0": 0.8, "n1": 0.3})
+    model.calculate_marginals()
+    # not recompiled
+    assert model._v_compiled_model is compiled_model
+    reweighted_results = dict(model.get_problog_query_results())
+
+    fresh_model = ProblogModel()
+    fresh_model.set_problog_program(_program(0.8, 0.3))
+    fresh_model.calculate_marginals()
+    fresh_results = dict(fresh_model.get_problog_query_results())
+    assert reweighted_results.keys() == fresh_results.keys()
+    for pos_id, prob in fresh_results.items():
+        assert reweighted_results[pos_id] == pytest.approx(prob)
+
+
+def test_setting_program_forces_recompile():
+    model = ProblogModel()
+    model.set_problog_program(_program(0.5, 0.5))
+    model.calculate_marginals()
+    model.set_problog_program(_program(0.5, 0.5))
+    assert not model.is_compiled()
+    # ignored until compiled again
+    model.update_term_weights({"n1": 0.9})
+    model.calculate_marginals()
+    assert model.get_problog_query_results()[1] == pytest.approx(
+        _results_for(_program(0.5, 0.5))[1])
+
+
+def _results_for(program: str) -> dict:
+    model = ProblogModel()
+    model.set_problog_program(program)
+    model.calculate_marginals()
+    return dict(model.get_problog_query_results())
+
+
+def test_inference_service_matches_synchronous_calculation():
+    event_obj = Event()
+    service = InferenceService(2, event_obj)
+    issue_key = (b"testuser", 0)
+    try:
+        service.submit(issue_key, True, _program(0.5, 0.5), {})
+        # coalesced with the request above if that is still running
+        service.submit(issue_key, False, _program(0.8, 0.3),
+                       {"n0": 0.8, "n1": 0.3})
+        results = {}
+        while not service.is_idle() or not results:
+            assert event_obj.wait(60)
+            event_obj.clear()
+            results.update(service.take_results())
+        assert results[issue_key] == pytest.approx(
+            _results_for(_program(0.8, 0.3)))
+    finally:
+        service.shutdown()
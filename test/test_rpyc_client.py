@@ -0,0 +1,86 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+import threading
+import time
+
+import pytest
+import rpyc
+from rpyc.utils.server import ThreadedServer
+
+from allsembly.rpyc_client import RpycConnectionPool
+
+
+class EchoService(rpyc.Service):
+    def exposed_echo(self, value):
+        return value
+
+
+@pytest.fixture
+def server():
+    server = ThreadedServer(EchoService, hostname="::1", port=0, ipv6=True)
+    thread = threading.Thread(target=server.start, daemon=True)
+    thread.start()
+    while not server.active:
+        time.sleep(0.01)
+    yield server
+    server.close()
+    thread.join()
+
+
+def test_connections_are_reused(server):
+    pool = RpycConnectionPool(port=server.port, max_connections=2)
+    with pool.connection() as client:
+        assert client.root.echo("hello") == "hello"
+        first_connection = client
+    with pool.connection() as client:
+        assert client is first_connection
+        with pool.connection() as other_client:
+            assert other_client is not first_connection
+    pool.close()
+    assert first_connection.closed
+
+
+def test_pool_is_bounded(server):
+    pool = RpycConnectionPool(port=server.port, max_connections=1,
+                              acquire_timeout_seconds=0.1)
+    with pool.connection():
+        with pytest.raises(RpycConnectionPool.Exhausted):
+            with pool.connection():
+                pass
+    with pool.connection() as client:
+        assert client.root.echo(1) == 1
+    pool.close()
+
+
+def test_broken_connections_are_replaced(server):
+    pool = RpycConnectionPool(port=server.port, health_check_seconds=0.0)
+    with pytest.raises(ValueError):
+        with pool.connection() as client:
+            first_connection = client
+            raise ValueError()
+    assert first_connection.closed
+    with pool.connection() as client:
+        second_connection = client
+    # e.g., the server closed the connection while it was idle
+    second_connection.close()
+    with pool.connection() as client:
+        assert client is not second_connection
+        assert client.root.echo("again") == "again"
+    pool.close()
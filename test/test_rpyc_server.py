@@ -0,0 +1,312 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+import gzip
+import math
+import pickle
+import queue
+
+import pytest
+import transaction
+import ZODB
+
+from allsembly.argument_graph import ArgumentGraph, Issues, \
+    IssuesDBAccessor, build_PositionNode
+from allsembly.betting_exchange import BettingMarket, Fill
+from allsembly.config import Config
+from allsembly.price_history import PriceHistory
+from allsembly.rpyc_server import AddPosition, AllsemblyServices, \
+    CommandQueue, DeleteIssue, GraphRequest, GraphSnapshotCache, \
+    IssuesRequest, LedgerRequest
+from allsembly.speech_act import InitialPosition, ProOrCon, \
+    ProposeSpeechAct
+
+ISSUE = (b"testuser", 0)
+
+
+@pytest.fixture
+def graph_request():
+    db = ZODB.DB(None)
+    conn = db.open()
+    conn.root().issues = Issues()
+    conn.root().issues.graphs[ISSUE] = ArgumentGraph("")
+    transaction.commit()
+    graph_request = GraphRequest(IssuesDBAccessor(db, read_only=True),
+                                 conn.root().issues)
+    yield graph_request
+    graph_request.close()
+    transaction.abort()
+    conn.close()
+    db.close()
+
+
+def _update_graph(graph_request, statement):
+    graph = graph_request._issues_not_safe_to_write.graphs[ISSUE]
+    graph.add_position(build_PositionNode(b"testuser", statement))
+    transaction.commit()
+    graph_request.notify_graph_updated(ISSUE)
+    return graph.get_revision_number()
+
+
+def test_subscribers_are_notified_of_the_next_revision(graph_request):
+    results = queue.Queue()
+    graph_request.subscribe_next_graph(ISSUE, 0, b"testuser", results.put)
+    revision_number = _update_graph(graph_request, "Socrates is mortal")
+    graph_svg, notified_revision_number = results.get(timeout=5)
+    assert notified_revision_number == revision_number
+    assert "Socrates is mortal" in graph_svg
+    # already newer than the revision the subscriber has
+    graph_request.subscribe_next_graph(ISSUE, 0, b"testuser", results.put)
+    assert results.get(timeout=5)[1] == revision_number
+    assert results.empty()
+
+
+def test_subscriptions_time_out_or_are_superseded(graph_request):
+    results = queue.Queue()
+    long_polling_timeout_seconds = Config.long_polling_timeout_seconds
+    Config.long_polling_timeout_seconds = 0.2
+    try:
+        graph_request.subscribe_next_graph(ISSUE, 0, b"testuser", results.put)
+    finally:
+        Config.long_polling_timeout_seconds = long_polling_timeout_seconds
+    assert results.get(timeout=5) == \
+        GraphRequest.Error(GraphRequest.ErrCodes.TIMED_OUT)
+    graph_request.subscribe_next_graph(ISSUE, 0, b"testuser", results.put)
+    graph_request.subscribe_next_graph(ISSUE, 0, b"testuser", results.put)
+    assert results.get(timeout=5) == \
+        GraphRequest.Error(GraphRequest.ErrCodes.GRAPH_UNAVAILABLE)
+    revision_number = _update_graph(graph_request, "Socrates is a man")
+    assert results.get(timeout=5)[1] == revision_number
+
+
+def test_get_next_graph_does_not_miss_an_earlier_update(graph_request):
+    # updated after the caller received revision 0 but before it waits
+    revision_number = _update_graph(graph_request, "Socrates is mortal")
+    graph_svg, next_revision_number = graph_request.get_next_graph(ISSUE, 0)
+    assert next_revision_number == revision_number
+    assert "Socrates is mortal" in graph_svg
+
+
+def test_revision_number_changes_when_the_update_is_committed(graph_request):
+    graph = graph_request._issues_not_safe_to_write.graphs[ISSUE]
+    graph.add_position(build_PositionNode(b"testuser", "Socrates is mortal"))
+    assert graph.get_revision_number() == 0
+    transaction.abort()
+    assert graph.get_revision_number() == 0
+    revision_number = _update_graph(graph_request, "Socrates is a man")
+    assert revision_number == 1
+    assert graph_request.draw_with_revision_number(ISSUE)[1] == revision_number
+
+
+def test_command_queue_batches_commands_by_issue():
+    command_queue = CommandQueue(max_items=4)
+    other_issue = (b"otheruser", 0)
+    commands = [AddPosition(b"testuser", "", ISSUE, InitialPosition("a")),
+                AddPosition(b"otheruser", "", other_issue, InitialPosition("b")),
+                AddPosition(b"testuser", "", ISSUE, InitialPosition("c")),
+                DeleteIssue(ISSUE)]
+    for command in commands:
+        assert command_queue.append(command)
+    assert not command_queue.append(DeleteIssue(other_issue))
+    assert len(command_queue) == 4
+    # the oldest command, with the ones after it for the same issue
+    assert command_queue.pop_issue_batch(2) == (ISSUE, commands[0:4:2])
+    assert command_queue.popleft() == commands[1]
+    assert command_queue.pop_issue_batch(2) == (ISSUE, [commands[3]])
+    assert not command_queue
+    with pytest.raises(IndexError):
+        command_queue.popleft()
+
+
+def test_full_queue_tells_the_client_to_retry(graph_request):
+    command_queue = CommandQueue(max_items=1)
+    services = AllsemblyServices(
+        command_queue,
+        IssuesRequest(graph_request._issues_not_safe_to_write),
+        graph_request,
+        LedgerRequest(graph_request._issues_accessor))
+    user_services = services.exposed_get_user_services(b"testuser")
+    proposal = pickle.dumps(ProposeSpeechAct(InitialPosition("a")))
+    assert user_services.propose(0, "", proposal) == (True, 0.0)
+    assert user_services.propose(0, "", proposal) == \
+        (False, Config.command_queue_retry_after_seconds)
+    assert services.exposed_get_queue_status() == (1, 1, 1, 1)
+    assert user_services.delete_issue(0) == \
+        (False, Config.command_queue_retry_after_seconds)
+    assert services.exposed_get_queue_status() == (1, 1, 1, 2)
+    command_queue.popleft()
+    assert user_services.propose(0, "", proposal) == (True, 0.0)
+    assert services.exposed_get_queue_status() == (1, 1, 1, 2)
+
+
+def test_graph_reads_reuse_cached_objects(graph_request):
+    issues_accessor = graph_request._issues_accessor
+
+    def read_drawn_graph():
+        with issues_accessor.get_context() as issues:
+            return issues.graphs[ISSUE].get_drawn_graph()
+
+    _update_graph(graph_request, "Socrates is mortal")
+    read_drawn_graph()
+    loads = issues_accessor.get_cache_status().loads
+    assert loads > 0
+    # the connection, with its cached objects, is reused
+    read_drawn_graph()
+    status = graph_request.get_cache_status()
+    assert status.loads == loads
+    assert status.non_ghost_objects > 0
+    assert status.storage_cache_hits == 0
+    # only the updated objects are loaded again
+    _update_graph(graph_request, "Socrates is a man")
+    assert "Socrates is a man" in read_drawn_graph()
+    assert issues_accessor.get_cache_status().loads > loads
+
+
+def test_published_graphs_are_served_from_memory(graph_request):
+    revision_number = _update_graph(graph_request, "Socrates is mortal")
+    graph_svg, drawn_revision_number = \
+        graph_request.draw_with_revision_number(ISSUE)
+    assert drawn_revision_number == revision_number
+    assert "Socrates is mortal" in graph_svg
+    assert graph_request.draw(ISSUE) == graph_svg
+    assert graph_request.get_next_graph(ISSUE, 0)[1] == revision_number
+    # not read from the database
+    assert graph_request.get_cache_status().loads == 0
+    del graph_request._issues_not_safe_to_write.graphs[ISSUE]
+    transaction.commit()
+    graph_request.notify_graph_updated(ISSUE)
+    assert graph_request.draw(ISSUE) == ""
+
+
+def test_graph_snapshot_cache_evicts_the_least_recently_used():
+    snapshots = GraphSnapshotCache(max_issues=2)
+    snapshots.publish((b"a", 0), ("a", 1))
+    snapshots.publish((b"b", 0), ("b", 1))
+    assert snapshots.get((b"a", 0)) == ("a", 1)
+    snapshots.publish((b"c", 0), ("c", 1))
+    assert snapshots.get((b"b", 0)) is None
+    assert len(snapshots) == 2
+    # a snapshot read from the database before a newer one was
+    # published is not added
+    generation = snapshots.get_generation()
+    snapshots.publish((b"a", 0), ("a", 2))
+    snapshots.add_if_unchanged((b"a", 0), ("a", 1), generation)
+    assert snapshots.get((b"a", 0)) == ("a", 2)
+    snapshots.add_if_unchanged((b"b", 0), ("b", 1),
+                               snapshots.get_generation())
+    assert snapshots.get((b"b", 0)) == ("b", 1)
+
+
+def test_subscribers_can_get_just_the_changes(graph_request):
+    results = queue.Queue()
+    revision_number = _update_graph(graph_request, "Socrates is mortal")
+    graph_request.subscribe_next_graph(ISSUE, revision_number, b"testuser",
+                                       results.put, changes_only=True)
+    next_revision_number = _update_graph(graph_request, "Socrates is a man")
+    graph_svg, changes = results.get(timeout=5)
+    assert changes.revision_number == next_revision_number
+    assert changes.positions == ((1, "Socrates is a man"),)
+    assert "Socrates is a man" in graph_svg
+    # no changes since the revision the subscriber has
+    assert graph_request.get_changes(ISSUE, next_revision_number) == \
+        (None, (next_revision_number, (), (), ()))
+    # the changes since an earlier published revision
+    last_revision_number = _update_graph(graph_request, "All men are mortal")
+    graph_svg, changes = graph_request.get_changes(ISSUE, revision_number)
+    assert changes.revision_number == last_revision_number
+    assert changes.positions == ((1, "Socrates is a man"),
+                                 (2, "All men are mortal"))
+    assert "All men are mortal" in graph_svg
+    # all served from the snapshot cache, not read from the database
+    assert graph_request.get_cache_status().loads == 0
+    # too old, so the whole graph is sent
+    graph_svg, changes = graph_request.get_changes(ISSUE, -1)
+    assert "Socrates is mortal" in graph_svg
+    assert changes == (last_revision_number, (), (), ())
+
+
+def test_compressed_graphs_are_cached_per_revision(graph_request):
+    revision_number = _update_graph(graph_request, "Socrates is mortal")
+    graph_gzip, compressed_revision_number = \
+        graph_request.draw_compressed(ISSUE)
+    assert compressed_revision_number == revision_number
+    assert gzip.decompress(graph_gzip).decode("utf-8") == \
+        graph_request.draw(ISSUE)
+    assert graph_request.draw_compressed(ISSUE)[0] is graph_gzip
+    _update_graph(graph_request, "Socrates is a man")
+    assert "Socrates is a man" in gzip.decompress(
+        graph_request.draw_compressed(ISSUE)[0]).decode("utf-8")
+
+
+def test_ledger_request_gets_a_users_commitments(graph_request):
+    ledger_request = LedgerRequest(graph_request._issues_accessor)
+    assert ledger_request.get_commitments(ISSUE, b"testuser") == ()
+    graph = graph_request._issues_not_safe_to_write.graphs[ISSUE]
+    graph.betting_exchange.record_fills(
+        3, [Fill(ProOrCon.PRO, b"testuser", b"otheruser", 70.0, 2, True)])
+    transaction.commit()
+    assert ledger_request.get_commitments(ISSUE, b"testuser") == \
+        ((0, 3, True, 70.0, 2),)
+    assert ledger_request.get_commitments(ISSUE, b"otheruser") == \
+        ((0, 3, False, 30.0, 2),)
+    assert ledger_request.get_owners(ISSUE, 0) == (b"testuser", b"otheruser")
+    assert ledger_request.get_commitments((b"nobody", 0), b"testuser") == ()
+
+
+def test_ledger_request_gets_the_price_history(graph_request):
+    ledger_request = LedgerRequest(graph_request._issues_accessor)
+    assert ledger_request.get_price_history(ISSUE, 3, 0.0, 1e10, 60.0) == ()
+    graph = graph_request._issues_not_safe_to_write.graphs[ISSUE]
+    graph.betting_exchange.markets[3] = BettingMarket()
+    for price in (70.0, 80.0, 60.0):
+        graph.betting_exchange.markets[3].place_bid(b"testuser",
+                                                    ProOrCon.PRO, price)
+    transaction.commit()
+    [(bucket_start, *prices)] = ledger_request.get_price_history(
+        ISSUE, 3, 0.0, 1e10, 1e10)
+    assert bucket_start == 0.0
+    assert prices == [70.0, 80.0, 60.0, 60.0]
+    # invalid requests
+    for start_seconds, end_seconds, bucket_seconds in (
+            (0.0, 1e10, 0.0), (0.0, 1e10, -60.0), (0.0, 1e10, math.nan),
+            (1e10, 0.0, 60.0)):
+        assert ledger_request.get_price_history(
+            ISSUE, 3, start_seconds, end_seconds, bucket_seconds) == \
+            LedgerRequest.Error(LedgerRequest.ErrCodes.INVALID_REQUEST)
+    user_services = AllsemblyServices(
+        CommandQueue(),
+        IssuesRequest(graph_request._issues_not_safe_to_write),
+        graph_request,
+        ledger_request).exposed_get_user_services(b"testuser")
+    assert user_services.get_price_history(0, 3, 0.0, 1e10, 0.0) == 1
+    # the buckets are made wider rather than returning too many
+    price_history = PriceHistory()
+    graph.betting_exchange.markets[3].price_history = price_history
+    for i in range(10):
+        price_history.append(i * 60.0, 50.0 + i)
+    transaction.commit()
+    price_history_max_buckets = Config.price_history_max_buckets
+    Config.price_history_max_buckets = 4
+    try:
+        buckets = ledger_request.get_price_history(ISSUE, 3, 0.0, 600.0,
+                                                   0.001)
+    finally:
+        Config.price_history_max_buckets = price_history_max_buckets
+    assert len(buckets) == 4
+    assert buckets[0][1] == 50.0 and buckets[-1][4] == 59.0
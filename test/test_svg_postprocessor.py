@@ -0,0 +1,62 @@
+# Copyright © 2021 Waleed H. Mebane
+#
+#   This file is part of Allsembly™ Prototype.
+#
+#   Allsembly™ Prototype is free software: you can redistribute it and/or
+#   modify it under the terms of the Lesser GNU General Public License,
+#   version 3, as published by the Free Software Foundation and the
+#   additional terms found in the accompanying file named "LICENSE.txt".
+#
+#   Allsembly™ Prototype is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   Lesser GNU General Public License for more details.
+#
+#   You should have received a copy of the Lesser GNU General Public
+#   License along with Allsembly™ Prototype.  If not, see
+#   <https://www.gnu.org/licenses/>.
+#
+
+from allsembly.svg_postprocessor import postprocess_svg
+
+SVG = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<!-- 0&#45;&gt;a0 -->
+<svg width="62pt" height="44pt" xmlns="http://www.w3.org/2000/svg">
+<g id="node1" class="node">
+<title>7</title>
+<path fill="none" stroke="black" d="M12,-30.75C12,-30.75"/>
+<text x="81.69" y="-69.25">57.1%</text>
+<polygon fill="none" stroke="black" points="8,-36.25 8,-65.5"/>
+<text x="14" y="-46">x &#45; &lt;script&gt;alert(1)]]&gt;&lt;/script&gt;</text>
+</g>
+<g id="node2" class="node">
+<title>a0</title>
+<ellipse fill="none" stroke="black" cx="214.89" cy="-59"/>
+<text x="214.89" y="-54.33">+</text>
+</g>
+</svg>
+""".encode("utf-8")
+
+
+def test_position_nodes_are_made_clickable():
+    svg = postprocess_svg(SVG)
+    assert svg.count('onclick="show_position_details(7);"') == 3
+    assert '<polygon cursor="pointer" pointer-events="visible" ' \
+           'onclick="show_position_details(7);" fill="none"' in svg
+    assert '<text cursor="pointer" onclick="show_position_details(7);" ' \
+           'x="81.69" y="-69.25"><![CDATA[57.1%]]></text>' in svg
+    # argument nodes are not positions
+    assert '<text x="214.89" y="-54.33"><![CDATA[+]]></text>' in svg
+    assert '<path fill="none" stroke="black" d="M12,-30.75C12,-30.75"/>' in svg
+    assert "<!-- 0-&gt;a0 -->" in svg
+
+
+def test_text_is_wrapped_in_cdata():
+    svg = postprocess_svg(SVG)
+    assert "&#45;" not in svg
+    assert "<![CDATA[x - <script>alert(1)]]]]><![CDATA[></script>]]>" in svg
+    assert postprocess_svg(b'<svg><g class="node"><title>7</title><text/>'
+                           b'</g></svg>') == \
+        '<svg><g class="node"><title>7</title><text cursor="pointer" ' \
+        'onclick="show_position_details(7);"/></g></svg>'
+    assert postprocess_svg(b"<svg><text>unterminated</svg>") == ""